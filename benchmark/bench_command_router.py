@@ -0,0 +1,106 @@
+# benchmark/bench_command_router.py
+"""
+指令分发微基准：旧版顺序正则链 vs CommandRouter 查表
+用法：python -m benchmark.bench_command_router [--rounds 20000] [--chat-ratio 0.85]
+"""
+import argparse
+import random
+import re
+import time
+
+from utils.command_router import CommandRouter
+
+# 旧版 main.py 中按顺序尝试的正则
+_LEGACY_PATTERNS = [
+    re.compile(r'\s*/签到\s*', re.IGNORECASE),
+    re.compile(r'\s*/查询积分\s*', re.IGNORECASE),
+    re.compile(r'\s*/清空用户画像\s*', re.IGNORECASE),
+    re.compile(r'\s*/查询用户画像\s*', re.IGNORECASE),
+    re.compile(r'\s*/设置用户画像\s*(.*)', re.IGNORECASE | re.DOTALL),
+    re.compile(r'\s*/查看系统提示词\s*', re.IGNORECASE),
+    re.compile(r'\s*/设置系统提示词\s*(.*)', re.IGNORECASE | re.DOTALL),
+    re.compile(r'\s*(帮助|help|菜单|/帮助)\s*', re.IGNORECASE),
+]
+
+_COMMANDS = [
+    " /签到 ",
+    "/查询积分",
+    "/查询用户画像",
+    "/设置用户画像 我喜欢科幻电影，讨厌香菜",
+    "/设置系统提示词你是一个冷静的学术助手",
+    "/查看系统提示词",
+    "帮助",
+    "HELP",
+]
+
+_CHATS = [
+    "今天天气怎么样呀",
+    "言小糯你好！",
+    "我们来玩个猜数字的小游戏吧，我想一个 1 到 100 的数字",
+    "你还记得我上次说我喜欢什么电影吗？",
+    "/签到 一下",
+    "哈哈哈哈哈哈哈哈哈哈",
+    "帮我想想周末去哪里玩，最好是不太远、人也不多的地方，预算两百以内",
+    "help me",
+]
+
+
+async def _noop(gid: str, uid: str, args: str) -> str:
+    return ""
+
+
+def _build_router() -> CommandRouter:
+    router = CommandRouter()
+    for keyword in ("/签到", "/查询积分", "/清空用户画像", "/查询用户画像", "/查看系统提示词"):
+        router.register(keyword, _noop)
+    router.register("/设置用户画像", _noop, takes_args=True)
+    router.register("/设置系统提示词", _noop, takes_args=True)
+    for keyword in ("帮助", "help", "菜单", "/帮助"):
+        router.register(keyword, _noop)
+    return router
+
+
+def _legacy_match(message: str):
+    msg = message.strip()
+    for pattern in _LEGACY_PATTERNS:
+        if match := pattern.fullmatch(msg):
+            return match
+    return None
+
+
+def _bench(func, messages, rounds: int) -> float:
+    """返回每条消息的平均耗时（纳秒）"""
+    start = time.perf_counter_ns()
+    for _ in range(rounds):
+        for message in messages:
+            func(message)
+    return (time.perf_counter_ns() - start) / (rounds * len(messages))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=20000)
+    parser.add_argument("--chat-ratio", type=float, default=0.85, help="普通聊天消息占比")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    messages = [
+        rng.choice(_CHATS) if rng.random() < args.chat_ratio else rng.choice(_COMMANDS)
+        for _ in range(100)
+    ]
+    router = _build_router()
+
+    # 两种实现的匹配结果必须一致
+    for message in _COMMANDS + _CHATS:
+        assert (_legacy_match(message) is None) == (router.match(message) is None), message
+
+    for name, mix in (("混合", messages), ("仅聊天", _CHATS), ("仅指令", _COMMANDS)):
+        rounds = max(1, args.rounds * len(_CHATS) // len(mix))  # 各组总消息数相同
+        legacy = _bench(_legacy_match, mix, rounds)
+        routed = _bench(router.match, mix, rounds)
+        print(f"{name:<6} 正则链 {legacy:8.1f} ns/条   路由表 {routed:8.1f} ns/条   加速 {legacy / routed:5.2f}x")
+
+
+if __name__ == "__main__":
+    main()
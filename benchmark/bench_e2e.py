@@ -0,0 +1,267 @@
+# benchmark/bench_e2e.py
+"""
+端到端离线压测：驱动 main.handle_user_message 与 ChatService.chat，统计各类消息的延迟与吞吐
+
+依赖的本地替身：
+- LLM：内置假 OpenAI 兼容接口（benchmark/fake_llm.py），可配置首 token 延迟与生成速度；
+  也可用 --llm-base-url 指向其他本地服务
+- Redis：REDIS_CONN_STRING 指向本地 Redis Stack（checkpointer 需要 RediSearch），
+  或 --fakeredis 使用进程内 fakeredis（此时 checkpointer 换成内存版）
+- MySQL：MYSQL_* 指向本地 MySQL / MariaDB，--init-schema 会按 benchmark/schema.sql 建表
+
+用法：
+    python -m benchmark.bench_e2e --concurrency 16 --requests 200 --llm-latency 0.8
+结果保存在 benchmark/results/，并与上一次结果对比（p95 变差超过阈值视为回归）
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_RESULTS_DIR = os.path.join(_ROOT, "benchmark", "results")
+
+# 消息类型 → 第 i 条消息的内容
+_SCENARIOS = {
+    "checkin": lambda i: "/签到",
+    "points": lambda i: "/查询积分",
+    "profile": lambda i: f"/设置用户画像 我喜欢科幻电影，最近在看第 {i} 部",
+    "chat": lambda i: f"言小糯你好呀，今天是我们第 {i} 次聊天～",
+    "chat_service": lambda i: f"陪我聊聊天吧，这是第 {i} 条消息",
+}
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(_SCENARIOS), help="逗号分隔，可选：" + ",".join(_SCENARIOS))
+    parser.add_argument("--requests", type=int, default=200, help="每类消息的请求数")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=500, help="模拟用户数")
+    parser.add_argument("--groups", type=int, default=20, help="模拟群数")
+    parser.add_argument("--llm-base-url", default=None, help="使用已有的 OpenAI 兼容接口，不启动内置假 LLM")
+    parser.add_argument("--llm-port", type=int, default=18080)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="假 LLM 首 token 延迟（秒）")
+    parser.add_argument("--llm-tokens-per-sec", type=float, default=50.0, help="假 LLM 生成速度")
+    parser.add_argument("--fakeredis", action="store_true", help="使用进程内 fakeredis 代替本地 Redis")
+    parser.add_argument("--init-schema", action="store_true", help="压测前按 benchmark/schema.sql 建表")
+    parser.add_argument("--results-dir", default=_RESULTS_DIR)
+    parser.add_argument("--baseline", default=None, help="对比的基线结果文件，缺省为上一次结果")
+    parser.add_argument("--regression-threshold", type=float, default=0.10, help="p95 变差超过该比例视为回归")
+    parser.add_argument("--fail-on-regression", action="store_true", help="出现回归时以非 0 退出")
+    return parser.parse_args()
+
+
+def _configure_environment(args):
+    """必须在导入业务模块之前调用：Constant 与共享客户端在导入时读取配置"""
+    if args.llm_base_url:
+        os.environ["DASHSCOPE_BASE_URL"] = args.llm_base_url
+    else:
+        os.environ["DASHSCOPE_BASE_URL"] = f"http://127.0.0.1:{args.llm_port}/v1"
+    os.environ.setdefault("DASHSCOPE_API_KEY", "bench")
+
+    if args.fakeredis:
+        import fakeredis
+        from fakeredis.aioredis import FakeConnection
+        from redis.asyncio import BlockingConnectionPool
+        from utils import redis_client
+        from utils.constant import Constant
+
+        redis_client._pool = BlockingConnectionPool(
+            connection_class=FakeConnection,
+            server=fakeredis.FakeServer(),
+            max_connections=Constant.REDIS_MAX_CONNECTIONS,
+            decode_responses=True,
+        )
+        redis_client._client = redis_client._InstrumentedRedis(connection_pool=redis_client._pool)
+
+        # fakeredis 不支持 RediSearch，checkpointer 换成内存版
+        from langgraph.checkpoint.memory import InMemorySaver
+        import service.chat_service as chat_service
+
+        class _InMemoryCheckpointer(InMemorySaver):
+            def __init__(self, redis_client=None):
+                super().__init__()
+
+            async def asetup(self):
+                pass
+
+        chat_service.AsyncRedisSaver = _InMemoryCheckpointer
+
+
+def _percentile(values, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+async def _apply_schema(db):
+    with open(os.path.join(_ROOT, "benchmark", "schema.sql"), encoding="utf-8") as f:
+        sql = f.read()
+    async with db._acquire() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(sql)
+            while await cursor.nextset():
+                pass
+
+
+async def _run_scenario(name, handle_message, chat_service, args, run_id) -> dict:
+    make_message = _SCENARIOS[name]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, first_replies = [], []
+    errors = 0
+    first_error = None
+
+    async def one(i: int):
+        nonlocal errors, first_error
+        gid = f"bench{run_id}g{i % args.groups}"
+        uid = f"bench{run_id}u{i % args.users}"
+        message = make_message(i)
+        first_reply_at = None
+        replies = []
+
+        async def reply_func(content: str, seq: int = 1):
+            nonlocal first_reply_at
+            if first_reply_at is None:
+                first_reply_at = time.perf_counter()
+            replies.append(content)
+
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                if name == "chat_service":
+                    await reply_func(await chat_service.chat(groupId=gid, userId=uid, message=message))
+                else:
+                    await handle_message(gid, uid, message, reply_func)
+            except Exception as e:
+                errors += 1
+                first_error = first_error or repr(e)
+                return
+            end = time.perf_counter()
+
+        if any(r in ("抱歉，系统出错了。", "系统初始化失败，请稍后再试。") for r in replies):
+            errors += 1
+            return
+        latencies.append(end - start)
+        first_replies.append((first_reply_at or end) - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "requests": args.requests,
+        "errors": errors,
+        "elapsed_seconds": elapsed,
+        "messages_per_second": len(latencies) / elapsed if elapsed else 0.0,
+        "latency_p50": _percentile(latencies, 0.50),
+        "latency_p95": _percentile(latencies, 0.95),
+        "latency_p99": _percentile(latencies, 0.99),
+        "first_reply_p50": _percentile(first_replies, 0.50),
+        "first_reply_p95": _percentile(first_replies, 0.95),
+        "first_error": first_error,
+    }
+
+
+def _print_results(results: dict):
+    print(f"{'类型':<14}{'成功/总数':>12}{'msg/s':>10}{'p50(ms)':>10}{'p95(ms)':>10}{'p99(ms)':>10}{'首条p50':>10}")
+    for name, r in results.items():
+        done = f"{r['requests'] - r['errors']}/{r['requests']}"
+        print(f"{name:<14}{done:>12}{r['messages_per_second']:>10.1f}"
+              f"{r['latency_p50'] * 1000:>10.1f}{r['latency_p95'] * 1000:>10.1f}"
+              f"{r['latency_p99'] * 1000:>10.1f}{r['first_reply_p50'] * 1000:>10.1f}")
+        if r["first_error"]:
+            print(f"  首个错误：{r['first_error']}")
+
+
+def _compare(results: dict, baseline_path: str, threshold: float) -> bool:
+    """与基线对比，返回是否存在回归"""
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\n对比基线 {os.path.basename(baseline_path)}（{baseline.get('revision')}）：")
+    regressed = False
+    for name, r in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base or not base["latency_p95"]:
+            continue
+        p95_change = r["latency_p95"] / base["latency_p95"] - 1
+        tput_change = (r["messages_per_second"] / base["messages_per_second"] - 1) if base["messages_per_second"] else 0.0
+        flag = ""
+        if p95_change > threshold:
+            regressed = True
+            flag = "  <-- 回归"
+        print(f"  {name:<14} p95 {p95_change:+7.1%}   吞吐 {tput_change:+7.1%}{flag}")
+    return regressed
+
+
+async def _main(args) -> int:
+    import main as bot
+    from mapper.database import Database
+    from mapper.points_ledger import points_ledger
+    from utils.redis_client import close_redis
+
+    runner = None
+    if not args.llm_base_url:
+        from benchmark.fake_llm import start_fake_llm
+        runner = await start_fake_llm(
+            "127.0.0.1", args.llm_port, latency=args.llm_latency, tokens_per_sec=args.llm_tokens_per_sec
+        )
+
+    try:
+        if args.init_schema:
+            await _apply_schema(bot.db)
+
+        run_id = uuid.uuid4().hex[:8]
+        results = {}
+        for name in [s.strip() for s in args.scenarios.split(",") if s.strip()]:
+            if name not in _SCENARIOS:
+                raise SystemExit(f"unknown scenario: {name}")
+            results[name] = await _run_scenario(name, bot.handle_user_message, bot.chatService, args, run_id)
+    finally:
+        await bot.chatService.close(timeout=5)
+        await points_ledger.close()
+        await Database.close()
+        await close_redis()
+        if runner is not None:
+            await runner.cleanup()
+
+    _print_results(results)
+
+    os.makedirs(args.results_dir, exist_ok=True)
+    previous = sorted(glob.glob(os.path.join(args.results_dir, "e2e-*.json")))
+    revision = _git_revision()
+    path = os.path.join(args.results_dir, f"e2e-{datetime.now():%Y%m%d-%H%M%S}-{revision}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "revision": revision,
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "config": {k: v for k, v in vars(args).items() if k not in ("results_dir", "baseline")},
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存：{path}")
+
+    baseline = args.baseline or (previous[-1] if previous else None)
+    if baseline and _compare(results, baseline, args.regression_threshold) and args.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, _ROOT)
+    cli_args = _parse_args()
+    _configure_environment(cli_args)
+    sys.exit(asyncio.run(_main(cli_args)))
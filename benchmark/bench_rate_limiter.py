@@ -0,0 +1,112 @@
+# benchmark/bench_rate_limiter.py
+"""
+限流器自身开销基准：每条消息做一次多级令牌桶检查（Lua 脚本，一次往返）的耗时，
+以同一连接池上的 PING 往返作为基线
+- Redis：默认连接 REDIS_CONN_STRING，或 --fakeredis 使用进程内 fakeredis（只反映脚本与客户端开销）
+用法：python -m benchmark.bench_rate_limiter [--messages 5000] [--concurrency 16] [--users 200] [--fakeredis]
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--groups", type=int, default=20)
+    parser.add_argument("--fakeredis", action="store_true", help="使用进程内 fakeredis 代替本地 Redis")
+    return parser.parse_args()
+
+
+def _use_fakeredis():
+    """必须在导入限流器之前调用：共享客户端在导入时创建"""
+    import fakeredis
+    from fakeredis.aioredis import FakeConnection
+    from redis.asyncio import BlockingConnectionPool
+    from utils import redis_client
+    from utils.constant import Constant
+
+    redis_client._pool = BlockingConnectionPool(
+        connection_class=FakeConnection,
+        server=fakeredis.FakeServer(),
+        max_connections=Constant.REDIS_MAX_CONNECTIONS,
+        decode_responses=True,
+    )
+    redis_client._client = redis_client._InstrumentedRedis(connection_pool=redis_client._pool)
+
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q * len(ordered) + 0.5) - 1))
+    return ordered[index]
+
+
+async def _measure(call, count: int, concurrency: int) -> list:
+    """并发执行 count 次 call(i)，返回每次耗时（秒）"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await call(i)
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(one(i) for i in range(count)))
+    return latencies
+
+
+def _report(name: str, latencies: list, wall: float):
+    print(
+        f"{name:<10} p50 {_percentile(latencies, 0.50) * 1e6:8.1f} µs   "
+        f"p95 {_percentile(latencies, 0.95) * 1e6:8.1f} µs   "
+        f"p99 {_percentile(latencies, 0.99) * 1e6:8.1f} µs   "
+        f"吞吐 {len(latencies) / wall:9.0f} 条/s"
+    )
+
+
+async def _run(args):
+    from utils.rate_limiter import RateLimiter
+    from utils.redis_client import close_redis, get_redis
+
+    # 每次运行使用独立的键前缀下的桶，且容量足够大，只测检查本身的开销
+    run_id = uuid.uuid4().hex[:8]
+    unlimited = (10 ** 9, 10 ** 6)
+    limiter = RateLimiter({
+        f"bench{run_id}": {"user": unlimited, "group": unlimited, "global": unlimited},
+    })
+    kind = f"bench{run_id}"
+    redis = get_redis()
+
+    async def ping(i: int):
+        await redis.ping()
+
+    async def acquire(i: int):
+        await limiter.acquire(kind, f"g{i % args.groups}", f"u{i % args.users}")
+
+    # 预热：加载脚本、建立连接
+    await _measure(acquire, args.concurrency * 2, args.concurrency)
+
+    print(f"消息数 {args.messages}，并发 {args.concurrency}，用户 {args.users}，群 {args.groups}")
+    for name, call in (("PING 基线", ping), ("三级限流", acquire)):
+        start = time.perf_counter()
+        latencies = await _measure(call, args.messages, args.concurrency)
+        _report(name, latencies, time.perf_counter() - start)
+
+    assert limiter.errors == 0, f"限流检查出错 {limiter.errors} 次"
+    await redis.delete(*[key async for key in redis.scan_iter(match=f"*:bench{run_id}:*")])
+    await close_redis()
+
+
+def main():
+    args = _parse_args()
+    if args.fakeredis:
+        _use_fakeredis()
+    asyncio.run(_run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+# benchmark/bench_scaleout.py
+"""
+多进程横向扩展压测：同一批消息分别由 1、2、4… 个 worker 进程（service.shard_worker.ShardWorker）消费，
+比较吞吐与加速比，并检查每个群只由一个 worker 处理
+- 消息处理用合成负载代替真实业务：--cpu-ms 为每条消息的 CPU 开销（构造上下文、序列化等），
+  --io-ms 为等待模型 / 数据库的时间；CPU 部分受 GIL 限制，只有多进程才能扩展
+- 需要真实 Redis（各 worker 进程共享事件流与租约），默认连接 REDIS_CONN_STRING，或用 --redis-url 指定
+用法：python -m benchmark.bench_scaleout [--events 2000] [--groups 200] [--workers 1,2,4] [--cpu-ms 5] [--io-ms 20]
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import signal
+import time
+import uuid
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--workers", default="1,2,4", help="逗号分隔的 worker 进程数")
+    parser.add_argument("--cpu-ms", type=float, default=5.0)
+    parser.add_argument("--io-ms", type=float, default=20.0)
+    parser.add_argument("--redis-url", default=None, help="默认使用 REDIS_CONN_STRING")
+    return parser.parse_args()
+
+
+def _configure(run_id: str):
+    """子进程与主进程共用：每轮使用独立的键前缀，缩短再均衡周期以便快速达到均衡"""
+    from utils.constant import Constant
+
+    Constant.REDIS_SCALEOUT_STREAM_KEY = f"bench:{run_id}:events"
+    Constant.REDIS_SCALEOUT_LEASE_KEY = f"bench:{run_id}:shard"
+    Constant.REDIS_SCALEOUT_WORKERS_KEY = f"bench:{run_id}:workers"
+    Constant.SCALEOUT_LEASE_RENEW_INTERVAL = 0.5
+    return Constant
+
+
+def _burn(cpu_seconds: float, payload: dict):
+    """模拟每条消息的 CPU 开销：反复序列化一段类似对话历史的数据"""
+    deadline = time.process_time() + cpu_seconds
+    while time.process_time() < deadline:
+        json.loads(json.dumps(payload, ensure_ascii=False))
+
+
+def _worker_process(redis_url: str, run_id: str, cpu_ms: float, io_ms: float):
+    os.environ["REDIS_CONN_STRING"] = redis_url
+    os.environ["METRICS_PORT"] = "0"
+    asyncio.run(_worker_main(run_id, cpu_ms / 1000, io_ms / 1000))
+
+
+async def _worker_main(run_id: str, cpu_seconds: float, io_seconds: float):
+    _configure(run_id)
+    from service.shard_worker import ShardWorker
+    from utils.redis_client import close_redis, get_redis
+
+    redis = get_redis()
+    worker_id = f"bench-{os.getpid()}"
+    seen_groups = set()
+    payload = {"messages": [{"role": "user", "content": "今天天气怎么样？" * 8}] * 20}
+
+    async def handle(event: dict):
+        _burn(cpu_seconds, payload)
+        await asyncio.sleep(io_seconds)
+        seen_groups.add(event["gid"])
+        await redis.incr(f"bench:{run_id}:done")
+
+    worker = ShardWorker(worker_id, handle)
+    loop = asyncio.get_running_loop()
+    loop.add_signal_handler(signal.SIGTERM, worker.stop)
+    await worker.run()
+    if seen_groups:
+        await redis.sadd(f"bench:{run_id}:groups:{worker_id}", *seen_groups)
+    await close_redis()
+
+
+async def _wait_balanced(redis, constant, workers: int, timeout: float = 60):
+    """等待所有 worker 上线且分片按公平份额分配完毕"""
+    fair_share = math.ceil(constant.SCALEOUT_SHARDS / workers)
+    keys = [f"{constant.REDIS_SCALEOUT_LEASE_KEY}:{s}" for s in range(constant.SCALEOUT_SHARDS)]
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        live = await redis.zcard(constant.REDIS_SCALEOUT_WORKERS_KEY)
+        owners = await redis.mget(keys)
+        counts = {}
+        for owner in owners:
+            counts[owner] = counts.get(owner, 0) + 1
+        if live == workers and None not in counts and len(counts) == workers and max(counts.values()) <= fair_share:
+            return
+        await asyncio.sleep(0.2)
+    raise TimeoutError(f"{workers} 个 worker 未能在 {timeout} 秒内完成分片分配")
+
+
+async def _round(args, redis_url: str, workers: int) -> dict:
+    run_id = uuid.uuid4().hex[:8]
+    constant = _configure(run_id)
+    from service.shard_worker import event_shard, stream_key
+    from utils.redis_client import get_redis
+
+    redis = get_redis()
+    ctx = multiprocessing.get_context("spawn")
+    processes = [
+        ctx.Process(target=_worker_process, args=(redis_url, run_id, args.cpu_ms, args.io_ms))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        await _wait_balanced(redis, constant, workers)
+
+        start = time.perf_counter()
+        async with redis.pipeline(transaction=False) as pipe:
+            for i in range(args.events):
+                event = {"kind": "group", "gid": f"g{i % args.groups}", "uid": f"u{i}", "msg_id": str(i), "content": "hi"}
+                pipe.xadd(stream_key(event_shard(event)), {"event": json.dumps(event)})
+            await pipe.execute()
+        while int(await redis.get(f"bench:{run_id}:done") or 0) < args.events:
+            await asyncio.sleep(0.01)
+        wall = time.perf_counter() - start
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout=30)
+
+    group_sets = [await redis.smembers(key) async for key in redis.scan_iter(match=f"bench:{run_id}:groups:*")]
+    shared = set()
+    for i, a in enumerate(group_sets):
+        for b in group_sets[i + 1:]:
+            shared |= a & b
+    handled = int(await redis.get(f"bench:{run_id}:done") or 0)
+    await redis.delete(*[key async for key in redis.scan_iter(match=f"bench:{run_id}:*")])
+    return {"workers": workers, "wall": wall, "handled": handled, "shared_groups": len(shared)}
+
+
+async def _run(args, redis_url: str):
+    from utils.redis_client import close_redis
+
+    print(f"消息 {args.events}，群 {args.groups}，每条 CPU {args.cpu_ms} ms + 等待 {args.io_ms} ms，CPU 核数 {os.cpu_count()}")
+    baseline = None
+    for workers in (int(n) for n in args.workers.split(",")):
+        result = await _round(args, redis_url, workers)
+        throughput = result["handled"] / result["wall"]
+        baseline = baseline or throughput
+        print(
+            f"worker {workers:>2}   耗时 {result['wall']:7.2f} s   吞吐 {throughput:8.1f} 条/s   "
+            f"加速比 {throughput / baseline:5.2f}x   被多个 worker 处理的群 {result['shared_groups']}"
+        )
+    await close_redis()
+
+
+def main():
+    args = _parse_args()
+    from utils.constant import Constant
+
+    redis_url = args.redis_url or Constant.REDIS_CONN_STRING
+    # 主进程的共享客户端在导入 redis_client 时按该地址创建，须在导入任何业务模块之前设置
+    Constant.REDIS_CONN_STRING = redis_url
+    asyncio.run(_run(args, redis_url))
+
+
+if __name__ == "__main__":
+    main()
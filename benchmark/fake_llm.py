@@ -0,0 +1,117 @@
+# benchmark/fake_llm.py
+"""
+本地 OpenAI 兼容接口（/v1/chat/completions），用于离线压测，替代 DashScope
+- 支持普通与流式（SSE）响应，返回 usage
+- 可配置首 token 延迟与生成速度
+用法：python -m benchmark.fake_llm --port 18080 --latency 0.8 --tokens-per-sec 40
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+
+from aiohttp import web
+
+_REPLY = "好呀好呀～言小糯收到啦！今天也要元气满满哦，有什么想聊的随时找我呀 (๑•̀ㅂ•́)و✧"
+
+
+class FakeLLM:
+    def __init__(self, latency: float = 0.5, tokens_per_sec: float = 50.0, reply: str = _REPLY):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.reply = reply
+        self.requests = 0
+
+    def _tokens(self, max_tokens: int | None) -> list:
+        # 按字符近似 token
+        tokens = list(self.reply)
+        return tokens[:max_tokens] if max_tokens else tokens
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        model = body.get("model", "fake")
+        tokens = self._tokens(body.get("max_tokens") or body.get("max_completion_tokens"))
+        prompt_tokens = sum(len(str(m.get("content") or "")) for m in body.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": len(tokens),
+            "total_tokens": prompt_tokens + len(tokens),
+        }
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        interval = 1 / self.tokens_per_sec if self.tokens_per_sec > 0 else 0
+
+        await asyncio.sleep(self.latency)
+
+        if not body.get("stream"):
+            await asyncio.sleep(interval * len(tokens))
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens)},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage,
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        def chunk(delta: dict, finish_reason=None, **extra) -> bytes:
+            payload = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                **extra,
+            }
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode()
+
+        await response.write(chunk({"role": "assistant", "content": ""}))
+        for token in tokens:
+            await asyncio.sleep(interval)
+            await response.write(chunk({"content": token}))
+        include_usage = (body.get("stream_options") or {}).get("include_usage")
+        await response.write(chunk({}, "stop", **({"usage": usage} if include_usage else {})))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+
+async def start_fake_llm(host: str, port: int, **kwargs) -> web.AppRunner:
+    """在当前事件循环中启动，返回 runner（结束时调用 runner.cleanup()）"""
+    fake = FakeLLM(**kwargs)
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", fake.handle)
+    app["fake_llm"] = fake
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=18080)
+    parser.add_argument("--latency", type=float, default=0.5, help="首 token 延迟（秒）")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0, help="生成速度")
+    args = parser.parse_args()
+
+    async def serve():
+        await start_fake_llm(args.host, args.port, latency=args.latency, tokens_per_sec=args.tokens_per_sec)
+        print(f"fake LLM listening on http://{args.host}:{args.port}/v1")
+        await asyncio.Event().wait()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+-- benchmark/schema.sql
+-- 本地压测用的 MySQL / MariaDB 表结构（与线上表字段一致）
+-- 用法：mysql -u root -p qqbot_bench < benchmark/schema.sql
+
+CREATE TABLE IF NOT EXISTS user_status (
+    user_id     VARCHAR(64) NOT NULL,
+    group_id    VARCHAR(64) NOT NULL,
+    is_reusable TINYINT(1)  NOT NULL DEFAULT 1,
+    created_at  TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    updated_at  TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, group_id)
+) DEFAULT CHARSET = utf8mb4;
+
+CREATE TABLE IF NOT EXISTS user_points (
+    user_id    VARCHAR(64) NOT NULL,
+    group_id   VARCHAR(64) NOT NULL,
+    points     INT         NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, group_id),
+    KEY idx_group_points (group_id, points),
+    CONSTRAINT fk_user_points_status FOREIGN KEY (user_id, group_id)
+        REFERENCES user_status (user_id, group_id) ON DELETE CASCADE
+) DEFAULT CHARSET = utf8mb4;
+
+CREATE TABLE IF NOT EXISTS checkin_records (
+    user_id           VARCHAR(64) NOT NULL,
+    group_id          VARCHAR(64) NOT NULL,
+    last_checkin_date DATE        NULL,
+    total_days        INT         NOT NULL DEFAULT 0,
+    streak_days       INT         NOT NULL DEFAULT 0,
+    updated_at        TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, group_id)
+) DEFAULT CHARSET = utf8mb4;
+
+CREATE TABLE IF NOT EXISTS user_system_prompts (
+    user_id       VARCHAR(64) NOT NULL,
+    group_id      VARCHAR(64) NOT NULL,
+    system_prompt TEXT        NOT NULL,
+    updated_at    TIMESTAMP   NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, group_id)
+) DEFAULT CHARSET = utf8mb4;
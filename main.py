@@ -1,5 +1,5 @@
 import os
-import re
+import signal
 import botpy
 from botpy import logging, Intents
 from botpy.ext.cog_yaml import read
@@ -8,158 +8,251 @@ from botpy.message import GroupMessage, C2CMessage
 # 导入服务
 from service.user_service import UserService
 from service.chat_service import ChatService
+from service.group_burst import GroupBurstCoalescer
+from service.intent_router import IntentRouter
 
 from mapper.database import Database
+from mapper.points_ledger import points_ledger
+from utils.command_router import CommandRouter
+from utils.constant import Constant
+from utils.dedupe import message_deduper
+from utils.rate_limiter import rate_limiter
+from utils.llm_factory import close_llm_http_client
+from utils.metrics import span, start_metrics_server, stop_metrics_server
+from utils.redis_client import close_redis
 
 # 全局服务实例
 
 db = Database()  # 直接在全局创建数据库实例，供服务使用
 user_service = UserService(db)
 chatService = ChatService()
-
-# 预编译正则（提升高频场景性能）
-_CHECKIN_PATTERN = re.compile(r'\s*/签到\s*', re.IGNORECASE)
-_QUERY_POINTS_PATTERN = re.compile(r'\s*/查询积分\s*', re.IGNORECASE)
-_CLEAR_MEM_PATTERN = re.compile(r'\s*/清空用户画像\s*', re.IGNORECASE)
-_QUERY_MEM_PATTERN = re.compile(r'\s*/查询用户画像\s*', re.IGNORECASE)
-_SET_MEM_PATTERN = re.compile(r'\s*/设置用户画像\s*(.*)', re.IGNORECASE | re.DOTALL)
-_VIEW_PROMPT_PATTERN = re.compile(r'\s*/查看系统提示词\s*', re.IGNORECASE)
-_SET_PROMPT_PATTERN = re.compile(r'\s*/设置系统提示词\s*(.*)', re.IGNORECASE | re.DOTALL)
-_HELP_PATTERN = re.compile(r'\s*(帮助|help|菜单|/帮助)\s*', re.IGNORECASE)
+group_burst = GroupBurstCoalescer(chatService)
 
 _log = logging.get_logger()
 config = read(os.path.join(os.path.dirname(__file__), "config.yaml"))
 
+# 指令路由：各指令处理函数在下方自行注册
+router = CommandRouter()
 
 
-class MyClient(botpy.Client):
+# 签到
+@router.command("/签到")
+async def _cmd_checkin(gid: str, uid: str, args: str) -> str:
+    return await user_service.handle_checkin(gid, uid)
 
-    async def reply_group(self, group_openid: str, msg_id: str, content: str):
-        await self.api.post_group_message(
-            group_openid=group_openid,
-            msg_id=msg_id,
-            msg_type=0,
-            content=content
-        )
 
-    async def reply_c2c(self, openid: str, msg_id: str, content: str):
-        await self.api.post_c2c_message(
-            openid=openid,
-            msg_id=msg_id,
-            msg_type=0,
-            content=content
-        )
+# 查询积分
+@router.command("/查询积分")
+async def _cmd_query_points(gid: str, uid: str, args: str) -> str:
+    return await user_service.handle_query_points(gid, uid)
+
+
+# 积分排行榜
+@router.command("/排行榜")
+async def _cmd_leaderboard(gid: str, uid: str, args: str) -> str:
+    return await user_service.handle_leaderboard(gid, uid)
+
+
+# 清空用户画像
+@router.command("/清空用户画像")
+async def _cmd_clear_memory(gid: str, uid: str, args: str) -> str:
+    return await user_service.clearUserLongMemory(gid, uid)
+
+
+# 查询用户画像
+@router.command("/查询用户画像")
+async def _cmd_query_memory(gid: str, uid: str, args: str) -> str:
+    return await user_service.queryUserLongMemory(gid, uid)
+
+
+# 设置用户画像
+@router.command("/设置用户画像", takes_args=True)
+async def _cmd_set_memory(gid: str, uid: str, args: str) -> str:
+    if not args:
+        return "请提供要设置的用户画像内容，例如：\n/设置用户画像 我喜欢科幻电影，讨厌香菜"
+    return await user_service.updateUserLongMemory(gid, uid, args)
+
+
+# 查看系统提示词
+@router.command("/查看系统提示词")
+async def _cmd_view_prompt(gid: str, uid: str, args: str) -> str:
+    return await user_service.getSystemPromptForUser(gid, uid)
+
+
+# 设置系统提示词
+@router.command("/设置系统提示词", takes_args=True)
+async def _cmd_set_prompt(gid: str, uid: str, args: str) -> str:
+    if not args:
+        return "请提供要设置的系统提示词内容，例如：\n/设置系统提示词 你是一个冷静的学术助手，禁止使用颜文字"
+    return await user_service.updateUserSystemPrompt(gid, uid, args)
+
+
+# 帮助
+@router.command("帮助", "help", "菜单", "/帮助")
+async def _cmd_help(gid: str, uid: str, args: str) -> str:
+    return await user_service.handle_help()
+
+
+async def handle_user_message(gid: str, uid: str, raw_msg: str, reply_func):
+    """
+    统一处理用户指令（群聊 or 私聊），单进程模式与 supervisor 的 worker 进程共用
+    :param gid: group id（私聊时为 "PRIVATE"）
+    :param uid: user id
+    :param raw_msg: 原始消息内容
+    :param reply_func: 异步回复函数 reply_func(内容, msg_seq=1)，如 lambda r, seq=1: self.reply_group(...)
+    """
+    with span("message"):
+        await _dispatch_user_message(gid, uid, raw_msg, reply_func)
 
-    async def on_ready(self):
-        _log.info(f"「{self.robot.name}」已上线！")
 
-    async def _handle_user_message(self, gid: str, uid: str, raw_msg: str, reply_func):
-        """
-        统一处理用户指令（群聊 or 私聊）
-        :param gid: group id（私聊时为 "PRIVATE"）
-        :param uid: user id
-        :param raw_msg: 原始消息内容
-        :param reply_func: 异步回复函数，如 lambda r: self.reply_group(...)
-        """
-        msg = raw_msg.strip()
-
-        try:
+async def _dispatch_user_message(gid: str, uid: str, raw_msg: str, reply_func):
+    msg = raw_msg.strip()
+    route = router.match(msg)
+
+    # 限流在 init_user 之前：超限消息不访问 MySQL，也不调用 LLM
+    # 能走意图快速路由的消息不经过模型，与指令共用 "command" 桶
+    fast_path = route or (Constant.INTENT_ROUTER_ENABLED and IntentRouter.classify(msg))
+    group_id = None if gid == "PRIVATE" else gid
+    level = await rate_limiter.acquire("command" if fast_path else "chat", group_id, uid)
+    if level is not None:
+        _log.info(f"限流 level={level} gid={gid} uid={uid}")
+        if reply := rate_limiter.limited_reply(level, group_id, uid):
+            await reply_func(reply)
+        return
+
+    try:
+        with span("init_user"):
             await db.init_user(uid, gid)
-        except Exception as e:
-            _log.error(f"初始化用户失败 (gid={gid}, uid={uid}): {e}", exc_info=True)
-            await reply_func("系统初始化失败，请稍后再试。")
-            return
+    except Exception as e:
+        _log.error(f"初始化用户失败 (gid={gid}, uid={uid}): {e}", exc_info=True)
+        await reply_func("系统初始化失败，请稍后再试。")
+        return
+
+
+    try:
+        # 指令：查表分发
+        if route:
+            handler, args = route
+            with span("command"):
+                reply = await handler(gid, uid, args)
+            await reply_func(reply)
+
+        # AI 回复
+        elif Constant.CHAT_STREAMING_ENABLED:
+            with span("chat"):
+                await chatService.chat_stream(reply_func, groupId=gid, userId=uid, message=raw_msg)
 
+        # 群聊突发合并：与窗口内的其他 @ 消息一起处理，各自用自己的 msg_id 回复
+        elif group_burst.enabled and gid != "PRIVATE":
+            with span("chat"):
+                ai_reply = await group_burst.submit(gid, uid, raw_msg)
+            await reply_func(ai_reply)
 
-        try:
-            # 签到
-            if _CHECKIN_PATTERN.fullmatch(msg):
-                reply = await user_service.handle_checkin(gid, uid)  # TODO: 若 service 异步化，改为 await
-                await reply_func(reply)
-                return
-
-            # 查询积分
-            elif _QUERY_POINTS_PATTERN.fullmatch(msg):
-                reply = await user_service.handle_query_points(gid, uid)
-                await reply_func(reply)
-                return
-
-            # 清空用户画像
-            elif _CLEAR_MEM_PATTERN.fullmatch(msg):
-                reply = await user_service.clearUserLongMemory(gid, uid)
-                await reply_func(reply)
-                return
-
-            # 查询用户画像
-            elif _QUERY_MEM_PATTERN.fullmatch(msg):
-                reply = await user_service.queryUserLongMemory(gid, uid)
-                await reply_func(reply)
-                return
-
-            # 设置用户画像
-            elif match := _SET_MEM_PATTERN.fullmatch(msg):
-                content_param = match.group(1).strip()
-                if not content_param:
-                    reply = "请提供要设置的用户画像内容，例如：\n/设置用户画像 我喜欢科幻电影，讨厌香菜"
-                else:
-                    reply = await user_service.updateUserLongMemory(gid, uid, content_param)
-                await reply_func(reply)
-                return
-
-            # 查看系统提示词
-            elif _VIEW_PROMPT_PATTERN.fullmatch(msg):
-                reply = await user_service.getSystemPromptForUser(gid, uid)
-                await reply_func(reply)
-                return
-
-            # 设置系统提示词
-            elif match := _SET_PROMPT_PATTERN.fullmatch(msg):
-                content_param = match.group(1).strip()
-                if not content_param:
-                    reply = "请提供要设置的系统提示词内容，例如：\n/设置系统提示词 你是一个冷静的学术助手，禁止使用颜文字"
-                else:
-                    reply = await user_service.updateUserSystemPrompt(gid, uid, content_param)
-                await reply_func(reply)
-                return
-
-            # 帮助
-            elif _HELP_PATTERN.fullmatch(msg):
-                reply = await user_service.handle_help()
-                await reply_func(reply)
-                return
-
-            # AI 回复
-            else:
+        else:
+            with span("chat"):
                 ai_reply = await chatService.chat(groupId=gid, userId=uid, message=raw_msg)
-                await reply_func(ai_reply)
+            await reply_func(ai_reply)
+
+    except Exception as e:
+        _log.error(f"处理用户消息出错 (gid={gid}, uid={uid}): {e}", exc_info=True)
+        await reply_func(Constant.CHAT_ERROR_REPLY)
+
+
+_shutdown_done = False
+
+
+async def shutdown():
+    """
+    退出清理，单进程模式与 supervisor 的 worker 进程共用（重复调用无副作用）
+    等待后台摘要完成（超时未完成的消息放回临时记忆列表）、刷完积分流水，再关闭各连接池
+    """
+    global _shutdown_done
+    if _shutdown_done:
+        return
+    _shutdown_done = True
+    _log.info("正在退出，等待后台任务完成")
+    try:
+        await chatService.close(Constant.SUMMARY_SHUTDOWN_TIMEOUT)
+    except Exception as e:
+        _log.error(f"等待后台摘要完成失败: {e}", exc_info=True)
+    try:
+        await points_ledger.close()
+    except Exception as e:
+        _log.error(f"积分流水刷盘失败，剩余流水将在下次启动后刷盘: {e}", exc_info=True)
+    finally:
+        await stop_metrics_server()
+        await Database.close()
+        await close_llm_http_client()
+        await close_redis()
 
-        except Exception as e:
-            _log.error(f"处理用户消息出错 (gid={gid}, uid={uid}): {e}", exc_info=True)
-            await reply_func("抱歉，系统出错了。")
+
+class MyClient(botpy.Client):
+
+    async def reply_group(self, group_openid: str, msg_id: str, content: str, msg_seq: int = 1):
+        with span("send"):
+            await self.api.post_group_message(
+                group_openid=group_openid,
+                msg_id=msg_id,
+                msg_type=0,
+                content=content,
+                msg_seq=msg_seq
+            )
+
+    async def reply_c2c(self, openid: str, msg_id: str, content: str, msg_seq: int = 1):
+        with span("send"):
+            await self.api.post_c2c_message(
+                openid=openid,
+                msg_id=msg_id,
+                msg_type=0,
+                content=content,
+                msg_seq=msg_seq
+            )
+
+    async def close(self):
+        # 连接正常结束时 botpy 会调用 close
+        await shutdown()
+        await super().close()
+
+    async def on_ready(self):
+        _log.info(f"「{self.robot.name}」已上线！")
+        await start_metrics_server()
+        await chatService.warm_up()
 
     async def on_group_at_message_create(self, message: GroupMessage):
         gid = message.group_openid
         uid = message.author.member_openid
         content = message.content or ""
+        # 网关重连后可能重复投递，同一条消息只处理一次
+        if not await message_deduper.first_seen(message.id):
+            _log.info(f"忽略重复投递的群消息 {message.id}")
+            return
         _log.info(f"处理群{gid}用户{uid}的消息：{content}")
 
-        await self._handle_user_message(
+        await handle_user_message(
             gid, uid, content,
-            lambda r: self.reply_group(gid, message.id, r)
+            lambda r, seq=1: self.reply_group(gid, message.id, r, seq)
         )
 
     async def on_c2c_message_create(self, message: C2CMessage):
         uid = message.author.user_openid
         content = message.content or ""
+        if not await message_deduper.first_seen(message.id):
+            _log.info(f"忽略重复投递的私聊消息 {message.id}")
+            return
         _log.info(f"处理私聊用户{uid}的消息：{content}")
 
-        await self._handle_user_message(
+        await handle_user_message(
             "PRIVATE", uid, content,
-            lambda r: self.reply_c2c(uid, message.id, r)
+            lambda r, seq=1: self.reply_c2c(uid, message.id, r, seq)
         )
 
 
 if __name__ == "__main__":
+    # SIGTERM 与 Ctrl+C 一样中断 client.run，随后在同一事件循环中完成退出清理
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
     intents = Intents(public_messages=True)
     client = MyClient(intents=intents)
-    client.run(appid=config["appid"], secret=config["secret"])
\ No newline at end of file
+    try:
+        client.run(appid=config["appid"], secret=config["secret"])
+    finally:
+        client.loop.run_until_complete(shutdown())
\ No newline at end of file
@@ -1,12 +1,127 @@
 # mapper/database.py
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
 import aiomysql
 import os
-from datetime import date
+from datetime import date, timedelta
 from dotenv import load_dotenv
 
+from mapper.leaderboard import leaderboard
+from utils.cache import LRUCache
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+from utils.redis_client import get_redis
+
 load_dotenv()
 
 
+class _PoolRegistry:
+    """
+    进程级 MySQL 连接池注册表
+    - 相同连接参数的 Database 实例共享同一个连接池，避免每次 Database() 都重新握手、泄漏连接池
+    - 记录连接池饱和度指标，便于根据线上数据调整 min/max
+    """
+
+    def __init__(self):
+        self._pools = {}
+        self._lock = asyncio.Lock()
+        self._stats = {}
+
+    async def get_pool(self, key: tuple, **conn_kwargs) -> aiomysql.Pool:
+        pool = self._pools.get(key)
+        if pool is not None and not pool.closed:
+            return pool
+
+        async with self._lock:
+            pool = self._pools.get(key)
+            if pool is None or pool.closed:
+                pool = await aiomysql.create_pool(
+                    minsize=Constant.MYSQL_POOL_MINSIZE,
+                    maxsize=Constant.MYSQL_POOL_MAXSIZE,
+                    pool_recycle=Constant.MYSQL_POOL_RECYCLE,
+                    **conn_kwargs,
+                )
+                self._pools[key] = pool
+                self._stats.setdefault(key, {
+                    "acquired": 0,          # 累计借出次数
+                    "waited": 0,            # 借出时连接池已满、需要排队的次数
+                    "wait_time_total": 0.0, # 累计排队耗时（秒）
+                    "wait_time_max": 0.0,   # 最长一次排队耗时（秒）
+                    "in_use_peak": 0,       # 同时借出连接数峰值
+                    "pinged": 0,            # 空闲过久后借出前的健康检查次数
+                })
+        return pool
+
+    @asynccontextmanager
+    async def acquire(self, key: tuple, pool: aiomysql.Pool):
+        """借出连接并记录饱和度指标；空闲过久的连接先 ping 一次（自动重连）"""
+        stats = self._stats[key]
+        saturated = pool.freesize == 0 and pool.size >= pool.maxsize
+        start = time.perf_counter()
+        async with pool.acquire() as conn:
+            waited = time.perf_counter() - start
+            stats["acquired"] += 1
+            if saturated:
+                stats["waited"] += 1
+                stats["wait_time_total"] += waited
+                stats["wait_time_max"] = max(stats["wait_time_max"], waited)
+            stats["in_use_peak"] = max(stats["in_use_peak"], pool.size - pool.freesize)
+
+            idle = Constant.MYSQL_POOL_PING_IDLE
+            if idle >= 0 and asyncio.get_running_loop().time() - conn.last_usage > idle:
+                stats["pinged"] += 1
+                await conn.ping(reconnect=True)
+            yield conn
+
+    def stats(self) -> list:
+        """返回每个连接池的当前状态与累计指标"""
+        result = []
+        for key, pool in self._pools.items():
+            result.append({
+                "host": key[0],
+                "port": key[1],
+                "db": key[3],
+                "size": pool.size,
+                "free": pool.freesize,
+                "in_use": pool.size - pool.freesize,
+                "minsize": pool.minsize,
+                "maxsize": pool.maxsize,
+                **self._stats[key],
+            })
+        return result
+
+    async def close_all(self):
+        """关闭所有连接池（应在应用退出时调用）"""
+        async with self._lock:
+            pools = list(self._pools.values())
+            self._pools.clear()
+        for pool in pools:
+            pool.close()
+            await pool.wait_closed()
+
+
+_registry = _PoolRegistry()
+
+
+def _collect_pool_metrics():
+    for stats in _registry.stats():
+        labels = {"host": stats["host"], "port": stats["port"], "db": stats["db"]}
+        yield from stats_samples(
+            "qqbot_mysql_pool", stats, labels,
+            counters=("acquired", "waited", "wait_time_total", "pinged"),
+        )
+
+
+registry.register_collector(_collect_pool_metrics)
+
+# 已初始化用户缓存：(user_id, group_id) → True，命中后 init_user 不再访问 MySQL
+_known_users = LRUCache(Constant.KNOWN_USER_CACHE_SIZE)
+# Redis 集合作为第二层，进程重启后仍有效、多进程共享
+_redis_client = get_redis()
+
+
 class Database:
     def __init__(self):
         self.host = os.getenv("MYSQL_HOST")
@@ -14,31 +129,48 @@ class Database:
         self.user = os.getenv("MYSQL_USER")
         self.password = os.getenv("MYSQL_PASSWORD")
         self.database = os.getenv("MYSQL_DATABASE")
-        self._pool = None  # 连接池将在首次使用或显式初始化时创建
+        # 连接池由 _registry 按连接参数在进程内共享，首次使用时创建
+        self._pool_key = (self.host, self.port, self.user, self.database)
 
     async def _get_pool(self):
-        """获取连接池（单例模式）"""
-        if self._pool is None:
-            self._pool = await aiomysql.create_pool(
-                host=self.host,
-                port=self.port,
-                user=self.user,
-                password=self.password,
-                db=self.database,
-                charset='utf8mb4',
-                autocommit=True,
-                minsize=1,
-                maxsize=10,
-            )
-        return self._pool
-
-    async def close(self):
-        """关闭连接池（应在应用退出时调用）"""
-        if self._pool:
-            self._pool.close()
-            await self._pool.wait_closed()
-
-    from datetime import date
+        """获取进程级共享连接池"""
+        return await _registry.get_pool(
+            self._pool_key,
+            host=self.host,
+            port=self.port,
+            user=self.user,
+            password=self.password,
+            db=self.database,
+            charset='utf8mb4',
+            autocommit=True,
+        )
+
+    @asynccontextmanager
+    async def _acquire(self):
+        """从共享连接池借出连接（带饱和度统计与空闲健康检查）"""
+        pool = await self._get_pool()
+        async with _registry.acquire(self._pool_key, pool) as conn:
+            yield conn
+
+    async def ping(self) -> bool:
+        """健康检查：借出一个连接并 ping 数据库"""
+        try:
+            async with self._acquire() as conn:
+                await conn.ping(reconnect=True)
+            return True
+        except Exception as e:
+            print(f"MySQL ping error: {e}")
+            return False
+
+    @staticmethod
+    def pool_stats() -> list:
+        """连接池饱和度指标（size/free/in_use/排队次数与耗时等）"""
+        return _registry.stats()
+
+    @staticmethod
+    async def close():
+        """关闭进程内所有共享连接池（应在应用退出时调用）"""
+        await _registry.close_all()
 
     async def init_user(self, user_id: str, group_id: str):
         """
@@ -46,28 +178,42 @@ class Database:
         - user_status: is_reusable = True
         - user_points: points = 0
         - checkin_records: total_days=0, streak_days=0, last_checkin_date=NULL
+        已初始化的用户先查进程内 LRU，再查 Redis 集合，命中则不访问 MySQL；
+        新用户的三条 INSERT IGNORE 合并为一次往返。
         """
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        key = (user_id, group_id)
+        if key in _known_users:
+            return
+
+        member = f"{group_id}:{user_id}"
+        if Constant.KNOWN_USER_REDIS_ENABLED:
+            try:
+                if await _redis_client.sismember(Constant.REDIS_KNOWN_USERS_KEY, member):
+                    _known_users.set(key, True)
+                    return
+            except Exception as e:
+                print(f"Known user cache lookup error: {e}")
+
+        async with self._acquire() as conn:
             async with conn.cursor() as cursor:
-                # 初始化 user_status
                 await cursor.execute("""
                     INSERT IGNORE INTO user_status (user_id, group_id, is_reusable)
-                    VALUES (%s, %s, %s)
-                """, (user_id, group_id, 1))
-
-                # 初始化 user_points
-                await cursor.execute("""
+                    VALUES (%(uid)s, %(gid)s, 1);
                     INSERT IGNORE INTO user_points (user_id, group_id, points)
-                    VALUES (%s, %s, %s)
-                """, (user_id, group_id, 0))
-
-                # 初始化 checkin_records
-                await cursor.execute("""
+                    VALUES (%(uid)s, %(gid)s, 0);
                     INSERT IGNORE INTO checkin_records 
                         (user_id, group_id, last_checkin_date, total_days, streak_days)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (user_id, group_id, None, 0, 0))
+                    VALUES (%(uid)s, %(gid)s, NULL, 0, 0);
+                """, {"uid": user_id, "gid": group_id})
+                while await cursor.nextset():
+                    pass
+
+        _known_users.set(key, True)
+        if Constant.KNOWN_USER_REDIS_ENABLED:
+            try:
+                await _redis_client.sadd(Constant.REDIS_KNOWN_USERS_KEY, member)
+            except Exception as e:
+                print(f"Known user cache update error: {e}")
 
     # ========================
     # Table: checkin_records
@@ -75,8 +221,7 @@ class Database:
 
     async def get_checkin_record(self, user_id: str, group_id: str):
         """获取用户的签到记录（含累计、连续天数）"""
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 sql = """
                     SELECT last_checkin_date, total_days, streak_days
@@ -89,9 +234,8 @@ class Database:
     async def add_or_update_checkin(self, user_id: str, group_id: str, checkin_date: date, total_days: int,
                                     streak_days: int):
         """插入或更新签到记录"""
-        pool = await self._get_pool()
         try:
-            async with pool.acquire() as conn:
+            async with self._acquire() as conn:
                 async with conn.cursor() as cursor:
                     sql = """
                         INSERT INTO checkin_records 
@@ -109,14 +253,102 @@ class Database:
             print(f"Update checkin record error: {e}")
             return False
 
+    async def checkin(self, user_id: str, group_id: str, today: date) -> dict:
+        """
+        原子签到：一次往返、一个事务内完成
+        - 锁定签到记录（不存在则创建），判断今日是否已签到
+        - 更新累计/连续天数，按 CHECKIN_POINTS + STREAK_BONUS 发放积分
+        - 返回签到结果与最新积分
+        并发重复签到由 checkin_records 行锁串行化，只有第一个请求会发放积分。
+        :return: {"checked_in", "total_days", "streak_days", "bonus", "points"}
+        """
+        params = {
+            "uid": user_id,
+            "gid": group_id,
+            "today": today,
+            "yesterday": today - timedelta(days=1),
+            "base": Constant.CHECKIN_POINTS,
+        }
+        bonus_cases = []
+        for i, (days, extra) in enumerate(Constant.STREAK_BONUS.items()):
+            params[f"bonus_days_{i}"] = days
+            params[f"bonus_extra_{i}"] = extra
+            bonus_cases.append(f"WHEN %(bonus_days_{i})s THEN %(bonus_extra_{i})s")
+        bonus_sql = f"CASE c.streak_days {' '.join(bonus_cases)} ELSE 0 END" if bonus_cases else "0"
+
+        # 先以 ON DUPLICATE KEY UPDATE 拿到签到记录的排他锁，避免并发 INSERT IGNORE + FOR UPDATE 死锁
+        sql = f"""
+            START TRANSACTION;
+            INSERT INTO checkin_records
+                (user_id, group_id, last_checkin_date, total_days, streak_days)
+            VALUES (%(uid)s, %(gid)s, NULL, 0, 0)
+            ON DUPLICATE KEY UPDATE user_id = user_id;
+            SELECT last_checkin_date INTO @prev_checkin_date
+            FROM checkin_records
+            WHERE user_id = %(uid)s AND group_id = %(gid)s
+            FOR UPDATE;
+            SET @checked_in = (@prev_checkin_date IS NULL OR @prev_checkin_date < %(today)s);
+            INSERT INTO user_status (user_id, group_id, is_reusable)
+            VALUES (%(uid)s, %(gid)s, 1)
+            ON DUPLICATE KEY UPDATE
+                is_reusable = VALUES(is_reusable),
+                updated_at = CURRENT_TIMESTAMP;
+            INSERT IGNORE INTO user_points (user_id, group_id, points)
+            VALUES (%(uid)s, %(gid)s, 0);
+            UPDATE checkin_records
+            SET streak_days = IF(@prev_checkin_date = %(yesterday)s, streak_days + 1, 1),
+                total_days = total_days + 1,
+                last_checkin_date = %(today)s
+            WHERE user_id = %(uid)s AND group_id = %(gid)s AND @checked_in;
+            UPDATE user_points p
+            JOIN checkin_records c ON c.user_id = p.user_id AND c.group_id = p.group_id
+            SET p.points = p.points + %(base)s + {bonus_sql}
+            WHERE p.user_id = %(uid)s AND p.group_id = %(gid)s AND @checked_in;
+            SELECT @checked_in AS checked_in, c.total_days, c.streak_days, p.points
+            FROM checkin_records c
+            JOIN user_points p ON p.user_id = c.user_id AND p.group_id = c.group_id
+            WHERE c.user_id = %(uid)s AND c.group_id = %(gid)s;
+            COMMIT;
+        """
+        async with self._acquire() as conn:
+            try:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    await cursor.execute(sql, params)
+                    row = await self._last_result_row(cursor)
+            except Exception:
+                await conn.rollback()
+                raise
+
+        checked_in = bool(row["checked_in"])
+        streak_days = row["streak_days"]
+        bonus = Constant.STREAK_BONUS.get(streak_days, 0) if checked_in else 0
+        if checked_in:
+            await leaderboard.incr(user_id, group_id, Constant.CHECKIN_POINTS + bonus)
+        return {
+            "checked_in": checked_in,
+            "total_days": row["total_days"],
+            "streak_days": streak_days,
+            "bonus": bonus,
+            "points": row["points"],
+        }
+
+    @staticmethod
+    async def _last_result_row(cursor):
+        """多语句执行时遍历全部结果集，返回最后一个 SELECT 的首行"""
+        row = None
+        while True:
+            if cursor.description:
+                row = await cursor.fetchone()
+            if not await cursor.nextset():
+                return row
+
     # ========================
     # Table: user_status
     # ========================
 
     async def create_or_update_user_status(self, user_id: str, group_id: str, is_reusable: bool = True):
         """插入或更新用户状态（ON DUPLICATE KEY UPDATE）"""
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.cursor() as cursor:
                 sql = """
                     INSERT INTO user_status (user_id, group_id, is_reusable)
@@ -129,8 +361,7 @@ class Database:
 
     async def get_user_status(self, user_id: str, group_id: str):
         """获取用户状态"""
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 sql = "SELECT * FROM user_status WHERE user_id = %s AND group_id = %s"
                 await cursor.execute(sql, (user_id, group_id))
@@ -138,8 +369,7 @@ class Database:
 
     async def update_user_status(self, user_id: str, group_id: str, is_reusable: bool):
         """更新用户状态（也可用 create_or_update_user_status）"""
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.cursor() as cursor:
                 sql = "UPDATE user_status SET is_reusable = %s WHERE user_id = %s AND group_id = %s"
                 affected = await cursor.execute(sql, (int(is_reusable), user_id, group_id))
@@ -147,8 +377,10 @@ class Database:
 
     async def delete_user_status(self, user_id: str, group_id: str):
         """删除用户状态（会级联删除 user_points）"""
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        _known_users.pop((user_id, group_id))
+        if Constant.KNOWN_USER_REDIS_ENABLED:
+            await _redis_client.srem(Constant.REDIS_KNOWN_USERS_KEY, f"{group_id}:{user_id}")
+        async with self._acquire() as conn:
             async with conn.cursor() as cursor:
                 sql = "DELETE FROM user_status WHERE user_id = %s AND group_id = %s"
                 affected = await cursor.execute(sql, (user_id, group_id))
@@ -160,44 +392,177 @@ class Database:
 
     async def get_user_points(self, user_id: str, group_id: str):
         """获取用户当前积分"""
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 sql = "SELECT points FROM user_points WHERE user_id = %s AND group_id = %s"
                 await cursor.execute(sql, (user_id, group_id))
                 result = await cursor.fetchone()
                 return result['points'] if result else None
 
-    async def add_user_points(self, user_id: str, group_id: str, delta: int):
-        """增加/减少用户积分（支持负数）"""
-        # 显式初始化用户状态（更清晰）
-        await self.create_or_update_user_status(user_id, group_id)
+    async def apply_points_delta(self, user_id: str, group_id: str, delta: int,
+                                 floor: int | None = 0) -> int | None:
+        """
+        原子地增加/减少积分并返回变更后的余额（单条语句、一次往返）
+        - floor: 变更后余额的下限，不满足则不修改；None 表示不限制
+        - floor >= 0 时余额通过 LAST_INSERT_ID(expr) 随 UPDATE 的 OK 包一起返回，无需再 SELECT；
+          LAST_INSERT_ID 按无符号 64 位保存，余额可能为负（floor 为 None 或负数）时改为在同一事务中回读
+        :return: 变更后的余额；余额不足或用户没有积分记录时返回 None
+        """
+        if delta == 0:
+            # 值未变化时 UPDATE 的影响行数为 0，直接查询余额
+            points = await self.get_user_points(user_id, group_id)
+            return points if points is not None and (floor is None or points >= floor) else None
 
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
-            async with conn.cursor() as cursor:
-                sql = """
-                    UPDATE user_points
-                    SET points = points + %s
-                    WHERE user_id = %s AND group_id = %s
-                """
-                affected = await cursor.execute(sql, (delta, user_id, group_id))
-                return affected > 0
+        sql = """
+            UPDATE user_points
+            SET points = LAST_INSERT_ID(points + %s)
+            WHERE user_id = %s AND group_id = %s
+        """
+        args = [delta, user_id, group_id]
+        if floor is not None:
+            sql += " AND points + %s >= %s"
+            args += [delta, floor]
+
+        async with self._acquire() as conn:
+            if floor is not None and floor >= 0:
+                async with conn.cursor() as cursor:
+                    affected = await cursor.execute(sql, args)
+                    new_points = cursor.lastrowid if affected > 0 else None
+            else:
+                try:
+                    await conn.begin()
+                    async with conn.cursor() as cursor:
+                        affected = await cursor.execute(sql, args)
+                        new_points = None
+                        if affected > 0:
+                            await cursor.execute(
+                                "SELECT points FROM user_points WHERE user_id = %s AND group_id = %s",
+                                (user_id, group_id),
+                            )
+                            new_points = (await cursor.fetchone())[0]
+                    await conn.commit()
+                except Exception:
+                    await conn.rollback()
+                    raise
+
+        if new_points is not None:
+            await leaderboard.incr(user_id, group_id, delta)
+        return new_points
+
+    async def add_user_points(self, user_id: str, group_id: str, delta: int):
+        """增加/减少用户积分（支持负数，不检查余额）"""
+        return await self.apply_points_delta(user_id, group_id, delta, floor=None) is not None
 
     async def set_user_points(self, user_id: str, group_id: str, points: int):
         """直接设置用户积分"""
-        await self.init_user_points(user_id, group_id)
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        await self.init_user(user_id, group_id)
+        async with self._acquire() as conn:
             async with conn.cursor() as cursor:
                 sql = "UPDATE user_points SET points = %s WHERE user_id = %s AND group_id = %s"
                 await cursor.execute(sql, (points, user_id, group_id))
+        await leaderboard.set(user_id, group_id, points)
+
+    async def iter_user_points(self, group_id: str | None = None, batch_size: int = 1000):
+        """
+        流式读取积分（服务端游标，不会把整张表读入内存），每次产出一批 [(group_id, user_id, points), ...]
+        :param group_id: 只读取指定群，None 为全部
+        """
+        sql = "SELECT group_id, user_id, points FROM user_points"
+        args = ()
+        if group_id is not None:
+            sql += " WHERE group_id = %s"
+            args = (group_id,)
+
+        async with self._acquire() as conn:
+            async with conn.cursor(aiomysql.SSCursor) as cursor:
+                await cursor.execute(sql, args)
+                while rows := await cursor.fetchmany(batch_size):
+                    yield rows
+
+    # ========================
+    # Table: points_ledger
+    # ========================
+
+    async def ensure_points_ledger_table(self):
+        """创建积分流水审计表（不存在时）；旧版表缺少 entry_id / flush_id 时补齐"""
+        async with self._acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS points_ledger (
+                        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                        entry_id CHAR(32) NULL,
+                        flush_id CHAR(32) NULL,
+                        user_id VARCHAR(64) NOT NULL,
+                        group_id VARCHAR(64) NOT NULL,
+                        delta INT NOT NULL,
+                        reason VARCHAR(255) NOT NULL DEFAULT '',
+                        created_at DATETIME(3) NOT NULL,
+                        UNIQUE KEY uk_entry (entry_id),
+                        KEY idx_flush (flush_id),
+                        KEY idx_user_group (user_id, group_id, created_at)
+                    ) DEFAULT CHARSET = utf8mb4
+                """)
+                await cursor.execute("""
+                    SELECT COUNT(*) FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'points_ledger' AND COLUMN_NAME = 'entry_id'
+                """)
+                (has_entry_id,) = await cursor.fetchone()
+                if not has_entry_id:
+                    await cursor.execute("""
+                        ALTER TABLE points_ledger
+                            ADD COLUMN entry_id CHAR(32) NULL AFTER id,
+                            ADD COLUMN flush_id CHAR(32) NULL AFTER entry_id,
+                            ADD UNIQUE KEY uk_entry (entry_id),
+                            ADD KEY idx_flush (flush_id)
+                    """)
+
+    async def apply_points_ledger(self, rows: list, flush_id: str) -> int:
+        """
+        在一个事务中批量写入积分流水并更新余额（幂等）
+        - 流水按 entry_id 去重（INSERT IGNORE），同一批流水重复刷盘不会重复加分
+        - 余额只按本次真正插入的行（flush_id 相同）累加；没有积分记录的用户先补齐
+          user_status（外键）再插入 user_points，积分不会因缺少记录被丢弃
+        :param rows: [(entry_id, user_id, group_id, delta, reason, created_at), ...]
+        :param flush_id: 本次刷盘的唯一标识
+        :return: 本次新插入的流水条数
+        """
+        async with self._acquire() as conn:
+            try:
+                await conn.begin()
+                async with conn.cursor() as cursor:
+                    inserted = await cursor.executemany("""
+                        INSERT IGNORE INTO points_ledger
+                            (entry_id, flush_id, user_id, group_id, delta, reason, created_at)
+                        VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    """, [(entry_id, flush_id, *rest) for entry_id, *rest in rows])
+                    if inserted:
+                        await cursor.execute("""
+                            INSERT IGNORE INTO user_status (user_id, group_id, is_reusable)
+                            SELECT DISTINCT user_id, group_id, 1
+                            FROM points_ledger
+                            WHERE flush_id = %s
+                        """, (flush_id,))
+                        await cursor.execute("""
+                            INSERT INTO user_points (user_id, group_id, points)
+                            SELECT l.user_id, l.group_id, l.delta
+                            FROM (
+                                SELECT user_id, group_id, SUM(delta) AS delta
+                                FROM points_ledger
+                                WHERE flush_id = %s
+                                GROUP BY user_id, group_id
+                            ) l
+                            ON DUPLICATE KEY UPDATE points = user_points.points + VALUES(points)
+                        """, (flush_id,))
+                await conn.commit()
+                return inserted or 0
+            except Exception:
+                await conn.rollback()
+                raise
 
     async def delete_user_points(self, user_id: str, group_id: str):
         """删除用户积分（一般不建议单独删，因有外键依赖）"""
         # 注意：由于外键 ON DELETE CASCADE，删 user_status 会自动删 points
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.cursor() as cursor:
                 sql = "DELETE FROM user_points WHERE user_id = %s AND group_id = %s"
                 affected = await cursor.execute(sql, (user_id, group_id))
@@ -209,8 +574,7 @@ class Database:
 
     async def get_user_system_prompt(self, user_id: str, group_id: str) -> str | None:
         """获取用户自定义系统提示词"""
-        pool = await self._get_pool()
-        async with pool.acquire() as conn:
+        async with self._acquire() as conn:
             async with conn.cursor(aiomysql.DictCursor) as cursor:
                 sql = "SELECT system_prompt FROM user_system_prompts WHERE user_id = %s AND group_id = %s"
                 await cursor.execute(sql, (user_id, group_id))
@@ -219,9 +583,8 @@ class Database:
 
     async def set_user_system_prompt(self, user_id: str, group_id: str, prompt: str) -> bool:
         """设置或更新用户系统提示词"""
-        pool = await self._get_pool()
         try:
-            async with pool.acquire() as conn:
+            async with self._acquire() as conn:
                 async with conn.cursor() as cursor:
                     sql = """
                         INSERT INTO user_system_prompts (user_id, group_id, system_prompt)
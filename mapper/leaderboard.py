@@ -0,0 +1,257 @@
+# mapper/leaderboard.py
+import asyncio
+import uuid
+from typing import List, Tuple
+from botpy import logging
+
+from utils.constant import Constant
+from utils.redis_client import get_redis, pipeline
+
+_log = logging.get_logger()
+
+# 积分变动的公共前缀：
+# - 重建进行中（群级或全量标记存在）时记下受影响的用户，重建 RENAME 之后逐个从 MySQL 校正，
+#   否则重建期间的变动会被 RENAME 覆盖，直到排行榜过期才恢复
+# - 删除“该群暂无积分”的空标记，下次读取时重建
+# KEYS: 排行榜, 空标记, 群重建标记, 群待校正集合, 全量重建标记, 全量待校正集合
+# ARGV[2]: user_id, ARGV[3]: "group_id:user_id", ARGV[4]: 待校正集合的过期毫秒数
+_TRACK_CHANGE = """
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    redis.call('SADD', KEYS[4], ARGV[2])
+    redis.call('PEXPIRE', KEYS[4], ARGV[4])
+end
+if redis.call('EXISTS', KEYS[5]) == 1 then
+    redis.call('SADD', KEYS[6], ARGV[3])
+    redis.call('PEXPIRE', KEYS[6], ARGV[4])
+end
+redis.call('DEL', KEYS[2])
+"""
+
+# 排行榜存在时才增量更新；不存在时留给下次读取时从 MySQL 重建，避免只记录到增量
+_INCR_SCRIPT = _TRACK_CHANGE + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call('ZINCRBY', KEYS[1], ARGV[1], ARGV[2])
+end
+return false
+"""
+
+# 直接设置积分时，分数 = MySQL 积分 + 尚未刷盘的流水积分
+_SET_SCRIPT = _TRACK_CHANGE + """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    local pending = tonumber(redis.call('HGET', KEYS[7], ARGV[3]) or '0')
+    return redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + pending, ARGV[2])
+end
+return false
+"""
+
+# 重建后校正单个用户：ARGV[1] 为 MySQL 积分（空串表示已无积分记录）
+_FIX_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return false
+end
+if ARGV[1] == '' then
+    return redis.call('ZREM', KEYS[1], ARGV[2])
+end
+local pending = tonumber(redis.call('HGET', KEYS[2], ARGV[3]) or '0')
+return redis.call('ZADD', KEYS[1], tonumber(ARGV[1]) + pending, ARGV[2])
+"""
+
+# 取出并清空待校正集合；已清空时一并删除重建标记，之后的变动直接增量更新
+_DRAIN_SCRIPT = """
+local members = redis.call('SMEMBERS', KEYS[1])
+redis.call('DEL', KEYS[1])
+if #members == 0 then
+    redis.call('DEL', KEYS[2])
+end
+return members
+"""
+
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _rank_key(group_id: str) -> str:
+    return f"{Constant.REDIS_POINTS_RANK_KEY}:{group_id}"
+
+
+def _empty_key(group_id: str) -> str:
+    return f"{_rank_key(group_id)}:empty"
+
+
+def _rebuild_keys(group_id: str | None) -> Tuple[str, str]:
+    """(重建标记, 待校正集合)；group_id 为 None 时为全量重建"""
+    scope = _rank_key(group_id) if group_id is not None else f"{Constant.REDIS_POINTS_RANK_KEY}:*"
+    return f"{scope}:rebuilding", f"{scope}:dirty"
+
+
+def _change_keys(group_id: str) -> list:
+    return [_rank_key(group_id), _empty_key(group_id), *_rebuild_keys(group_id), *_rebuild_keys(None)]
+
+
+class Leaderboard:
+    """
+    群积分排行榜（每个群一个 Redis 有序集合，member 为 user_id，score 为积分）
+    - 所有积分变动同步增量更新；排行榜不存在或过期时从 MySQL 流式重建，
+      重建期间发生变动的用户在重建完成后逐个校正；没有积分记录的群缓存空标记，不会每次读取都重建
+    - Top N 与“我的排名”均为 O(log n)
+    """
+
+    def __init__(self):
+        self._redis = get_redis()
+        self._incr = self._redis.register_script(_INCR_SCRIPT)
+        self._set = self._redis.register_script(_SET_SCRIPT)
+        self._fix = self._redis.register_script(_FIX_SCRIPT)
+        self._drain = self._redis.register_script(_DRAIN_SCRIPT)
+        self._release_lock = self._redis.register_script(_RELEASE_LOCK_SCRIPT)
+
+    async def incr(self, user_id: str, group_id: str, delta: int):
+        """积分增减后同步排行榜（失败只记录日志，不影响积分操作本身）"""
+        try:
+            await self._incr(
+                keys=_change_keys(group_id),
+                args=[delta, user_id, f"{group_id}:{user_id}", Constant.LEADERBOARD_REBUILD_LOCK_TTL_MS],
+            )
+        except Exception as e:
+            _log.warning(f"更新排行榜失败 - group:{group_id} user:{user_id}, error: {e}")
+
+    async def set(self, user_id: str, group_id: str, points: int):
+        """直接设置积分后同步排行榜"""
+        try:
+            await self._set(
+                keys=[*_change_keys(group_id), Constant.REDIS_POINTS_PENDING_KEY],
+                args=[points, user_id, f"{group_id}:{user_id}", Constant.LEADERBOARD_REBUILD_LOCK_TTL_MS],
+            )
+        except Exception as e:
+            _log.warning(f"更新排行榜失败 - group:{group_id} user:{user_id}, error: {e}")
+
+    async def top(self, db, group_id: str, n: int = 10) -> List[Tuple[str, int]]:
+        """积分前 n 名 [(user_id, points), ...]"""
+        await self._ensure(db, group_id)
+        rows = await self._redis.zrevrange(_rank_key(group_id), 0, n - 1, withscores=True)
+        return [(user_id, int(score)) for user_id, score in rows]
+
+    async def rank(self, db, group_id: str, user_id: str) -> Tuple[int | None, int | None, int]:
+        """用户排名，返回 (名次（从 1 开始）, 积分, 上榜人数)；不在榜上时名次与积分为 None"""
+        await self._ensure(db, group_id)
+        key = _rank_key(group_id)
+        async with pipeline() as pipe:
+            pipe.zrevrank(key, user_id)
+            pipe.zscore(key, user_id)
+            pipe.zcard(key)
+            rank, score, total = await pipe.execute()
+        return (
+            rank + 1 if rank is not None else None,
+            int(score) if score is not None else None,
+            total,
+        )
+
+    async def _ensure(self, db, group_id: str):
+        """排行榜不存在时重建；并发读取只有一个请求执行重建，其余短暂等待"""
+        key = _rank_key(group_id)
+        if await self._redis.exists(key, _empty_key(group_id)):
+            return
+
+        lock_key = f"{key}:lock"
+        token = uuid.uuid4().hex
+        if await self._redis.set(lock_key, token, nx=True, px=Constant.LEADERBOARD_REBUILD_LOCK_TTL_MS):
+            try:
+                await self.rebuild(db, group_id)
+            finally:
+                await self._release_lock(keys=[lock_key], args=[token])
+            return
+
+        for _ in range(50):
+            await asyncio.sleep(0.1)
+            if await self._redis.exists(key, _empty_key(group_id)):
+                return
+
+    async def rebuild(self, db, group_id: str | None = None) -> int:
+        """
+        从 MySQL 流式重建排行榜（group_id 为 None 时重建所有群），返回写入的用户数
+        数据先写入临时键，全部完成后再 RENAME 覆盖，重建期间读取不受影响；
+        重建期间积分有变动的用户在 RENAME 之后重新读取校正
+        """
+        marker_key, _ = _rebuild_keys(group_id)
+        marker_ttl = Constant.LEADERBOARD_REBUILD_LOCK_TTL_MS
+        await self._redis.set(marker_key, 1, px=marker_ttl)
+
+        suffix = uuid.uuid4().hex
+        temp_keys = {}
+        count = 0
+        try:
+            async for rows in db.iter_user_points(group_id, Constant.LEADERBOARD_REBUILD_BATCH_SIZE):
+                async with pipeline() as pipe:
+                    for row_group_id, user_id, points in rows:
+                        temp_key = temp_keys.setdefault(row_group_id, f"{_rank_key(row_group_id)}:rebuild:{suffix}")
+                        pipe.zadd(temp_key, {user_id: points})
+                    pipe.pexpire(marker_key, marker_ttl)
+                    await pipe.execute()
+                count += len(rows)
+
+            # 叠加尚未刷盘的流水积分
+            async for field, pending in self._redis.hscan_iter(Constant.REDIS_POINTS_PENDING_KEY):
+                row_group_id, _, user_id = field.partition(":")
+                temp_key = temp_keys.get(row_group_id)
+                if temp_key is not None:
+                    await self._redis.zincrby(temp_key, int(pending), user_id)
+
+            async with pipeline(transaction=True) as pipe:
+                for row_group_id, temp_key in temp_keys.items():
+                    pipe.rename(temp_key, _rank_key(row_group_id))
+                    pipe.expire(_rank_key(row_group_id), Constant.LEADERBOARD_TTL)
+                    pipe.delete(_empty_key(row_group_id))
+                if group_id is not None and group_id not in temp_keys:
+                    # 该群暂无积分记录：缓存空标记，积分变动时删除
+                    pipe.delete(_rank_key(group_id))
+                    pipe.set(_empty_key(group_id), 1, ex=Constant.LEADERBOARD_TTL)
+                await pipe.execute()
+
+            fixed = await self._fix_changed(db, group_id)
+        except BaseException:
+            await self._redis.delete(marker_key, *temp_keys.values())
+            raise
+
+        _log.info(f"排行榜重建完成：{len(temp_keys)} 个群，{count} 个用户，校正重建期间变动 {fixed} 人")
+        return count
+
+    async def _fix_changed(self, db, group_id: str | None) -> int:
+        """逐个校正重建期间积分有变动的用户，直到没有新的变动，返回校正人数"""
+        marker_key, dirty_key = _rebuild_keys(group_id)
+        fixed = 0
+        while members := await self._drain(keys=[dirty_key, marker_key]):
+            await self._redis.pexpire(marker_key, Constant.LEADERBOARD_REBUILD_LOCK_TTL_MS)
+            for member in members:
+                row_group_id, user_id = (group_id, member) if group_id is not None else member.split(":", 1)
+                points = await db.get_user_points(user_id, row_group_id)
+                await self._fix(
+                    keys=[_rank_key(row_group_id), Constant.REDIS_POINTS_PENDING_KEY],
+                    args=["" if points is None else points, user_id, f"{row_group_id}:{user_id}"],
+                )
+                fixed += 1
+        return fixed
+
+
+# 进程内共享的排行榜
+leaderboard = Leaderboard()
+
+
+if __name__ == "__main__":
+    import argparse
+    from mapper.database import Database
+
+    parser = argparse.ArgumentParser(description="从 MySQL 重建群积分排行榜")
+    parser.add_argument("--group", default=None, help="只重建指定群，缺省为全部")
+    cli_args = parser.parse_args()
+
+    async def main():
+        db = Database()
+        try:
+            await leaderboard.rebuild(db, cli_args.group)
+        finally:
+            await db.close()
+
+    asyncio.run(main())
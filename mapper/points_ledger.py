@@ -0,0 +1,283 @@
+# mapper/points_ledger.py
+import asyncio
+import hashlib
+import json
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from botpy import logging
+
+from mapper.database import Database
+from mapper.leaderboard import leaderboard
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+from utils.redis_client import get_redis, pipeline
+
+_log = logging.get_logger()
+
+# 刷盘完成后：裁掉已写入 MySQL 的流水，并从待刷盘累计中扣除（归零的字段直接删除），
+# 清除提交中标记并递增刷盘代数（读余额据此判断 MySQL 与 Redis 的读数是否来自同一时刻）
+# 以锁令牌防护：锁已过期并被其他进程取得时什么都不做，由新的持有者重新读取同一批流水并裁剪
+_FINISH_FLUSH_SCRIPT = """
+if redis.call('GET', KEYS[3]) ~= ARGV[1] then
+    return 0
+end
+redis.call('LTRIM', KEYS[1], tonumber(ARGV[2]), -1)
+for i = 3, #ARGV, 2 do
+    local left = redis.call('HINCRBY', KEYS[2], ARGV[i], -tonumber(ARGV[i + 1]))
+    if left == 0 then
+        redis.call('HDEL', KEYS[2], ARGV[i])
+    end
+end
+redis.call('DEL', KEYS[4])
+redis.call('INCR', KEYS[5])
+return 1
+"""
+
+# 仅当锁仍归自己持有时才释放
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def _pending_field(group_id: str, user_id: str) -> str:
+    return f"{group_id}:{user_id}"
+
+
+def _entry_id(entry: dict, raw: str) -> str:
+    """流水唯一标识；升级前写入的流水没有 id，用原文摘要代替"""
+    return entry.get("id") or hashlib.md5(raw.encode("utf-8")).hexdigest()
+
+
+class PointsLedger:
+    """
+    积分流水（写后刷盘）
+    - 高频加分先追加到 Redis 流水列表，并累加到“待刷盘积分”哈希，不直接写 MySQL
+    - 后台任务每 POINTS_LEDGER_FLUSH_INTERVAL_MS 毫秒或积累 POINTS_LEDGER_FLUSH_SIZE 条时，
+      以一个事务 executemany 写入 MySQL（积分 + points_ledger 审计表）
+    - 刷盘幂等：每条流水带唯一 id，MySQL 按 id 去重；提交后、裁剪前进程崩溃或锁过期，
+      同一批流水会被再次读取，但不会重复加分
+    - 余额 = MySQL 已落盘积分 + Redis 待刷盘积分；刷盘在提交 MySQL 前设置提交中标记，
+      裁剪后清除标记并递增代数，两次读取之间有刷盘提交时重读，避免同一笔积分算两次或漏算
+    流水只用于加分；扣分仍走 MySQL 原子扣减，待刷盘的加分只会让扣减更保守，不会扣成负数。
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+        self._redis = get_redis()
+        self._finish_flush = self._redis.register_script(_FINISH_FLUSH_SCRIPT)
+        self._release_lock = self._redis.register_script(_RELEASE_LOCK_SCRIPT)
+        self._flush_event: asyncio.Event | None = None
+        self._flusher: asyncio.Task | None = None
+        self._schema_ready = False
+
+        self.flushed_entries = 0
+        self.flush_failures = 0
+
+    def start(self):
+        """启动后台刷盘任务（需在事件循环中调用，重复调用无副作用）"""
+        if self._flusher is None or self._flusher.done():
+            self._flush_event = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def credit(self, user_id: str, group_id: str, delta: int, reason: str = "") -> int:
+        """记一笔加分流水，返回加分后的余额"""
+        if delta <= 0:
+            raise ValueError("ledger only accepts positive credits")
+        self.start()
+
+        entry = json.dumps({
+            "id": uuid.uuid4().hex,
+            "user_id": user_id,
+            "group_id": group_id,
+            "delta": delta,
+            "reason": reason,
+            "ts": time.time(),
+        }, ensure_ascii=False)
+        async with pipeline(transaction=True) as pipe:
+            pipe.rpush(Constant.REDIS_POINTS_LEDGER_KEY, entry)
+            pipe.hincrby(Constant.REDIS_POINTS_PENDING_KEY, _pending_field(group_id, user_id), delta)
+            self._queue_generation(pipe)
+            length, pending, generation, committing = await pipe.execute()
+
+        if length >= Constant.POINTS_LEDGER_FLUSH_SIZE:
+            self._flush_event.set()
+        await leaderboard.incr(user_id, group_id, delta)
+
+        # 读 MySQL 前后刷盘代数不变且没有刷盘在提交时，两次读数一致；否则重新读取余额
+        committed = await self.db.get_user_points(user_id, group_id) or 0
+        if not committing and await self._flush_generation() == (generation or "0"):
+            return committed + pending
+        return await self.balance(user_id, group_id) or 0
+
+    @staticmethod
+    def _queue_generation(pipe):
+        pipe.get(Constant.REDIS_POINTS_LEDGER_GEN_KEY)
+        pipe.exists(Constant.REDIS_POINTS_LEDGER_COMMITTING_KEY)
+
+    async def _flush_generation(self) -> str | None:
+        """当前刷盘代数；有刷盘正在提交 MySQL 时返回 None"""
+        async with pipeline(transaction=True) as pipe:
+            self._queue_generation(pipe)
+            generation, committing = await pipe.execute()
+        return None if committing else (generation or "0")
+
+    async def _pending_since(self, user_id: str, group_id: str, generation: str | None) -> int | None:
+        """读取待刷盘积分；自 generation 以来有刷盘提交过（与之前的 MySQL 读数不一致）时返回 None"""
+        async with pipeline(transaction=True) as pipe:
+            pipe.hget(Constant.REDIS_POINTS_PENDING_KEY, _pending_field(group_id, user_id))
+            self._queue_generation(pipe)
+            pending, current, committing = await pipe.execute()
+        if generation is None or committing or (current or "0") != generation:
+            return None
+        return int(pending) if pending else 0
+
+    async def pending(self, user_id: str, group_id: str) -> int:
+        """尚未刷入 MySQL 的积分"""
+        value = await self._redis.hget(Constant.REDIS_POINTS_PENDING_KEY, _pending_field(group_id, user_id))
+        return int(value) if value else 0
+
+    @staticmethod
+    def pending_command(user_id: str, group_id: str) -> tuple:
+        """读取待刷盘积分的原始命令，供调用方并入自己的管道（结果为 None 时视为 0）"""
+        return "HGET", Constant.REDIS_POINTS_PENDING_KEY, _pending_field(group_id, user_id)
+
+    async def balance(self, user_id: str, group_id: str) -> int | None:
+        """当前余额（含待刷盘积分）；用户没有积分记录时返回 None"""
+        committed = None
+        for _ in range(Constant.POINTS_LEDGER_READ_RETRIES):
+            generation = await self._flush_generation()
+            committed = await self.db.get_user_points(user_id, group_id)
+            if committed is None:
+                return None
+            pending = await self._pending_since(user_id, group_id, generation)
+            if pending is not None:
+                return committed + pending
+            await asyncio.sleep(Constant.POINTS_LEDGER_RETRY_INTERVAL_MS / 1000)
+        # 刷盘迟迟没有完成（如提交后进程崩溃，等待下一次刷盘裁剪），返回可能多算的近似值
+        return committed + await self.pending(user_id, group_id)
+
+    async def debit(self, user_id: str, group_id: str, amount: int) -> int | None:
+        """
+        原子扣分，返回扣分后的余额（含待刷盘积分）；余额不足时返回 None
+        MySQL 余额不足但有待刷盘积分时，先刷盘再重试；其他进程正在刷盘时等待其完成，
+        超过刷盘锁有效期仍有待刷盘积分则抛出 TimeoutError，而不是误报余额不足
+        """
+        generation = await self._flush_generation()
+        new_points = await self.db.apply_points_delta(user_id, group_id, -amount)
+        deadline = time.monotonic() + Constant.POINTS_LEDGER_LOCK_TTL_MS / 1000
+        while new_points is None and await self.pending(user_id, group_id) > 0:
+            if time.monotonic() >= deadline:
+                raise TimeoutError("points ledger flush did not finish in time")
+            if not await self.flush():
+                await asyncio.sleep(Constant.POINTS_LEDGER_RETRY_INTERVAL_MS / 1000)
+            new_points = await self.db.apply_points_delta(user_id, group_id, -amount)
+        if new_points is None:
+            return None
+
+        pending = await self._pending_since(user_id, group_id, generation)
+        if pending is None:
+            return await self.balance(user_id, group_id)
+        return new_points + pending
+
+    async def flush(self) -> int:
+        """把一批流水写入 MySQL，返回写入条数；其他进程正在刷盘时直接返回 0"""
+        token = uuid.uuid4().hex
+        lock_key = Constant.REDIS_POINTS_LEDGER_LOCK_KEY
+        if not await self._redis.set(lock_key, token, nx=True, px=Constant.POINTS_LEDGER_LOCK_TTL_MS):
+            return 0
+
+        try:
+            raw = await self._redis.lrange(Constant.REDIS_POINTS_LEDGER_KEY, 0, Constant.POINTS_LEDGER_FLUSH_SIZE - 1)
+            if not raw:
+                return 0
+
+            if not self._schema_ready:
+                await self.db.ensure_points_ledger_table()
+                self._schema_ready = True
+
+            rows = []
+            totals = defaultdict(int)
+            for item in raw:
+                entry = json.loads(item)
+                rows.append((
+                    _entry_id(entry, item),
+                    entry["user_id"],
+                    entry["group_id"],
+                    entry["delta"],
+                    entry["reason"],
+                    datetime.fromtimestamp(entry["ts"]),
+                ))
+                totals[(entry["user_id"], entry["group_id"])] += entry["delta"]
+
+            # 提交中标记：读余额时据此等待，避免把已落盘、尚未裁剪的积分算两次；
+            # 提交后进程崩溃时标记随锁一起过期
+            await self._redis.set(Constant.REDIS_POINTS_LEDGER_COMMITTING_KEY, token,
+                                  px=Constant.POINTS_LEDGER_LOCK_TTL_MS)
+            inserted = await self.db.apply_points_ledger(rows, flush_id=token)
+            if inserted < len(rows):
+                _log.warning(f"积分流水 {len(rows) - inserted} 条此前已写入 MySQL，本次跳过")
+
+            # MySQL 已提交：裁掉流水并扣减待刷盘积分（整批，不论是否由本次插入）。
+            # 提交后到裁剪前余额会被多算；若裁剪没有完成（崩溃、Redis 故障、锁已被他人取得），
+            # 多算会持续到下一次刷盘重新读取这批流水并裁剪为止
+            args = [token, len(raw)]
+            for (user_id, group_id), delta in totals.items():
+                args += [_pending_field(group_id, user_id), delta]
+            finished = await self._finish_flush(
+                keys=[Constant.REDIS_POINTS_LEDGER_KEY, Constant.REDIS_POINTS_PENDING_KEY, lock_key,
+                      Constant.REDIS_POINTS_LEDGER_COMMITTING_KEY, Constant.REDIS_POINTS_LEDGER_GEN_KEY],
+                args=args,
+            )
+            if not finished:
+                _log.warning("积分流水刷盘期间锁已过期，交由下一次刷盘裁剪")
+                return 0
+            self.flushed_entries += inserted
+            return len(raw)
+        finally:
+            await self._release_lock(keys=[lock_key], args=[token])
+
+    async def _flush_loop(self):
+        interval = Constant.POINTS_LEDGER_FLUSH_INTERVAL_MS / 1000
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_event.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_event.clear()
+            try:
+                # 一次刷满一批说明还有积压，继续刷
+                while await self.flush() >= Constant.POINTS_LEDGER_FLUSH_SIZE:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.flush_failures += 1
+                _log.error(f"积分流水刷盘失败，稍后重试: {e}")
+
+    async def close(self):
+        """停止后台任务并把剩余流水刷入 MySQL（应在应用退出时调用）"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        while await self.flush() > 0:
+            pass
+
+    def stats(self) -> dict:
+        return {
+            "flushed_entries": self.flushed_entries,
+            "flush_failures": self.flush_failures,
+        }
+
+
+# 进程内共享的积分流水
+points_ledger = PointsLedger(Database())
+
+registry.register_collector(
+    lambda: stats_samples("qqbot_points_ledger", points_ledger.stats(), counters=("flushed_entries", "flush_failures"))
+)
@@ -1,14 +1,20 @@
 # service/agentUtils/saveMemory.py
 import json
 import asyncio
+from functools import partial
 from typing import List, Dict, Any
 from botpy import logging
 
 from redis.asyncio import Redis
+from redis.exceptions import ResponseError
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
 
+from service.agentUtils.summaryScheduler import SummaryScheduler
+from utils.admission import summary_gate
+from utils.circuit_breaker import CircuitOpen, summary_breaker
 from utils.constant import Constant
+from utils.llm_factory import create_chat_model
+from utils.redis_client import get_redis, pipeline
 
 _log = logging.get_logger()
 
@@ -27,14 +33,13 @@ class SaveMemory:
     """
 
     def __init__(self):
-        self.summary_llm = ChatOpenAI(
+        self.summary_llm = create_chat_model(
             model=Constant.SUMMARY_MODEL_NAME,
-            api_key=Constant.DASHSCOPE_API_KEY,
-            base_url=Constant.DASHSCOPE_BASE_URL,
             temperature=Constant.SUMMARY_TEMPERATURE,
             max_tokens=Constant.SUMMARY_MAX_TOKENS,
         )
-        self.redis_client: Redis = Redis.from_url(Constant.REDIS_CONN_STRING, decode_responses=True)
+        self.redis_client: Redis = get_redis()
+        self.summary_scheduler = SummaryScheduler()
 
     @staticmethod
     def _get_user_long_key(group_id: str, user_id: str) -> str:
@@ -75,19 +80,29 @@ class SaveMemory:
                 f"对话内容：\n{conversation}"
             )
 
-        response = await self.summary_llm.ainvoke([HumanMessage(content=prompt)])
+        async with summary_gate.admit(), summary_breaker.call():
+            response = await self.summary_llm.ainvoke([HumanMessage(content=prompt)])
         return response.content.strip()
 
+    async def _requeue(self, key: str, messages: List[Dict[str, Any]], reason: str = "摘要模型熔断中"):
+        """
+        摘要无法完成时（模型熔断、进程退出）把消息放回临时记忆列表头部（保持先后顺序），
+        随下一次摘要一起处理；列表超过 MAX_TEMP_MEMORY_MESSAGES 时丢弃最旧的消息
+        """
+        async with pipeline() as pipe:
+            pipe.lpush(key, *reversed(self._dump(messages)))
+            pipe.ltrim(key, -Constant.MAX_TEMP_MEMORY_MESSAGES, -1)
+            length, _ = await pipe.execute()
+        dropped = max(length - Constant.MAX_TEMP_MEMORY_MESSAGES, 0)
+        _log.info(f"{reason}，{len(messages)} 条消息已放回 {key} 延后摘要"
+                  + (f"，丢弃最旧的 {dropped} 条" if dropped else ""))
+
     async def userMessageSummary(self, group_id: str, user_id: str, messages: List[Dict[str, Any]]):
         """对用户临时记忆进行总结并存入长期记忆（支持增量更新）"""
         _log.info(f"开始处理群{group_id}, 用户 {user_id} 的对话")
         if not messages:
             return
 
-        # 清空临时记忆
-        temp_key = _get_user_temp_key(group_id, user_id)
-        await self.redis_client.delete(temp_key)
-
         # 读取已有长期记忆（如果有）
         long_key = self._get_user_long_key(group_id, user_id)
         previous_summary = await self.redis_client.get(long_key)  # decode_responses=True → str
@@ -96,7 +111,11 @@ class SaveMemory:
         conversation = self._messages_to_text(messages)
 
         # 生成**增量式**摘要
-        summary = await self._summarize(conversation, previous_summary=previous_summary or "", is_group=False)
+        try:
+            summary = await self._summarize(conversation, previous_summary=previous_summary or "", is_group=False)
+        except CircuitOpen:
+            await self._requeue(_get_user_temp_key(group_id, user_id), messages)
+            return
 
         # 保存新摘要
         await self.redis_client.set(long_key, summary)
@@ -108,10 +127,6 @@ class SaveMemory:
         if not messages:
             return
 
-        # 清空临时记忆
-        temp_key = _get_group_temp_key(group_id)
-        await self.redis_client.delete(temp_key)
-
         # 读取已有长期记忆
         long_key = self._get_group_long_key(group_id)
         previous_summary = await self.redis_client.get(long_key)
@@ -120,16 +135,63 @@ class SaveMemory:
         conversation = self._messages_to_text(messages)
 
         # 生成增量摘要
-        summary = await self._summarize(conversation, previous_summary=previous_summary or "", is_group=True)
+        try:
+            summary = await self._summarize(conversation, previous_summary=previous_summary or "", is_group=True)
+        except CircuitOpen:
+            await self._requeue(_get_group_temp_key(group_id), messages)
+            return
 
         # 保存
         await self.redis_client.set(long_key, summary)
         _log.info(f"已更新群组 {group_id} 的长期记忆摘要")
 
+    @staticmethod
+    def _dump(messages: List[Dict[str, Any]]) -> List[str]:
+        return [json.dumps(m, ensure_ascii=False) for m in messages]
+
+    @staticmethod
+    def _load(items: List[str]) -> List[Dict[str, Any]]:
+        return [json.loads(item) for item in items]
+
+    async def _push(self, entries: List[tuple]) -> List[int]:
+        """
+        一次往返把本轮消息 RPUSH 到多个临时记忆列表，返回各列表追加后的长度
+        列表只保留最新的 MAX_TEMP_MEMORY_MESSAGES 条（摘要模型熔断期间不取出，避免无限增长）
+        :param entries: [(key, [序列化后的消息, ...]), ...]
+        """
+        async with pipeline() as pipe:
+            for key, items in entries:
+                pipe.rpush(key, *items)
+                pipe.ltrim(key, -Constant.MAX_TEMP_MEMORY_MESSAGES, -1)
+            results = await pipe.execute()
+        return [min(length, Constant.MAX_TEMP_MEMORY_MESSAGES) for length in results[::2]]
+
+    async def _drain(self, key: str) -> List[Dict[str, Any]]:
+        """原子地读取并清空临时记忆列表（MULTI/EXEC），并发触发时只有一方拿到数据"""
+        async with pipeline(transaction=True) as pipe:
+            pipe.lrange(key, 0, -1)
+            pipe.delete(key)
+            items, _ = await pipe.execute()
+        return self._load(items)
+
+    async def _migrate_legacy(self, key: str):
+        """旧版本以 JSON 字符串整体保存临时记忆，首次遇到时转换为列表"""
+        if await self.redis_client.type(key) != "string":
+            return
+        async with pipeline(transaction=True) as pipe:
+            pipe.get(key)
+            pipe.delete(key)
+            raw, _ = await pipe.execute()
+        messages = json.loads(raw) if raw else []
+        if messages:
+            await self.redis_client.rpush(key, *self._dump(messages))
+        _log.info(f"已将临时记忆 {key} 迁移为列表存储")
+
     async def save(self, groupId: str = None, userId: str = None, userMessage: str = "", agentMessage: str = ""):
         """
         保存一轮对话（用户 + 助手）到临时记忆，并自动判断是否触发总结。
-        触发总结时使用 asyncio.create_task 执行，避免阻塞。
+        临时记忆以 Redis 列表存储，每轮只追加本轮消息（RPUSH 返回列表长度），
+        达到阈值时原子取出并清空，再交给 SummaryScheduler 在后台执行总结，避免阻塞。
         """
         if not userId:
             raise ValueError("userId is required")
@@ -144,29 +206,51 @@ class SaveMemory:
         if not new_messages:
             return
 
-        # === 处理用户维度记忆 ===
+        items = self._dump(new_messages)
         user_temp_key = _get_user_temp_key(groupId, userId)
-        user_raw = await self.redis_client.get(user_temp_key)
-        user_messages = json.loads(user_raw) if user_raw else []
-        user_messages.extend(new_messages)
+        entries = [(user_temp_key, items)]
+        if groupId:
+            group_temp_key = _get_group_temp_key(groupId)
+            entries.append((group_temp_key, items))
 
-        if len(user_messages) >= Constant.MAX_USER_MESSAGE_COUNT:
-            # 👇 关键：使用 asyncio.create_task 异步执行总结
-            asyncio.create_task(self.userMessageSummary(groupId, userId, user_messages.copy()))
-        else:
-            await self.redis_client.set(user_temp_key, json.dumps(user_messages, ensure_ascii=False))
+        try:
+            lengths = await self._push(entries)
+        except ResponseError as e:
+            if "WRONGTYPE" not in str(e):
+                raise
+            for key, _ in entries:
+                await self._migrate_legacy(key)
+            lengths = await self._push(entries)
+
+        # 摘要模型熔断期间不取出临时记忆，继续累积，恢复后一并摘要
+        if not summary_breaker.is_closed:
+            return
+
+        # === 处理用户维度记忆 ===
+        if lengths[0] >= Constant.MAX_USER_MESSAGE_COUNT:
+            user_messages = await self._drain(user_temp_key)
+            if user_messages:
+                self.summary_scheduler.submit(
+                    user_temp_key, partial(self.userMessageSummary, groupId, userId), user_messages
+                )
 
         # === 处理群组维度记忆（如果 groupId 存在）===
-        if groupId:
-            group_temp_key = _get_group_temp_key(groupId)
-            group_raw = await self.redis_client.get(group_temp_key)
-            group_messages = json.loads(group_raw) if group_raw else []
-            group_messages.extend(new_messages)
+        if groupId and lengths[1] >= Constant.MAX_GROUP_MESSAGE_COUNT:
+            group_messages = await self._drain(group_temp_key)
+            if group_messages:
+                self.summary_scheduler.submit(
+                    group_temp_key, partial(self.groupMessageSummary, groupId), group_messages
+                )
 
-            if len(group_messages) >= Constant.MAX_GROUP_MESSAGE_COUNT:
-                asyncio.create_task(self.groupMessageSummary(groupId, group_messages.copy()))
-            else:
-                await self.redis_client.set(group_temp_key, json.dumps(group_messages, ensure_ascii=False))
+    async def close(self, timeout: float | None = None):
+        """等待后台摘要完成，超时未完成的消息放回临时记忆列表，重启后继续摘要（应在应用退出时调用）"""
+        unfinished = await self.summary_scheduler.close(timeout)
+        # 同一 key 可能既有执行中又有待执行的任务，倒序放回以保持消息先后顺序
+        for key, messages in reversed(unfinished):
+            try:
+                await self._requeue(key, messages, reason="进程退出时摘要未完成")
+            except Exception as e:
+                _log.error(f"放回 {key} 的 {len(messages)} 条消息失败: {e}")
 
 
 # 示例主函数（异步）
@@ -183,8 +267,7 @@ if __name__ == "__main__":
                 )
                 _log.info(f"已保存第 {i} 条对话")
                 await asyncio.sleep(1)
-            await asyncio.sleep(5)  # 等待后台任务完成
         finally:
-            await save_memory.redis_client.close()
+            await save_memory.close()  # 等待后台摘要任务完成
 
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,163 @@
+# service/agentUtils/summaryScheduler.py
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List
+from botpy import logging
+
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+
+_log = logging.get_logger()
+
+SummaryHandler = Callable[[List[Dict[str, Any]]], Awaitable[None]]
+
+
+class _SummaryJob:
+    __slots__ = ("key", "handler", "messages", "enqueued_at", "merged")
+
+    def __init__(self, key: str, handler: SummaryHandler, messages: List[Dict[str, Any]]):
+        self.key = key
+        self.handler = handler
+        self.messages = list(messages)
+        self.enqueued_at = time.monotonic()
+        self.merged = 0
+
+
+class SummaryScheduler:
+    """
+    后台摘要调度器
+    - 固定数量的 worker 执行摘要，限制同时进行的摘要 LLM 调用数
+    - 按 key（用户 / 群组临时记忆键）合并：同一 key 同时只有一个摘要在执行，
+      排队或执行期间到达的新请求合并进同一个待执行任务
+    - 失败按指数退避重试
+    - 持有全部任务引用，close() 时等待队列处理完毕，超时未完成的任务交还调用方，避免消息丢失
+    """
+
+    def __init__(
+            self,
+            workers: int = Constant.SUMMARY_WORKERS,
+            max_retries: int = Constant.SUMMARY_MAX_RETRIES,
+            retry_base_delay: float = Constant.SUMMARY_RETRY_BASE_DELAY,
+    ):
+        self._worker_count = workers
+        self._max_retries = max_retries
+        self._retry_base_delay = retry_base_delay
+
+        self._queue: asyncio.Queue | None = None
+        self._pending: Dict[str, _SummaryJob] = {}  # 等待执行的任务（每个 key 至多一个）
+        self._running: Dict[str, _SummaryJob] = {}  # 正在执行的任务
+        self._workers: List[asyncio.Task] = []
+        self._closed = False
+
+        self.submitted = 0
+        self.merged = 0
+        self.completed = 0
+        self.failed = 0
+        self.retries = 0
+        self.last_lag = 0.0  # 最近一个任务从提交到开始执行的等待秒数
+
+        registry.register_collector(lambda: stats_samples(
+            "qqbot_summary", self.stats(), counters=("submitted", "merged", "completed", "failed", "retries")
+        ), name="summary_scheduler")
+
+    def _ensure_started(self):
+        if self._queue is not None:
+            return
+        self._queue = asyncio.Queue()
+        for i in range(self._worker_count):
+            self._workers.append(asyncio.create_task(self._worker(), name=f"summary-worker-{i}"))
+
+    def submit(self, key: str, handler: SummaryHandler, messages: List[Dict[str, Any]]):
+        """提交摘要任务；同一 key 已有待执行任务时合并消息"""
+        if self._closed:
+            raise RuntimeError("SummaryScheduler is closed")
+        if not messages:
+            return
+        self._ensure_started()
+        self.submitted += 1
+
+        job = self._pending.get(key)
+        if job is not None:
+            job.messages.extend(messages)
+            job.merged += 1
+            self.merged += 1
+            return
+
+        self._pending[key] = _SummaryJob(key, handler, messages)
+        # 正在执行的 key 不重复入队，由 worker 执行完后重新入队
+        if key not in self._running:
+            self._queue.put_nowait(key)
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            try:
+                job = self._pending.pop(key, None)
+                if job is None:
+                    continue
+                self._running[key] = job
+                self.last_lag = time.monotonic() - job.enqueued_at
+                try:
+                    await self._run(job)
+                finally:
+                    self._running.pop(key, None)
+                    if key in self._pending:
+                        self._queue.put_nowait(key)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: _SummaryJob):
+        for attempt in range(self._max_retries + 1):
+            try:
+                await job.handler(job.messages)
+                self.completed += 1
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                if attempt >= self._max_retries:
+                    self.failed += 1
+                    _log.error(f"摘要任务 {job.key} 重试 {attempt} 次后仍失败，丢弃 {len(job.messages)} 条消息: {e}")
+                    return
+                delay = self._retry_base_delay * (2 ** attempt)
+                self.retries += 1
+                _log.warning(f"摘要任务 {job.key} 第 {attempt + 1} 次失败，{delay:.1f}s 后重试: {e}")
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        """队列深度与滞后情况，用于判断摘要是否跟不上聊天流量"""
+        now = time.monotonic()
+        oldest = min((job.enqueued_at for job in self._pending.values()), default=None)
+        return {
+            "queue_depth": len(self._pending),
+            "running": len(self._running),
+            "lag_seconds": now - oldest if oldest is not None else 0.0,
+            "last_lag_seconds": self.last_lag,
+            "submitted": self.submitted,
+            "merged": self.merged,
+            "completed": self.completed,
+            "failed": self.failed,
+            "retries": self.retries,
+        }
+
+    async def close(self, timeout: float | None = None) -> List[tuple]:
+        """
+        停止接收新任务，等待已提交任务完成
+        超时则取消剩余任务，返回未完成的 [(key, messages), ...]（正在执行的在前），由调用方放回
+        """
+        self._closed = True
+        if self._queue is None:
+            return []
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            _log.warning(f"摘要队列关闭超时，{len(self._running)} 个执行中、{len(self._pending)} 个待执行任务未完成")
+        # 先记下执行中的任务：取消后 worker 会把它们从 _running 中移除
+        unfinished = [(job.key, job.messages) for job in self._running.values()]
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        unfinished += [(job.key, job.messages) for job in self._pending.values()]
+        self._pending.clear()
+        return unfinished
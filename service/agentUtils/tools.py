@@ -1,27 +1,31 @@
 # service/agentUtils/tools.py
 
-import redis.asyncio as redis  # 使用异步 Redis 客户端
 from botpy import logging
 from langchain.tools import tool
-from langchain_openai import ChatOpenAI
 
 from mapper.database import Database
+from mapper.points_ledger import points_ledger
 from service.user_service import UserService
 from utils.constant import Constant
+from utils.llm_factory import create_chat_model
+from utils.metrics import timed_tool
+from utils.redis_client import get_redis
 
-# 初始化异步 Redis 客户端
-_redis_client = redis.from_url(Constant.REDIS_CONN_STRING)
+# 共享异步 Redis 客户端（decode_responses=True）
+_redis_client = get_redis()
 
-_update_llm = ChatOpenAI(
+_update_llm = create_chat_model(
     model=Constant.SUMMARY_MODEL_NAME,
-    api_key=Constant.DASHSCOPE_API_KEY,
-    base_url=Constant.DASHSCOPE_BASE_URL,
     temperature=Constant.SUMMARY_TEMPERATURE,
     max_tokens=Constant.SUMMARY_MAX_TOKENS,
 )
 
 _log = logging.get_logger()
 
+# 共享 Database / UserService 实例（底层连接池由 Database 在进程内共享）
+_db = Database()
+_user_service = UserService(_db)
+
 
 def _get_user_long_key(group_id: str, user_id: str) -> str:
     return f"{Constant.REDIS_USER_MEMORY_KEY}:{group_id}:{user_id}"
@@ -32,6 +36,7 @@ def _get_group_long_key(group_id: str) -> str:
 
 
 @tool
+@timed_tool
 async def queryUserLongMemory(groupId: str, userId: str) -> str:
     """
     查询当前用户的长期记忆画像。包含兴趣、偏好、背景等信息。
@@ -48,7 +53,7 @@ async def queryUserLongMemory(groupId: str, userId: str) -> str:
         memory = await _redis_client.get(key)
 
         if memory:
-            return memory.decode("utf-8")
+            return memory
         else:
             return "暂无关于该用户的长期记忆。"
     except Exception as e:
@@ -58,6 +63,7 @@ async def queryUserLongMemory(groupId: str, userId: str) -> str:
 
 
 @tool
+@timed_tool
 async def queryGroupLongMemory(groupId: str) -> str:
     """
     查询当前群组的长期记忆画像。包含群主题、成员偏好、历史事件等。
@@ -76,7 +82,7 @@ async def queryGroupLongMemory(groupId: str) -> str:
         memory = await _redis_client.get(key)
 
         if memory:
-            return memory.decode("utf-8")
+            return memory
         else:
             return "暂无关于该群组的长期记忆。"
     except Exception as e:
@@ -86,6 +92,7 @@ async def queryGroupLongMemory(groupId: str) -> str:
 
 
 @tool
+@timed_tool
 async def queryUserPoints(groupId: str, userId: str) -> str:
     """
     查询用户在指定群组中的当前积分。
@@ -98,11 +105,10 @@ async def queryUserPoints(groupId: str, userId: str) -> str:
     """
     try:
         _log.info(f"查询群{groupId}中用户 {userId} 的积分")
-        db = Database()
-        current_points = await db.get_user_points(userId, groupId)
+        current_points = await points_ledger.balance(userId, groupId)
 
         if current_points is None:
-            await db.init_user_points(userId, groupId)
+            await _db.init_user(userId, groupId)
             current_points = 0
 
         return f"用户当前积分：{current_points}"
@@ -113,6 +119,7 @@ async def queryUserPoints(groupId: str, userId: str) -> str:
 
 
 @tool
+@timed_tool
 async def addUserPoints(groupId: str, userId: str, amount: int, reason: str = "") -> str:
     """
     为用户增加积分。
@@ -128,23 +135,16 @@ async def addUserPoints(groupId: str, userId: str, amount: int, reason: str = ""
     try:
         if amount < 0:
             return "积分数量不能为负数。"
+        elif amount == 0:
+            return "积分数量必须大于 0。"
         elif amount > 9999:
             return "单次增加积分过多，请合理控制在9999以内。"
 
         _log.info(f"为群{groupId}用户 {userId} 增加 {amount} 积分，原因：{reason}")
 
-        db = Database()
-        current_points = await db.get_user_points(userId, groupId)
-
-        if current_points is None:
-            await db.init_user_points(userId, groupId)
-            current_points = 0
-
-        success = await db.add_user_points(userId, groupId, amount)
-        if not success:
-            return "积分操作失败，请稍后再试。"
-
-        new_points = await db.get_user_points(userId, groupId) or 0
+        # 记入积分流水，由后台批量写入 MySQL
+        await _db.init_user(userId, groupId)
+        new_points = await points_ledger.credit(userId, groupId, amount, reason)
 
         msg = f"成功增加{amount}积分"
         if reason:
@@ -158,6 +158,7 @@ async def addUserPoints(groupId: str, userId: str, amount: int, reason: str = ""
 
 
 @tool
+@timed_tool
 async def deductUserPoints(groupId: str, userId: str, amount: int, reason: str = "") -> str:
     """
     从用户扣除积分（需确保余额充足）。
@@ -178,22 +179,12 @@ async def deductUserPoints(groupId: str, userId: str, amount: int, reason: str =
 
         _log.info(f"从群{groupId}用户 {userId} 扣除 {amount} 积分，原因：{reason}")
 
-        db = Database()
-        current_points = await db.get_user_points(userId, groupId)
-
-        if current_points is None:
-            await db.init_user_points(userId, groupId)
-            current_points = 0
-
-        if current_points < amount:
+        # 余额检查与扣除在同一条语句中完成，并发扣除不会扣成负数
+        new_points = await points_ledger.debit(userId, groupId, amount)
+        if new_points is None:
+            current_points = await points_ledger.balance(userId, groupId) or 0
             return f"积分不足！当前积分：{current_points}，需扣除：{amount}"
 
-        success = await db.add_user_points(userId, groupId, -amount)
-        if not success:
-            return "积分操作失败，请稍后再试。"
-
-        new_points = await db.get_user_points(userId, groupId) or 0
-
         msg = f"成功扣除{amount}积分"
         if reason:
             msg += f"（原因：{reason}）"
@@ -206,6 +197,28 @@ async def deductUserPoints(groupId: str, userId: str, amount: int, reason: str =
 
 
 @tool
+@timed_tool
+async def queryLeaderboard(groupId: str, userId: str) -> str:
+    """
+    查询群内积分排行榜及当前用户的名次。
+
+    参数：
+      - groupId (str): 群组ID
+      - userId (str): 用户ID
+    返回值：
+      - 排行榜文本（前若干名及用户自己的名次），若查询失败则返回错误提示。
+    """
+    try:
+        _log.info(f"查询群{groupId}的积分排行榜（用户 {userId}）")
+        return await _user_service.handle_leaderboard(groupId, userId)
+    except Exception as e:
+        error_msg = f"查询积分排行榜时出错：{str(e)}"
+        _log.error(error_msg)
+        return "查询积分排行榜时发生错误。"
+
+
+@tool
+@timed_tool
 async def doCheckin(groupId: str, userId: str) -> str:
     """
     执行用户签到操作。
@@ -219,8 +232,7 @@ async def doCheckin(groupId: str, userId: str) -> str:
     """
     _log.info(f"用户 {userId} 在群 {groupId} 请求签到")
     try:
-        service = UserService()
-        result = await service.handle_checkin(group_id=groupId, user_id=userId)
+        result = await _user_service.handle_checkin(group_id=groupId, user_id=userId)
         return result
     except Exception as e:
         error_msg = f"签到工具执行出错: {e}"
@@ -229,6 +241,7 @@ async def doCheckin(groupId: str, userId: str) -> str:
 
 
 @tool
+@timed_tool
 async def showHelp() -> str:
     """显示帮助信息。"""
     _log.info("用户请求帮助信息")
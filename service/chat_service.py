@@ -1,12 +1,15 @@
 # service/chat_service.py
 
 import asyncio
-import redis.asyncio as redis
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+from botpy import logging
 from langchain.agents import create_agent
-from langchain.agents.middleware import SummarizationMiddleware
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain.agents.middleware import AgentMiddleware, SummarizationMiddleware
+from langchain_core.messages import AIMessageChunk, BaseMessage, SystemMessage, HumanMessage
 from langchain_core.runnables import RunnableConfig
-from langchain_openai import ChatOpenAI
 from langgraph.checkpoint.redis.aio import AsyncRedisSaver
 
 from service.agentUtils.saveMemory import SaveMemory
@@ -16,44 +19,145 @@ from service.agentUtils.tools import (
     doCheckin,
     showHelp,
     queryUserPoints,
+    queryLeaderboard,
     addUserPoints,
     deductUserPoints,
 )
-from service.user_service import UserService
+from service.intent_router import IntentRouter
+from mapper.points_ledger import points_ledger
+from service.user_service import UserService, start_system_prompt_invalidation
+from utils.admission import KeyedLock, Overloaded, chat_gate
+from utils.circuit_breaker import CircuitOpen, chat_breaker, summary_breaker
 from utils.constant import Constant
+from utils.llm_factory import create_chat_model, create_hedged_chat_model
+from utils.metrics import registry, span, stage_seconds, stats_samples
+from utils.redis_client import get_redis
+
+_log = logging.get_logger()
+
+# 句末标点（连同紧随的右括号/引号，避免把颜文字或引语拆开）
+_SEGMENT_END = re.compile(r'[。！？!?～~…\n]+[)）」』”"]*')
+# 多人轮次回复中每段开头的序号标记，如 [#2]
+_BURST_MARKER = re.compile(r'[\[【]#(\d+)[\]】]')
+
+
+def _split_segments(buffer: str) -> Tuple[List[str], str]:
+    """把缓冲区切分为若干完整句子与剩余的未完成部分"""
+    segments = []
+    start = 0
+    for match in _SEGMENT_END.finditer(buffer):
+        segment = buffer[start:match.end()].strip()
+        if segment:
+            segments.append(segment)
+        start = match.end()
+    return segments, buffer[start:]
+
+
+def _format_prefetched_context(context: dict, budget: int = Constant.CHAT_CONTEXT_MAX_CHARS) -> str:
+    """把预取的长期记忆与积分整理为系统提示片段，记忆总长度不超过 budget 字（用户画像优先）"""
+    lines = ["【已知上下文】（已是最新数据，相关问题直接据此回答，无需再调用 "
+             "queryUserLongMemory / queryGroupLongMemory / queryUserPoints）"]
+    if context["points"] is not None:
+        lines.append(f"• 当前积分：{context['points']}")
+
+    remaining = budget
+    for label, memory in (("用户画像", context["user_memory"]), ("群组画像", context["group_memory"])):
+        if memory is None:  # 私聊没有群组画像
+            continue
+        memory = memory.strip()
+        if not memory:
+            lines.append(f"• {label}：暂无")
+            continue
+        if remaining <= 0:
+            break
+        if len(memory) > remaining:
+            memory = memory[:remaining] + "…"
+        remaining -= len(memory)
+        lines.append(f"• {label}：{memory}")
+    return "\n".join(lines)
+
+
+def _split_burst_reply(reply: str) -> Dict[int, str]:
+    """把多人轮次的回复按 [#序号] 标记拆分为 {序号: 回复}"""
+    parts = {}
+    matches = list(_BURST_MARKER.finditer(reply))
+    for k, match in enumerate(matches):
+        end = matches[k + 1].start() if k + 1 < len(matches) else len(reply)
+        text = reply[match.end():end].strip()
+        if text:
+            parts[int(match.group(1))] = text
+    return parts
+
+
+class TimedSummarizationMiddleware(SummarizationMiddleware):
+    """记录摘要中间件（含触发的摘要模型调用）耗时"""
+
+    def before_model(self, state, runtime):
+        with span("summarization"):
+            return super().before_model(state, runtime)
+
+    async def abefore_model(self, state, runtime):
+        with span("summarization"):
+            return await super().abefore_model(state, runtime)
+
+
+class CircuitBreakerMiddleware(AgentMiddleware):
+    """
+    只对对话模型调用计入熔断器：工具执行、checkpointer 读写与摘要中间件都不计时，
+    一轮对话中的多次模型调用各自独立统计；熔断打开时抛出 CircuitOpen
+    """
+
+    def __init__(self, breaker):
+        super().__init__()
+        self.breaker = breaker
+
+    async def awrap_model_call(self, request, handler):
+        async with self.breaker.call():
+            return await handler(request)
 
 
 class ChatService:
     def __init__(self):
         # 延迟初始化 async 组件
         self._agent = None
+        self._chat_llm = None
         self._save_memory = None
         self._initialized = False
+        self._warmed_up = False
+        # 保证并发的首批请求只初始化一次智能体与 checkpointer
+        self._init_lock = asyncio.Lock()
+        self._user_service = UserService()
+        self._intent_router = IntentRouter(self._user_service)
+        # 同一 thread_id 的请求串行执行，避免并发读写同一个 checkpoint
+        self._conversation_locks = KeyedLock(Constant.CHAT_MAX_PENDING_PER_THREAD)
+        registry.register_collector(lambda: stats_samples(
+            "qqbot_conversation_locks", self._conversation_locks.stats(), counters=("rejected",)
+        ), name="conversation_locks")
 
     async def _initialize(self):
-        """在 asyncio loop 中安全初始化"""
+        """在 asyncio loop 中安全初始化（加锁，只执行一次）"""
         if self._initialized:
             return
+        async with self._init_lock:
+            if self._initialized:
+                return
+            await self._do_initialize()
 
-        # 1. 创建 Redis 客户端并初始化 Checkpointer
-        redis_client = redis.from_url(Constant.REDIS_CONN_STRING)
-        checkpointer = AsyncRedisSaver(redis_client=redis_client)
+    async def _do_initialize(self):
+        # 1. 使用共享 Redis 客户端初始化 Checkpointer
+        checkpointer = AsyncRedisSaver(redis_client=get_redis())
 
         await checkpointer.asetup()
 
-        # 2. 初始化模型
-        chat_llm = ChatOpenAI(
-            model=Constant.CHAT_MODEL_NAME,
-            api_key=Constant.DASHSCOPE_API_KEY,
-            base_url=Constant.DASHSCOPE_BASE_URL,
+        # 2. 初始化模型（共享同一个 HTTP 连接池）
+        chat_llm = create_hedged_chat_model(
+            model_names=Constant.CHAT_MODEL_NAMES,
             temperature=Constant.CHAT_TEMPERATURE,
             max_tokens=Constant.CHAT_MAX_TOKENS,
         )
 
-        summary_llm = ChatOpenAI(
+        summary_llm = create_chat_model(
             model=Constant.SUMMARY_MODEL_NAME,
-            api_key=Constant.DASHSCOPE_API_KEY,
-            base_url=Constant.DASHSCOPE_BASE_URL,
             temperature=Constant.SUMMARY_TEMPERATURE,
             max_tokens=Constant.SUMMARY_MAX_TOKENS,
         )
@@ -63,6 +167,7 @@ class ChatService:
             queryUserLongMemory,
             queryGroupLongMemory,
             queryUserPoints,
+            queryLeaderboard,
             addUserPoints,
             deductUserPoints,
             doCheckin,
@@ -74,30 +179,85 @@ class ChatService:
             model=chat_llm,
             tools=tools,
             middleware=[
-                SummarizationMiddleware(
+                TimedSummarizationMiddleware(
                     model=summary_llm,
                     trigger=[("tokens", Constant.SUMMARY_TOKENS_THRESHOLD),
                              ("messages", Constant.SUMMARY_MESSAGES_THRESHOLD)],
                     keep=("messages", Constant.SUMMARY_KEEP_MESSAGES),
-                )
+                ),
+                CircuitBreakerMiddleware(chat_breaker),
             ],
             checkpointer=checkpointer,
         )
 
+        self._chat_llm = chat_llm
+        # 熔断器半开时用极短的请求探测模型服务是否恢复
+        chat_breaker.probe = lambda: chat_llm.ainvoke("你好", max_tokens=1)
+        summary_breaker.probe = lambda: summary_llm.ainvoke("你好", max_tokens=1)
         self._save_memory = SaveMemory()
         self._initialized = True
 
-    async def chat(self, groupId: str = None, userId: str = None, message: str = None) -> str:
-        if not userId:
-            raise ValueError("userId is required")
+    async def warm_up(self):
+        """
+        启动预热（在 on_ready 中调用）：并发完成 MySQL 连接池、Redis 连接、智能体初始化，
+        并可选发送一次模型请求建立长连接，避免部署后的第一个用户承担这些耗时
+        网关每次重连都会触发 on_ready，只有第一次调用执行预热
+        """
+        if self._warmed_up:
+            return
+        self._warmed_up = True
 
-        await self._initialize()
+        async def step(name: str, coro):
+            start = time.perf_counter()
+            try:
+                result = await coro
+                if result is False:
+                    raise RuntimeError("health check returned False")
+                _log.info(f"预热 {name} 完成，耗时 {time.perf_counter() - start:.3f}s")
+            except Exception as e:
+                _log.warning(f"预热 {name} 失败，耗时 {time.perf_counter() - start:.3f}s: {e}")
+
+        async def warm_agent():
+            await step("agent", self._initialize())
+            if Constant.CHAT_WARMUP_LLM_ENABLED and self._chat_llm is not None:
+                await step("llm", self._chat_llm.ainvoke("你好", max_tokens=1))
 
+        start = time.perf_counter()
+        start_system_prompt_invalidation()
+        points_ledger.start()
+        await asyncio.gather(
+            step("mysql", self._user_service.db.ping()),
+            step("redis", get_redis().ping()),
+            warm_agent(),
+        )
+        _log.info(f"预热完成，总耗时 {time.perf_counter() - start:.3f}s")
+
+    async def close(self, timeout: float | None = None):
+        """等待后台摘要完成，未完成的放回临时记忆（应在应用退出时调用）"""
+        if self._save_memory is not None:
+            await self._save_memory.close(timeout)
+
+    async def _build_messages(self, groupId: str, userId: str, message: str) -> Tuple[str, List[BaseMessage]]:
+        """构造 thread_id 与本轮输入消息（系统提示 + 带上下文前缀的用户消息）"""
         thread_id = f"{groupId or 'private'}_{userId}"
 
         # 获取系统提示（保持你的调用方式）
-        actual_system_prompt = await UserService.getSystemPromptForUser(groupId or "private", userId)
+        context = None
+        if Constant.CHAT_CONTEXT_PREFETCH_ENABLED:
+            try:
+                with span("prefetch_context"):
+                    context = await self._user_service.prefetch_chat_context(groupId or "private", userId)
+            except Exception as e:
+                _log.warning(f"预取上下文失败，退回按需查询: {e}")
+
+        if context is not None:
+            actual_system_prompt = context["system_prompt"]
+        else:
+            with span("system_prompt"):
+                actual_system_prompt = await self._user_service.getSystemPromptForUser(groupId or "private", userId)
         actual_system_prompt += "\n\n" + Constant.CHAT_RULES_PROMPT
+        if context is not None:
+            actual_system_prompt += "\n\n" + _format_prefetched_context(context)
 
         # 注入上下文（完全保留你的逻辑）
         if groupId:
@@ -111,22 +271,278 @@ class ChatService:
             SystemMessage(content=actual_system_prompt),
             HumanMessage(content=message.strip() + contextualized_message)  # 按你写的保留
         ]
+        return thread_id, messages
 
-        # 异步调用智能体
-        response = await self._agent.ainvoke(
-            {"messages": messages},
-            config=RunnableConfig(configurable={"thread_id": thread_id}),
-        )
+    async def chat(self, groupId: str = None, userId: str = None, message: str = None) -> str:
+        if not userId:
+            raise ValueError("userId is required")
+
+        # 明确的签到/查分等请求直接处理，不调用 LLM
+        if Constant.INTENT_ROUTER_ENABLED:
+            with span("intent_router"):
+                reply = await self._intent_router.route(groupId, userId, message)
+            if reply is not None:
+                return reply
+
+        return await self._chat_agent(groupId, userId, message)
+
+    async def _chat_agent(self, groupId: str, userId: str, message: str) -> str:
+        """单条消息交给智能体处理并保存记忆"""
+        # 模型服务熔断期间直接降级，不再排队等待超时
+        try:
+            chat_breaker.check()
+        except CircuitOpen as e:
+            _log.warning(f"对话降级 group={groupId} user={userId}: {e}")
+            return Constant.CHAT_DEGRADED_REPLY
+
+        await self._initialize()
+
+        thread_id, messages = await self._build_messages(groupId, userId, message)
 
-        assistant_reply = response["messages"][-1].content
+        try:
+            assistant_reply = await self._invoke_agent(thread_id, messages)
+        except Overloaded as e:
+            _log.warning(f"对话 {thread_id} 被限流: {e}")
+            return Constant.CHAT_BUSY_REPLY
+        except CircuitOpen as e:
+            _log.warning(f"对话 {thread_id} 降级: {e}")
+            return Constant.CHAT_DEGRADED_REPLY
 
         # 保存记忆（假设 save 是 async）
-        await self._save_memory.save(
-            groupId=groupId,
-            userId=userId,
-            userMessage=message.strip(),
-            agentMessage=assistant_reply.strip(),
-        )
+        with span("save_memory"):
+            await self._save_memory.save(
+                groupId=groupId,
+                userId=userId,
+                userMessage=message.strip(),
+                agentMessage=assistant_reply.strip(),
+            )
+
+        return assistant_reply
+
+    async def _invoke_agent(self, thread_id: str, messages: List[BaseMessage]) -> str:
+        """按会话串行、经准入与熔断后调用智能体，返回最终回复；排队已满抛出 Overloaded，熔断抛出 CircuitOpen"""
+        async with self._conversation_locks.hold(thread_id) as lock_wait, chat_gate.admit() as gate_wait:
+            _log.info(f"对话 {thread_id} 排队等待 {lock_wait + gate_wait:.3f}s")
+            stage_seconds.observe(lock_wait + gate_wait, stage="queue_wait")
+            # 异步调用智能体
+            with span("agent"):
+                response = await self._agent.ainvoke(
+                    {"messages": messages},
+                    config=RunnableConfig(configurable={"thread_id": thread_id}),
+                )
+        return response["messages"][-1].content
+
+    async def chat_batch(self, groupId: str, entries: List[Tuple[str, str]]) -> List[str]:
+        """
+        群聊突发合并：同一群短时间内的多条 @ 消息作为一个多人发言轮次交给智能体，
+        按 [#序号] 拆分回复，返回与 entries 一一对应的回复
+        - 能走意图快速路由的消息单独处理；只剩一条时按普通对话处理
+        - 多人轮次使用群级会话 "<groupId>_burst" 与默认人设（各用户的自定义提示词无法同时生效）
+        - 回复中缺少某条消息的段落时，该消息退回单独调用智能体
+        :param entries: [(userId, message), ...]
+        """
+        replies: List[str | None] = [None] * len(entries)
+        pending = []
+        for i, (userId, message) in enumerate(entries):
+            if Constant.INTENT_ROUTER_ENABLED:
+                with span("intent_router"):
+                    replies[i] = await self._intent_router.route(groupId, userId, message)
+            if replies[i] is None:
+                pending.append(i)
+
+        if len(pending) == 1:
+            i = pending[0]
+            replies[i] = await self._chat_agent(groupId, *entries[i])
+        elif pending:
+            await self._chat_burst(groupId, entries, pending, replies)
+        return replies
+
+    async def _chat_burst(self, groupId: str, entries: List[Tuple[str, str]], pending: List[int],
+                          replies: List[str | None]):
+        try:
+            chat_breaker.check()
+        except CircuitOpen as e:
+            _log.warning(f"群 {groupId} 合并对话降级: {e}")
+            for i in pending:
+                replies[i] = Constant.CHAT_DEGRADED_REPLY
+            return
+
+        await self._initialize()
+
+        thread_id = f"{groupId}_burst"
+        lines = [f"[群组ID:{groupId}] 本轮共有 {len(pending)} 条消息："]
+        for n, i in enumerate(pending, start=1):
+            userId, message = entries[i]
+            lines.append(f"[#{n}|用户ID:{userId}] {message.strip()}")
+        messages = [
+            SystemMessage(content="\n\n".join(
+                (Constant.CHAT_PERSONA_PROMPT, Constant.CHAT_RULES_PROMPT, Constant.GROUP_BURST_PROMPT)
+            )),
+            HumanMessage(content="\n".join(lines)),
+        ]
+
+        try:
+            assistant_reply = await self._invoke_agent(thread_id, messages)
+        except (Overloaded, CircuitOpen) as e:
+            _log.warning(f"群 {groupId} 合并对话失败: {e}")
+            fallback = Constant.CHAT_BUSY_REPLY if isinstance(e, Overloaded) else Constant.CHAT_DEGRADED_REPLY
+            for i in pending:
+                replies[i] = fallback
+            return
+
+        parts = _split_burst_reply(assistant_reply)
+        missing = []
+        for n, i in enumerate(pending, start=1):
+            if parts.get(n):
+                replies[i] = parts[n]
+            else:
+                missing.append(i)
+        _log.info(f"群 {groupId} 合并 {len(pending)} 条消息为一次智能体调用，{len(missing)} 条未拆分出回复")
+
+        with span("save_memory"):
+            for i in pending:
+                if replies[i] is not None:
+                    userId, message = entries[i]
+                    await self._save_memory.save(
+                        groupId=groupId,
+                        userId=userId,
+                        userMessage=message.strip(),
+                        agentMessage=replies[i].strip(),
+                    )
+
+        if missing:
+            results = await asyncio.gather(*(self._chat_agent(groupId, *entries[i]) for i in missing))
+            for i, reply in zip(missing, results):
+                replies[i] = reply
+
+    async def chat_stream(
+            self,
+            send: Callable[[str, int], Awaitable[None]],
+            groupId: str = None,
+            userId: str = None,
+            message: str = None,
+    ) -> str:
+        """
+        流式回复：基于智能体的 astream 事件，首个完整句子就绪后立即发送，其余分批发送。
+        出错时由本方法发送提示（msg_seq 接着已发送的条数），不向调用方抛出异常。
+        :param send: 异步发送函数 send(内容, msg_seq)，msg_seq 从 1 开始递增
+        :return: 完整回复（流结束后才保存记忆）
+        """
+        if not userId:
+            raise ValueError("userId is required")
+
+        if Constant.INTENT_ROUTER_ENABLED:
+            with span("intent_router"):
+                reply = await self._intent_router.route(groupId, userId, message)
+            if reply is not None:
+                await send(reply, 1)
+                return reply
+
+        try:
+            chat_breaker.check()
+        except CircuitOpen as e:
+            _log.warning(f"对话降级 group={groupId} user={userId}: {e}")
+            await send(Constant.CHAT_DEGRADED_REPLY, 1)
+            return Constant.CHAT_DEGRADED_REPLY
+
+        first_sent_at = None
+        last_sent_at = 0.0
+        seq = 0
+        sent_parts = []
+        ready = []  # 已完整但尚未发送的句子
+        buffer = ""
+        thread_id = None
+
+        async def flush(parts: List[str]):
+            nonlocal seq, first_sent_at, last_sent_at
+            content = "".join(parts).strip()
+            if not content:
+                return
+            seq += 1
+            await send(content, seq)
+            sent_parts.append(content)
+            last_sent_at = time.perf_counter()
+            if first_sent_at is None:
+                first_sent_at = last_sent_at
+
+        async def reply_error(content: str) -> str:
+            # 可能已发出部分片段，同一 msg_id 下的 msg_seq 不能重复
+            try:
+                await send(content, seq + 1)
+            except Exception as e:
+                _log.error(f"对话 {thread_id} 发送错误提示失败: {e}")
+            return content
+
+        try:
+            await self._initialize()
+            thread_id, messages = await self._build_messages(groupId, userId, message)
+
+            async with self._conversation_locks.hold(thread_id) as lock_wait, chat_gate.admit() as gate_wait:
+                _log.info(f"对话 {thread_id} 排队等待 {lock_wait + gate_wait:.3f}s")
+                stage_seconds.observe(lock_wait + gate_wait, stage="queue_wait")
+                start = last_sent_at = time.perf_counter()
+                async for chunk, metadata in self._agent.astream(
+                        {"messages": messages},
+                        config=RunnableConfig(configurable={"thread_id": thread_id}),
+                        stream_mode="messages",
+                ):
+                    # 只转发主模型节点的文本输出（忽略工具结果与摘要中间件的模型调用）
+                    if metadata.get("langgraph_node") != "model" or not isinstance(chunk, AIMessageChunk):
+                        continue
+                    if not isinstance(chunk.content, str) or not chunk.content:
+                        continue
+
+                    segments, buffer = _split_segments(buffer + chunk.content)
+                    ready.extend(segments)
+                    if not ready:
+                        continue
+
+                    # 被动回复条数有限，最后一条留到流结束时发送
+                    if seq + 1 >= Constant.STREAM_MAX_MESSAGES:
+                        continue
+
+                    pending = "".join(ready)
+                    if seq == 0:
+                        if len(pending) < Constant.STREAM_FIRST_SEGMENT_MIN_CHARS:
+                            continue
+                    elif (len(pending) < Constant.STREAM_BATCH_MIN_CHARS
+                          and time.perf_counter() - last_sent_at < Constant.STREAM_BATCH_INTERVAL):
+                        continue
+
+                    await flush(ready)
+                    ready = []
+
+                await flush(ready + [buffer])
+        except Overloaded as e:
+            _log.warning(f"对话 {thread_id} 被限流: {e}")
+            return await reply_error(Constant.CHAT_BUSY_REPLY)
+        except CircuitOpen as e:
+            _log.warning(f"对话 {thread_id} 降级: {e}")
+            return await reply_error(Constant.CHAT_DEGRADED_REPLY)
+        except Exception as e:
+            _log.error(f"流式对话出错 (group={groupId}, user={userId}, 已发送 {seq} 条): {e}", exc_info=True)
+            return await reply_error(Constant.CHAT_ERROR_REPLY)
+
+        total = time.perf_counter() - start
+        ttfr = (first_sent_at - start) if first_sent_at is not None else total
+        _log.info(f"流式回复 thread={thread_id} 首条耗时 {ttfr:.2f}s，总耗时 {total:.2f}s，共 {seq} 条")
+        stage_seconds.observe(ttfr, stage="stream_first_reply")
+        stage_seconds.observe(total, stage="agent")
+
+        # 各片段是分条发送的，保存时按行分隔
+        assistant_reply = "\n".join(sent_parts)
+
+        # 流结束后再保存记忆（回复已全部发出，保存失败只记录日志）
+        try:
+            with span("save_memory"):
+                await self._save_memory.save(
+                    groupId=groupId,
+                    userId=userId,
+                    userMessage=message.strip(),
+                    agentMessage=assistant_reply.strip(),
+                )
+        except Exception as e:
+            _log.error(f"对话 {thread_id} 保存记忆失败: {e}", exc_info=True)
 
         return assistant_reply
 
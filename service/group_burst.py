@@ -0,0 +1,100 @@
+# service/group_burst.py
+import asyncio
+from typing import Dict, List, Tuple
+
+from botpy import logging
+
+from service.chat_service import ChatService
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+
+_log = logging.get_logger()
+
+
+class _Burst:
+    __slots__ = ("entries", "futures", "full", "task")
+
+    def __init__(self):
+        self.entries: List[Tuple[str, str]] = []
+        self.futures: List[asyncio.Future] = []
+        self.full = asyncio.Event()
+        self.task: asyncio.Task | None = None
+
+
+class GroupBurstCoalescer:
+    """
+    群聊突发合并（微批）
+    - 每个群的第一条消息开启一个 window_ms 的收集窗口，窗口内到达的消息加入同一批；
+      攒满 max_messages 条时立即处理
+    - 整批交给 ChatService.chat_batch，作为一个多人发言轮次调用一次智能体，
+      每条消息的调用方拿到属于自己的那段回复（再用各自的 msg_id 回复）
+    - 单条消息额外等待不超过 window_ms
+    """
+
+    def __init__(self, chat_service: ChatService, window_ms: int = Constant.GROUP_BURST_WINDOW_MS,
+                 max_messages: int = Constant.GROUP_BURST_MAX_MESSAGES):
+        self._chat_service = chat_service
+        self.window = window_ms / 1000
+        self.max_messages = max_messages
+        self._bursts: Dict[str, _Burst] = {}
+        self.batches = 0
+        self.messages = 0
+        self.merged_messages = 0  # 与其他消息合并处理的消息数
+        registry.register_collector(lambda: stats_samples(
+            "qqbot_group_burst", self.stats(), counters=("batches", "messages", "merged_messages")
+        ), name="group_burst")
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    async def submit(self, groupId: str, userId: str, message: str) -> str:
+        """加入所在群的当前批次，等待并返回该消息的回复"""
+        burst = self._bursts.get(groupId)
+        if burst is None:
+            burst = self._bursts[groupId] = _Burst()
+            burst.task = asyncio.create_task(self._run(groupId, burst))
+
+        future = asyncio.get_running_loop().create_future()
+        burst.entries.append((userId, message))
+        burst.futures.append(future)
+        if len(burst.entries) >= self.max_messages:
+            # 批次已满：后续消息开启新批次
+            self._bursts.pop(groupId, None)
+            burst.full.set()
+        return await future
+
+    async def _run(self, groupId: str, burst: _Burst):
+        try:
+            await asyncio.wait_for(burst.full.wait(), timeout=self.window)
+        except asyncio.TimeoutError:
+            pass
+        if self._bursts.get(groupId) is burst:
+            del self._bursts[groupId]
+
+        self.batches += 1
+        self.messages += len(burst.entries)
+        if len(burst.entries) > 1:
+            self.merged_messages += len(burst.entries)
+            _log.info(f"群 {groupId} 合并 {len(burst.entries)} 条消息")
+
+        try:
+            replies = await self._chat_service.chat_batch(groupId, burst.entries)
+        except Exception as e:
+            for future in burst.futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, reply in zip(burst.futures, replies):
+            if not future.done():
+                future.set_result(reply)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "messages": self.messages,
+            "merged_messages": self.merged_messages,
+            "messages_per_batch": self.messages / self.batches if self.batches else 0.0,
+            "open_bursts": len(self._bursts),
+        }
+
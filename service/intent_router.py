@@ -0,0 +1,132 @@
+# service/intent_router.py
+import random
+import re
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from botpy import logging
+
+from service.user_service import UserService
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+
+_log = logging.get_logger()
+
+# 归一化时去掉的字符：空白、标点、语气词、颜文字常用符号
+_NOISE = re.compile(r"[\s\W_]+|[呀啊呐啦吧哈嘛呢哦噢喔嗯～~]+")
+# 含有这些词的消息通常是在讨论而不是下指令（如“签到有什么用”），交给智能体
+_DISCUSSION = re.compile(r"怎么|为什么|为啥|什么是|如何|规则|不要|别|不想|没有用|有什么用|能不能|可以吗|吗")
+
+IntentHandler = Callable[[UserService, str, str], Awaitable[str]]
+
+
+class _Intent:
+    __slots__ = ("name", "handler", "patterns")
+
+    def __init__(self, name: str, handler: IntentHandler, patterns: List[str]):
+        self.name = name
+        self.handler = handler
+        # 必须完整匹配归一化后的整条消息；只含关键词的消息（如“扣积分”“积分榜”）可能另有所指，交给智能体
+        self.patterns = [re.compile(p) for p in patterns]
+
+    def matches(self, text: str) -> bool:
+        return any(p.fullmatch(text) for p in self.patterns)
+
+
+_INTENTS = [
+    _Intent(
+        "checkin",
+        lambda service, gid, uid: service.handle_checkin(gid, uid),
+        patterns=[r"(我要|帮我|给我)?(打卡)?签到(一下)?(打卡)?", r"(我要)?(每日)?打卡"],
+    ),
+    _Intent(
+        "points",
+        lambda service, gid, uid: service.handle_query_points(gid, uid),
+        # 只说“几分”“多少分”时必须有“我”，避免把问时间（“现在几分了”）当成查积分
+        patterns=[r"(查询?|看看?)(一下)?(我的?)?(现在|当前|目前)?积分",
+                  r"(我的?)?(现在|当前|目前)?积分(是|有)?(多少)?(了)?",
+                  r"我(的)?(现在|当前|目前)?(有)?(多少|几)(个)?积分(了)?",
+                  r"我(现在|当前|目前)?(有)?多少分(了)?",
+                  r"points?"],
+    ),
+    _Intent(
+        "leaderboard",
+        lambda service, gid, uid: service.handle_leaderboard(gid, uid),
+        patterns=[r"(查询?|看看?)?(一下)?(积分)?(排行榜?|排名|榜单)",
+                  r"(查询?|看看?)?(一下)?积分榜",
+                  r"我?(现在)?(排)?第几名(了)?",
+                  r"我?(现在)?排第几(了)?",
+                  r"rank(ing)?"],
+    ),
+    _Intent(
+        "help",
+        lambda service, gid, uid: service.handle_help(),
+        patterns=[r"帮助", r"help", r"菜单", r"(有)?(哪些|什么)(指令|命令|功能)", r"(你)?能(做|干)什么"],
+    ),
+]
+
+
+def _normalize(message: str) -> str:
+    return _NOISE.sub("", message).casefold()
+
+
+class IntentRouter:
+    """
+    智能体前置的轻量意图路由
+    - 整条消息与某个意图的模式完整匹配时，直接调用 UserService 处理，套用人设模板回复
+    - 含疑问、否定等讨论性措辞或没有完整匹配的消息返回 None，交给智能体
+    - 统计命中率与节省的 LLM 调用次数
+    """
+
+    def __init__(self, user_service: UserService):
+        self._user_service = user_service
+        self.total = 0
+        self.hits: Dict[str, int] = {intent.name: 0 for intent in _INTENTS}
+        self.errors = 0
+        registry.register_collector(self._collect, name="intent_router")
+
+    @staticmethod
+    def classify(message: str) -> Optional[str]:
+        """返回完整匹配的意图名；无匹配时为 None"""
+        text = _normalize(message or "")
+        if not text or _DISCUSSION.search(message):
+            return None
+        return next((intent.name for intent in _INTENTS if intent.matches(text)), None)
+
+    async def route(self, groupId: str, userId: str, message: str) -> str | None:
+        """命中时返回回复内容，否则返回 None（调用方继续走智能体）"""
+        self.total += 1
+        name = self.classify(message)
+        if name is None:
+            return None
+
+        intent = next(i for i in _INTENTS if i.name == name)
+        try:
+            result = await intent.handler(self._user_service, groupId, userId)
+        except Exception as e:
+            # 处理失败交给智能体兜底
+            self.errors += 1
+            _log.warning(f"意图快速路由处理失败 intent={name}: {e}")
+            return None
+
+        self.hits[name] += 1
+        _log.info(f"意图快速路由命中 intent={name}")
+        templates = Constant.INTENT_REPLY_TEMPLATES.get(name)
+        return random.choice(templates).format(result=result) if templates else result
+
+    def stats(self) -> dict:
+        hit_total = sum(self.hits.values())
+        return {
+            "total": self.total,
+            "hits": hit_total,
+            "hit_rate": hit_total / self.total if self.total else 0.0,
+            "llm_calls_saved": hit_total * Constant.INTENT_LLM_CALLS_SAVED,
+            "errors": self.errors,
+            "by_intent": dict(self.hits),
+        }
+
+    def _collect(self):
+        yield from stats_samples(
+            "qqbot_intent_router", self.stats(), counters=("total", "hits", "llm_calls_saved", "errors")
+        )
+        for name, count in self.hits.items():
+            yield "qqbot_intent_router_intent_hits_total", "counter", "意图快速路由各意图命中次数", {"intent": name}, count
@@ -0,0 +1,226 @@
+# service/shard_worker.py
+import asyncio
+import json
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Set
+
+from botpy import logging
+from redis.exceptions import ResponseError
+
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+from utils.redis_client import get_redis
+from utils.sharding import ShardLeaseManager, shard_of, stream_key
+
+_log = logging.get_logger()
+
+EventHandler = Callable[[dict], Awaitable[None]]
+
+
+def event_shard(event: dict) -> int:
+    """群消息按群分片，私聊按用户分片：同一会话的消息总落在同一分片、由同一 worker 处理"""
+    return shard_of(event["gid"] if event["kind"] == "group" else event["uid"])
+
+
+async def publish_event(event: dict):
+    """网关进程调用：把一条消息事件写入其所属分片的事件流"""
+    await get_redis().xadd(
+        stream_key(event_shard(event)),
+        {"event": json.dumps(event, ensure_ascii=False)},
+        maxlen=Constant.SCALEOUT_STREAM_MAXLEN,
+        approximate=True,
+    )
+
+
+class ShardWorker:
+    """
+    分片消费者：持有哪些分片的租约就消费哪些分片的事件流
+    - 消费组 + XACK：处理完才确认；worker 崩溃后，接管分片的 worker 通过 XAUTOCLAIM 收回未确认的消息（至少一次）
+    - 交还分片前等本轮读取结束、且该分片已读出的消息全部确认，避免同一会话同时在两个 worker 上执行；
+      接管主动交还的分片时不抢占未确认消息，只有原租约过期（原持有者失联）时才立即收回
+    """
+
+    def __init__(self, worker_id: str, handler: EventHandler,
+                 concurrency: int = Constant.SCALEOUT_WORKER_CONCURRENCY):
+        self.worker_id = worker_id
+        self._handler = handler
+        self._redis = get_redis()
+        self._leases = ShardLeaseManager(worker_id)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._active: Set[int] = set()  # 正在消费的分片（已持有且未在交还中）
+        self._inflight: Dict[str, int] = {}  # 在途消息 id -> 分片
+        # 各分片已读出（或已收回）但尚未确认的消息数，从读出起计，包括还在等待并发名额的消息
+        self._unacked: Dict[int, int] = defaultdict(int)
+        self._draining: Set[int] = set()
+        self._reading = False  # 是否有一轮 XREADGROUP 及其消息分发正在进行
+        self._read_rounds = 0  # 已完成的读取轮数
+        self._tasks: Set[asyncio.Task] = set()
+        self._stopping = asyncio.Event()
+        self._stats = {
+            "handled": 0,
+            "failed": 0,
+            "claimed": 0,
+            "shards_acquired": 0,
+            "shards_lost": 0,
+            "shards_released": 0,
+        }
+        registry.register_collector(self._collect, name="shard_worker")
+
+    def stats(self) -> dict:
+        return {
+            **self._stats,
+            "owned_shards": len(self._leases.owned),
+            "inflight": len(self._inflight),
+        }
+
+    def _collect(self):
+        return stats_samples(
+            "qqbot_shard_worker", self.stats(), {"worker": self.worker_id},
+            counters=("handled", "failed", "claimed", "shards_acquired", "shards_lost", "shards_released"),
+        )
+
+    async def run(self):
+        await self._rebalance()
+        lease_task = asyncio.create_task(self._lease_loop())
+        try:
+            await self._consume_loop()
+        finally:
+            lease_task.cancel()
+            if self._tasks:
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+            await self._leases.release_all()
+            _log.info(f"worker {self.worker_id} 已退出并释放全部分片")
+
+    def stop(self):
+        self._stopping.set()
+
+    async def _lease_loop(self):
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._stopping.wait(), Constant.SCALEOUT_LEASE_RENEW_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            if self._stopping.is_set():
+                return
+            try:
+                await self._rebalance()
+            except Exception as e:
+                _log.error(f"worker {self.worker_id} 分片再均衡失败: {e}")
+
+    async def _rebalance(self):
+        acquired, lost, surplus = await self._leases.rebalance()
+        self._active -= lost
+        self._stats["shards_lost"] += len(lost)
+        for shard in acquired:
+            await self._ensure_group(shard)
+            self._active.add(shard)
+        self._stats["shards_acquired"] += len(acquired)
+        if acquired:
+            _log.info(f"worker {self.worker_id} 认领分片 {sorted(acquired)}，共持有 {len(self._leases.owned)} 个")
+        # 收回之前持有者未确认的消息：原租约过期说明原持有者已失联，无需再等待空闲时间；
+        # 主动交还的分片上原持有者已全部确认，剩下的只可能是更早失联者遗留的，按正常空闲时间收回
+        for shard in list(self._active):
+            min_idle = 0 if acquired.get(shard) else Constant.SCALEOUT_LEASE_TTL_MS
+            await self._claim_pending(shard, min_idle)
+        for shard in surplus:
+            if shard in self._draining:
+                continue
+            self._active.discard(shard)
+            self._draining.add(shard)
+            task = asyncio.create_task(self._drain_and_release(shard))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _ensure_group(self, shard: int):
+        try:
+            await self._redis.xgroup_create(
+                stream_key(shard), Constant.SCALEOUT_CONSUMER_GROUP, id="0", mkstream=True
+            )
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _claim_pending(self, shard: int, min_idle: int):
+        start = "0-0"
+        while True:
+            start, entries, *_ = await self._redis.xautoclaim(
+                stream_key(shard), Constant.SCALEOUT_CONSUMER_GROUP, self.worker_id,
+                min_idle_time=min_idle, start_id=start, count=Constant.SCALEOUT_READ_COUNT,
+            )
+            for entry_id, fields in entries:
+                if entry_id in self._inflight or fields is None:
+                    continue
+                self._stats["claimed"] += 1
+                self._unacked[shard] += 1
+                await self._spawn(shard, entry_id, fields)
+            if start == "0-0":
+                return
+
+    async def _drain_and_release(self, shard: int):
+        try:
+            # 分片移出 _active 时可能正有一轮读取在进行，其结果里可能还有该分片的消息
+            if self._reading:
+                started = self._read_rounds
+                while self._read_rounds == started:
+                    await asyncio.sleep(0.05)
+            while self._unacked[shard]:
+                await asyncio.sleep(0.05)
+            if shard in self._leases.owned:
+                await self._leases.release(shard)
+                self._stats["shards_released"] += 1
+                _log.info(f"worker {self.worker_id} 交还分片 {shard}")
+        finally:
+            self._draining.discard(shard)
+
+    async def _consume_loop(self):
+        while not self._stopping.is_set():
+            if not self._active:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), Constant.SCALEOUT_READ_BLOCK_MS / 1000)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self._reading = True
+            try:
+                response = await self._redis.xreadgroup(
+                    Constant.SCALEOUT_CONSUMER_GROUP, self.worker_id,
+                    {stream_key(shard): ">" for shard in self._active},
+                    count=Constant.SCALEOUT_READ_COUNT, block=Constant.SCALEOUT_READ_BLOCK_MS,
+                )
+                batches = [(int(key.rsplit(":", 1)[1]), entries) for key, entries in response or []]
+                for shard, entries in batches:
+                    self._unacked[shard] += len(entries)
+                for shard, entries in batches:
+                    for entry_id, fields in entries:
+                        await self._spawn(shard, entry_id, fields)
+            except Exception as e:
+                _log.error(f"worker {self.worker_id} 读取事件流失败: {e}")
+                await asyncio.sleep(1)
+                continue
+            finally:
+                self._reading = False
+                self._read_rounds += 1
+
+    async def _spawn(self, shard: int, entry_id: str, fields: dict):
+        await self._semaphore.acquire()
+        self._inflight[entry_id] = shard
+        task = asyncio.create_task(self._handle(shard, entry_id, fields))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _handle(self, shard: int, entry_id: str, fields: dict):
+        try:
+            await self._handler(json.loads(fields["event"]))
+            self._stats["handled"] += 1
+        except Exception as e:
+            self._stats["failed"] += 1
+            _log.error(f"worker {self.worker_id} 处理事件 {entry_id} 出错: {e}", exc_info=True)
+        finally:
+            # 处理出错也确认：错误已回复给用户，重试只会重复回复
+            try:
+                await self._redis.xack(stream_key(shard), Constant.SCALEOUT_CONSUMER_GROUP, entry_id)
+            except Exception as e:
+                _log.error(f"worker {self.worker_id} 确认事件 {entry_id} 失败: {e}")
+            self._inflight.pop(entry_id, None)
+            self._unacked[shard] -= 1
+            self._semaphore.release()
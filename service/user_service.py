@@ -1,21 +1,24 @@
 # service/user_service.py
-from datetime import date, timedelta
+from datetime import date
 from botpy import logging
-import redis.asyncio as redis
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
 import asyncio
 
 from mapper.database import Database
+from mapper.leaderboard import leaderboard
+from mapper.points_ledger import points_ledger
+from utils.admission import summary_gate
+from utils.circuit_breaker import CircuitOpen, summary_breaker
+from utils.cache import LRUCache
 from utils.constant import Constant
+from utils.llm_factory import create_chat_model
+from utils.redis_client import batch, get_redis
 
-# 初始化异步 Redis 客户端
-_redis_client = redis.from_url(Constant.REDIS_CONN_STRING)
+# 共享异步 Redis 客户端（decode_responses=True）
+_redis_client = get_redis()
 
-_update_llm = ChatOpenAI(
+_update_llm = create_chat_model(
     model=Constant.SUMMARY_MODEL_NAME,
-    api_key=Constant.DASHSCOPE_API_KEY,
-    base_url=Constant.DASHSCOPE_BASE_URL,
     temperature=Constant.SUMMARY_TEMPERATURE,
     max_tokens=Constant.SUMMARY_MAX_TOKENS,
 )
@@ -27,86 +30,84 @@ def _get_user_long_key(group_id: str, user_id: str) -> str:
     return f"{Constant.REDIS_USER_MEMORY_KEY}:{group_id}:{user_id}"
 
 
-class UserService:
-    def __init__(self, db: Database = Database()):
-        self.db = db
+def _get_group_long_key(group_id: str) -> str:
+    return f"{Constant.REDIS_GROUP_MEMORY_KEY}:{group_id}"
 
-    async def handle_checkin(self, group_id: str, user_id: str) -> str:
-        today = date.today()
-        yesterday = today - timedelta(days=1)
 
-        # 查询已有记录（异步）
-        record = await self.db.get_checkin_record(user_id, group_id)
+def _is_private(group_id: str | None) -> bool:
+    """私聊消息的 groupId 为 "PRIVATE"（main.py）或 "private"（ChatService），所有私聊共用同一个占位群号"""
+    return not group_id or group_id.lower() == "private"
 
-        if record and record['last_checkin_date'] == today:
-            return "你今天已经签到过了！"
 
-        if record is None:
-            total_days = 1
-            streak_days = 1
-        else:
-            last_date_str = record['last_checkin_date']
-
-            # --- 安全解析 last_checkin_date ---
-            last_date = None
-            if last_date_str:
-                # 过滤掉 MySQL 的无效日期 '0000-00-00'
-                if last_date_str != '0000-00-00':
-                    try:
-                        last_date = datetime.strptime(last_date_str, '%Y-%m-%d').date()
-                    except (ValueError, TypeError):
-                        last_date = None  # 解析失败也视为未签到
-
-            total_days = record['total_days'] + 1
-
-            if last_date is None:
-                streak_days = 1
-            elif last_date == yesterday:
-                streak_days = record['streak_days'] + 1
-            elif last_date < yesterday:
-                streak_days = 1
-            else:
-                # last_date == today（重复签到）或未来日期（异常）
-                streak_days = record['streak_days']
-                total_days = record['total_days']  # 不增加总天数
-
-        # 更新数据库（异步）
-        success = await self.db.add_or_update_checkin(
-            user_id=user_id,
-            group_id=group_id,
-            checkin_date=today,
-            total_days=total_days,
-            streak_days=streak_days
-        )
-        if not success:
-            return "签到失败，请稍后再试。"
+def _get_system_prompt_key(group_id: str, user_id: str) -> str:
+    return f"{Constant.REDIS_USER_SYSTEM_PROMPT_KEY}:{group_id}:{user_id}"
+
+
+# 系统提示词进程内缓存：(group_id, user_id) → 自定义提示词，None 表示没有自定义（负缓存）
+_system_prompt_cache = LRUCache(Constant.SYSTEM_PROMPT_CACHE_SIZE, ttl=Constant.SYSTEM_PROMPT_CACHE_TTL)
+_MISSING = object()
+_invalidation_task: asyncio.Task | None = None
 
-        # 计算积分
-        bonus = 0
-        points_delta = Constant.CHECKIN_POINTS
 
-        for days, extra in Constant.STREAK_BONUS.items():
-            if streak_days == days:
-                bonus = extra
-                points_delta += bonus
-                break
+async def _listen_system_prompt_invalidation():
+    """订阅系统提示词失效通知，其他进程修改提示词后立即丢弃本地缓存"""
+    while True:
+        pubsub = _redis_client.pubsub()
+        try:
+            await pubsub.subscribe(Constant.REDIS_SYSTEM_PROMPT_INVALIDATE_CHANNEL)
+            # (重新)订阅前可能错过了通知，清空本地缓存
+            _system_prompt_cache.clear()
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                group_id, _, user_id = message["data"].partition(":")
+                _system_prompt_cache.pop((group_id, user_id))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            _log.warning(f"系统提示词失效订阅中断，5 秒后重连: {e}")
+            _system_prompt_cache.clear()
+            await asyncio.sleep(5)
+        finally:
+            await pubsub.aclose()
 
-        await self.db.create_or_update_user_status(user_id, group_id, is_reusable=True)
-        await self.db.add_user_points(user_id, group_id, points_delta)
 
-        points = await self.db.get_user_points(user_id, group_id) or 0
+def start_system_prompt_invalidation():
+    """启动失效订阅（需在事件循环中调用，重复调用无副作用）"""
+    global _invalidation_task
+    if _invalidation_task is None or _invalidation_task.done():
+        _invalidation_task = asyncio.create_task(_listen_system_prompt_invalidation())
+
+
+class UserService:
+    def __init__(self, db: Database = Database()):
+        self.db = db
+
+    async def handle_checkin(self, group_id: str, user_id: str) -> str:
+        # 签到、积分发放与余额查询在一个事务、一次往返内完成
+        try:
+            result = await self.db.checkin(user_id, group_id, date.today())
+        except Exception as e:
+            _log.error(f"签到失败 - group:{group_id} user:{user_id}, error: {e}")
+            return "签到失败，请稍后再试。"
+
+        if not result["checked_in"]:
+            return "你今天已经签到过了！"
+
+        bonus = result["bonus"]
+        streak_days = result["streak_days"]
 
         reply = f"签到成功！+{Constant.CHECKIN_POINTS} 积分"
         if bonus > 0:
             reply += f"\n连续签到 {streak_days} 天！额外奖励 +{bonus} 积分"
-        reply += f"\n当前积分：{points}"
-        reply += f"\n累计签到：{total_days} 天"
+        reply += f"\n当前积分：{result['points']}"
+        reply += f"\n累计签到：{result['total_days']} 天"
         reply += f"\n连续签到：{streak_days} 天"
 
         return reply
 
     async def handle_query_points(self, group_id: str, user_id: str) -> str:
-        points = await self.db.get_user_points(user_id, group_id)
+        points = await points_ledger.balance(user_id, group_id)
         record = await self.db.get_checkin_record(user_id, group_id)
 
         if points is None and record is None:
@@ -122,13 +123,31 @@ class UserService:
 
         return "\n".join(lines) if lines else "暂无数据"
 
+    async def handle_leaderboard(self, group_id: str, user_id: str, top_n: int = Constant.LEADERBOARD_TOP_N) -> str:
+        top, (rank, points, total) = await asyncio.gather(
+            leaderboard.top(self.db, group_id, top_n),
+            leaderboard.rank(self.db, group_id, user_id),
+        )
+        if not top:
+            return "本群还没有积分记录。发送“/签到”开始吧！"
+
+        lines = [f"积分排行榜（共 {total} 人）"]
+        for i, (member_id, member_points) in enumerate(top, start=1):
+            # openid 不含昵称，只展示首尾几位用于区分
+            name = "你" if member_id == user_id else f"{member_id[:4]}…{member_id[-4:]}"
+            lines.append(f"{i}. {name}：{member_points} 分")
+        if rank is not None and rank > top_n:
+            lines.append(f"你的排名：第 {rank} 名（{points} 分）")
+
+        return "\n".join(lines)
+
     async def queryUserLongMemory(self, groupId: str, userId: str) -> str:
         _log.info(f"查询用户 {userId} 的长期记忆")
         key = _get_user_long_key(groupId, userId)
         memory = await _redis_client.get(key)
 
         if memory:
-            return memory.decode("utf-8")
+            return memory
         else:
             return "暂无关于该用户的长期记忆。"
 
@@ -143,8 +162,7 @@ class UserService:
 
     async def updateUserLongMemory(self, groupId: str, userId: str, update_instruction: str) -> str:
         key = _get_user_long_key(groupId, userId)
-        current_memory = await _redis_client.get(key)
-        current_memory_str = current_memory.decode("utf-8") if current_memory else ""
+        current_memory_str = await _redis_client.get(key) or ""
 
         if current_memory_str:
             prompt = (
@@ -166,47 +184,107 @@ class UserService:
             )
 
         try:
-            response = await _update_llm.ainvoke([HumanMessage(content=prompt)])  # ✅ ainvoke
+            async with summary_gate.admit(), summary_breaker.call():
+                response = await _update_llm.ainvoke([HumanMessage(content=prompt)])  # ✅ ainvoke
             new_profile = response.content.strip()
 
             await _redis_client.set(key, new_profile)
             return f"用户画像已更新。新画像：{new_profile}"
+        except CircuitOpen:
+            return "模型服务暂时不可用，请稍后再试。"
         except Exception as e:
             _log.error(f"更新用户画像失败 - group:{groupId} user:{userId}, error: {e}")
             return "更新失败，请稍后再试。"
 
     async def getSystemPromptForUser(self, groupId: str, userId: str) -> str:
-        cache_key = f"{Constant.REDIS_USER_SYSTEM_PROMPT_KEY}:{groupId}:{userId}"
-        cached = await _redis_client.get(cache_key)
-        if cached:
-            return cached.decode("utf-8")
-
-        prompt_from_db = await self.db.get_user_system_prompt(userId, groupId)
-        if prompt_from_db:
-            await _redis_client.setex(cache_key, 3600, prompt_from_db)
-            return prompt_from_db
+        """
+        两级缓存：进程内 TTL/LRU → Redis → MySQL
+        没有自定义提示词的用户同样缓存（Redis 中存空字符串），热路径通常无需网络 I/O
+        """
+        start_system_prompt_invalidation()
+
+        local_key = (groupId, userId)
+        prompt = _system_prompt_cache.get(local_key, _MISSING)
+        if prompt is not _MISSING:
+            return prompt or Constant.CHAT_PERSONA_PROMPT
+
+        cached = await _redis_client.get(_get_system_prompt_key(groupId, userId))
+        prompt = await self._resolve_system_prompt(groupId, userId, cached)
+        return prompt or Constant.CHAT_PERSONA_PROMPT
+
+    async def _resolve_system_prompt(self, groupId: str, userId: str, cached: str | None) -> str | None:
+        """根据 Redis 中读到的值确定自定义提示词（未命中时回源 MySQL 并回填），并写入本地缓存"""
+        if cached is not None:
+            prompt = cached or None
         else:
-            return Constant.CHAT_PERSONA_PROMPT
+            cache_key = _get_system_prompt_key(groupId, userId)
+            prompt = await self.db.get_user_system_prompt(userId, groupId) or None
+            if prompt:
+                await _redis_client.setex(cache_key, 3600, prompt)
+            else:
+                await _redis_client.setex(cache_key, Constant.SYSTEM_PROMPT_NEGATIVE_TTL, "")
+
+        _system_prompt_cache.set((groupId, userId), prompt)
+        return prompt
+
+    async def prefetch_chat_context(self, groupId: str, userId: str) -> dict:
+        """
+        对话前并发预取上下文：一次 Redis 管道（系统提示词、用户/群组长期记忆、待刷盘积分）
+        与一次 MySQL 查询（已落盘积分）同时进行
+        :return: {"system_prompt", "user_memory", "group_memory", "points"}，积分无记录时为 None；
+                 私聊时 group_memory 为 None：占位群号下的"群记忆"是所有用户私聊的摘要，不能注入给任何人
+        """
+        start_system_prompt_invalidation()
+
+        prompt = _system_prompt_cache.get((groupId, userId), _MISSING)
+        commands = {
+            "user_memory": ("GET", _get_user_long_key(groupId, userId)),
+            "pending": points_ledger.pending_command(userId, groupId),
+        }
+        is_group = not _is_private(groupId)
+        if is_group:
+            commands["group_memory"] = ("GET", _get_group_long_key(groupId))
+        if prompt is _MISSING:
+            commands["prompt"] = ("GET", _get_system_prompt_key(groupId, userId))
+
+        values, committed = await asyncio.gather(
+            batch(*commands.values()),
+            self.db.get_user_points(userId, groupId),
+        )
+        results = dict(zip(commands, values))
+
+        if prompt is _MISSING:
+            prompt = await self._resolve_system_prompt(groupId, userId, results["prompt"])
+
+        pending = int(results["pending"]) if results["pending"] else 0
+        return {
+            "system_prompt": prompt or Constant.CHAT_PERSONA_PROMPT,
+            "user_memory": results["user_memory"] or "",
+            "group_memory": (results["group_memory"] or "") if is_group else None,
+            "points": committed + pending if committed is not None else None,
+        }
 
     async def updateUserSystemPrompt(self, groupId: str, userId: str, prompt_instruction: str) -> str:
         cost = Constant.USER_SYSTEM_PROMPT_COST
 
-        current_points = await self.db.get_user_points(userId, groupId)
-        if current_points is None or current_points < cost:
+        # 余额检查与扣除在同一条语句中完成，并发设置不会扣成负数
+        if await points_ledger.debit(userId, groupId, cost) is None:
             return f"积分不足！设置系统提示词需要 {cost} 积分。"
 
-        if not await self.db.add_user_points(userId, groupId, -cost):
-            return "扣除积分失败，请稍后再试。"
-
         success = await self.db.set_user_system_prompt(userId, groupId, prompt_instruction)
         if not success:
-            return f"保存失败，但已扣除 {cost} 积分（请联系管理员）。"
+            await self.db.apply_points_delta(userId, groupId, cost, floor=None)
+            return f"保存失败，已退还 {cost} 积分，请稍后再试。"
 
-        cache_key = f"{Constant.REDIS_USER_SYSTEM_PROMPT_KEY}:{groupId}:{userId}"
+        cache_key = _get_system_prompt_key(groupId, userId)
         await _redis_client.setex(cache_key, 3600, prompt_instruction)
+        _system_prompt_cache.set((groupId, userId), prompt_instruction)
+        # 通知其他进程丢弃本地缓存
+        await _redis_client.publish(Constant.REDIS_SYSTEM_PROMPT_INVALIDATE_CHANNEL, f"{groupId}:{userId}")
 
         return f"个性化系统提示词已设置成功！已扣除 {cost} 积分。"
 
+    @staticmethod
     async def handle_help() -> str:
         """帮助信息是静态的，可保持同步，但为统一接口也声明为 async"""
         return Constant.HELP
\ No newline at end of file
@@ -0,0 +1,168 @@
+# supervisor.py
+"""
+多进程部署入口：python supervisor.py [--workers N]
+- 网关进程：维持与 QQ 的 WebSocket 连接，去重后把消息事件按会话写入 Redis 分片事件流，不做任何业务处理
+- N 个 worker 进程：通过 Redis 租约认领分片，各自运行完整的业务栈（命令、积分、对话 Agent），
+  直接调用 OpenAPI 回复；同一群 / 私聊用户的消息只由一个 worker 处理，进程内的会话锁与群聊合并依旧有效
+- 主进程只负责拉起子进程，子进程异常退出后自动重启
+单进程运行仍使用 python main.py
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import time
+import uuid
+
+RESTART_BACKOFF_SECONDS = 3
+
+
+def run_gateway():
+    import botpy
+    from botpy import logging, Intents
+    from botpy.ext.cog_yaml import read
+    from botpy.message import GroupMessage, C2CMessage
+
+    from service.shard_worker import publish_event
+    from utils.dedupe import message_deduper
+    from utils.metrics import start_metrics_server
+
+    _log = logging.get_logger()
+
+    class GatewayClient(botpy.Client):
+        """只负责收消息并写入事件流"""
+
+        async def on_ready(self):
+            _log.info(f"「{self.robot.name}」网关已上线，消息将分发给 worker 进程")
+            await start_metrics_server()
+
+        async def on_group_at_message_create(self, message: GroupMessage):
+            if not await message_deduper.first_seen(message.id):
+                _log.info(f"忽略重复投递的群消息 {message.id}")
+                return
+            await publish_event({
+                "kind": "group",
+                "gid": message.group_openid,
+                "uid": message.author.member_openid,
+                "msg_id": message.id,
+                "content": message.content or "",
+            })
+
+        async def on_c2c_message_create(self, message: C2CMessage):
+            if not await message_deduper.first_seen(message.id):
+                _log.info(f"忽略重复投递的私聊消息 {message.id}")
+                return
+            await publish_event({
+                "kind": "c2c",
+                "gid": "PRIVATE",
+                "uid": message.author.user_openid,
+                "msg_id": message.id,
+                "content": message.content or "",
+            })
+
+    config = read(os.path.join(os.path.dirname(__file__), "config.yaml"))
+    client = GatewayClient(intents=Intents(public_messages=True))
+    client.run(appid=config["appid"], secret=config["secret"])
+
+
+def run_worker(index: int, metrics_port: int):
+    # 网关使用 METRICS_PORT，worker 依次使用其后的端口；须在导入 Constant 之前设置
+    if metrics_port:
+        os.environ["METRICS_PORT"] = str(metrics_port + index + 1)
+    asyncio.run(_worker_main(index))
+
+
+async def _worker_main(index: int):
+    from botpy import logging
+    from botpy.api import BotAPI
+    from botpy.http import BotHttp
+
+    import main
+    from service.shard_worker import ShardWorker
+    from utils.metrics import span, start_metrics_server
+
+    _log = logging.get_logger()
+    api = BotAPI(http=BotHttp(timeout=5, app_id=main.config["appid"], secret=main.config["secret"]))
+
+    async def reply_group(group_openid: str, msg_id: str, content: str, msg_seq: int = 1):
+        with span("send"):
+            await api.post_group_message(
+                group_openid=group_openid, msg_id=msg_id, msg_type=0, content=content, msg_seq=msg_seq
+            )
+
+    async def reply_c2c(openid: str, msg_id: str, content: str, msg_seq: int = 1):
+        with span("send"):
+            await api.post_c2c_message(
+                openid=openid, msg_id=msg_id, msg_type=0, content=content, msg_seq=msg_seq
+            )
+
+    async def handle_event(event: dict):
+        gid, uid, msg_id = event["gid"], event["uid"], event["msg_id"]
+        _log.info(f"worker {index} 处理{'群' + gid if event['kind'] == 'group' else '私聊'}用户{uid}的消息：{event['content']}")
+        if event["kind"] == "group":
+            reply = lambda r, seq=1: reply_group(gid, msg_id, r, seq)
+        else:
+            reply = lambda r, seq=1: reply_c2c(uid, msg_id, r, seq)
+        await main.handle_user_message(gid, uid, event["content"], reply)
+
+    await start_metrics_server()
+    await main.chatService.warm_up()
+
+    worker = ShardWorker(f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:6]}", handle_event)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.stop)
+    _log.info(f"worker {index} 已启动")
+    try:
+        await worker.run()
+    finally:
+        await main.shutdown()
+
+
+def _spawn(ctx, target, args, name):
+    process = ctx.Process(target=target, args=args, name=name, daemon=False)
+    process.start()
+    return process
+
+
+def main():
+    from utils.constant import Constant
+
+    parser = argparse.ArgumentParser(description="网关 + 多 worker 进程部署")
+    parser.add_argument("--workers", type=int, default=Constant.SCALEOUT_WORKERS)
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    specs = {"gateway": (run_gateway, ())}
+    for i in range(args.workers):
+        specs[f"worker-{i}"] = (run_worker, (i, Constant.METRICS_PORT))
+    processes = {name: _spawn(ctx, target, a, name) for name, (target, a) in specs.items()}
+
+    stopping = False
+
+    def _shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, _shutdown)
+    signal.signal(signal.SIGTERM, _shutdown)
+
+    while not stopping:
+        time.sleep(1)
+        for name, process in processes.items():
+            if not process.is_alive() and not stopping:
+                print(f"[supervisor] {name} 退出（exitcode={process.exitcode}），{RESTART_BACKOFF_SECONDS} 秒后重启")
+                time.sleep(RESTART_BACKOFF_SECONDS)
+                target, a = specs[name]
+                processes[name] = _spawn(ctx, target, a, name)
+
+    for process in processes.values():
+        if process.is_alive():
+            process.terminate()
+    for process in processes.values():
+        process.join(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,25 @@
+# tests/conftest.py
+"""
+测试环境：共享 Redis 客户端换成进程内 fakeredis（须在导入任何业务模块之前完成），
+模型 API Key 使用占位值，测试中不会真正发起请求
+"""
+import os
+import sys
+
+import fakeredis
+from fakeredis.aioredis import FakeConnection
+from redis.asyncio import BlockingConnectionPool
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+os.environ.setdefault("METRICS_PORT", "0")
+
+from utils import redis_client  # noqa: E402
+
+redis_client._pool = BlockingConnectionPool(
+    connection_class=FakeConnection,
+    server=fakeredis.FakeServer(),
+    max_connections=8,
+    decode_responses=True,
+)
+redis_client._client = redis_client._InstrumentedRedis(connection_pool=redis_client._pool)
@@ -0,0 +1,33 @@
+# tests/test_admission.py
+import asyncio
+
+import pytest
+
+from utils.admission import KeyedLock, Overloaded
+
+
+def test_keyed_lock_admits_exactly_max_pending_waiters():
+    async def run():
+        lock = KeyedLock(max_pending=2)
+        release = asyncio.Event()
+
+        async def hold():
+            async with lock.hold("t"):
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(hold()) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert lock.stats()["waiting"] == 2
+
+        with pytest.raises(Overloaded):
+            async with lock.hold("t"):
+                pass
+        assert lock.rejected == 1
+
+        release.set()
+        await asyncio.gather(holder, *waiters)
+        assert lock.stats()["active_keys"] == 0
+
+    asyncio.run(run())
@@ -0,0 +1,78 @@
+# tests/test_hedged_model.py
+import asyncio
+from typing import Any, AsyncIterator, List, Optional
+
+from langchain.agents import create_agent
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from utils.constant import Constant
+from utils.hedged_model import HedgedChatModel, HedgeTracker
+
+
+class _DelayedChatModel(BaseChatModel):
+    """首个 chunk 前等待 delay 秒，之后逐字输出 reply"""
+
+    reply: str
+    delay: float
+
+    @property
+    def _llm_type(self) -> str:
+        return "delayed-fake"
+
+    def bind_tools(self, tools, **kwargs: Any) -> "_DelayedChatModel":
+        return self
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.reply))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.delay)
+        for char in self.reply:
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=char))
+            if run_manager:
+                await run_manager.on_llm_new_token(char, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(0.01)
+
+
+def _hedged(monkeypatch) -> HedgedChatModel:
+    monkeypatch.setattr(Constant, "CHAT_HEDGE_INITIAL_DELAY", 0.05)
+    names = ["slow", "fast"]
+    return HedgedChatModel(
+        models=[_DelayedChatModel(reply="慢模型的回复", delay=0.3), _DelayedChatModel(reply="快模型的回复", delay=0.0)],
+        model_names=names,
+        tracker=HedgeTracker(names),
+    )
+
+
+def test_agent_message_stream_only_carries_the_winner(monkeypatch):
+    agent = create_agent(model=_hedged(monkeypatch), tools=[])
+
+    async def run():
+        texts = []
+        async for chunk, metadata in agent.astream(
+            {"messages": [{"role": "user", "content": "你好"}]}, stream_mode="messages"
+        ):
+            if metadata.get("langgraph_node") == "model" and isinstance(chunk, AIMessageChunk):
+                texts.append(chunk.content)
+        return "".join(texts)
+
+    assert asyncio.run(run()) == "快模型的回复"
+
+
+def test_cancelled_calls_are_not_latency_samples(monkeypatch):
+    model = _hedged(monkeypatch)
+
+    async def run():
+        async for _ in model.astream("你好"):
+            pass
+
+    asyncio.run(run())
+    stats = model.tracker.stats()
+    assert stats["slow"]["cancelled"] == 1
+    assert len(model.tracker._stats["slow"].latencies) == 0
+    assert len(model.tracker._stats["fast"].latencies) == 1
@@ -0,0 +1,44 @@
+# tests/test_intent_router.py
+import pytest
+
+from service.intent_router import IntentRouter
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("签到", "checkin"),
+    ("我要签到～", "checkin"),
+    ("打卡", "checkin"),
+    ("我的积分", "points"),
+    ("查一下积分", "points"),
+    ("积分多少了", "points"),
+    ("我有多少积分", "points"),
+    ("我现在多少分了？", "points"),
+    ("排行榜", "leaderboard"),
+    ("积分榜", "leaderboard"),
+    ("我排第几", "leaderboard"),
+    ("帮助", "help"),
+    ("你能做什么", "help"),
+])
+def test_explicit_requests_are_fast_pathed(message, intent):
+    assert IntentRouter.classify(message) == intent
+
+
+@pytest.mark.parametrize("message", [
+    "扣积分",
+    "帮我扣积分",
+    "积分有什么用",
+    "现在几分了",
+    "几分了",
+    "刚才那局比赛几分",
+    "积分榜上那个人是谁",
+    "我不想签到",
+    "签到有什么用",
+    "今天签到了吗",
+    "别签到",
+    "第几集了",
+    "积分清零",
+    "给他加点积分",
+    "你好呀",
+])
+def test_near_misses_go_to_the_agent(message):
+    assert IntentRouter.classify(message) is None
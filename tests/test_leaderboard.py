@@ -0,0 +1,66 @@
+# tests/test_leaderboard.py
+import asyncio
+import uuid
+
+from mapper.leaderboard import Leaderboard
+
+
+class _FakeDatabase:
+    def __init__(self, points: dict):
+        self.points = points  # (group_id, user_id) -> points
+        self.scans = 0
+        self.on_batch = None
+
+    async def iter_user_points(self, group_id=None, batch_size=1000):
+        self.scans += 1
+        rows = [(g, u, p) for (g, u), p in sorted(self.points.items()) if group_id in (None, g)]
+        for i in range(0, len(rows), 2):
+            yield rows[i:i + 2]
+            if self.on_batch:
+                await self.on_batch()
+
+    async def get_user_points(self, user_id, group_id):
+        return self.points.get((group_id, user_id))
+
+
+def test_changes_during_rebuild_survive_the_rename():
+    group = f"g{uuid.uuid4().hex[:6]}"
+    db = _FakeDatabase({(group, f"u{i}"): 10 * i for i in range(6)})
+    board = Leaderboard()
+
+    async def change():
+        # MySQL 已提交后再同步排行榜，与 Database.apply_points_delta 的顺序一致
+        db.on_batch = None
+        db.points[(group, "u0")] += 100
+        await board.incr("u0", group, 100)
+        db.points[(group, "u5")] += 7
+        await board.incr("u5", group, 7)
+
+    async def run():
+        db.on_batch = change
+        await board.rebuild(db, group)
+        return await board.top(db, group, 10)
+
+    top = dict(asyncio.run(run()))
+    assert top["u0"] == 100
+    assert top["u5"] == 57
+    assert db.scans == 1
+
+
+def test_empty_group_is_not_rebuilt_on_every_read():
+    group = f"g{uuid.uuid4().hex[:6]}"
+    db = _FakeDatabase({})
+    board = Leaderboard()
+
+    async def run():
+        assert await board.top(db, group) == []
+        assert await board.top(db, group) == []
+        assert db.scans == 1
+
+        # 有了积分之后空标记失效，下次读取重建
+        db.points[(group, "u1")] = 5
+        await board.incr("u1", group, 5)
+        return await board.top(db, group)
+
+    assert asyncio.run(run()) == [("u1", 5)]
+    assert db.scans == 2
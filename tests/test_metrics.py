@@ -0,0 +1,25 @@
+# tests/test_metrics.py
+import re
+
+from service.intent_router import IntentRouter
+from utils.metrics import registry
+
+
+def _series(text: str) -> list:
+    return [line.split(" ")[0] for line in text.splitlines() if line and not line.startswith("#")]
+
+
+def test_new_instances_do_not_duplicate_series():
+    IntentRouter(user_service=None)
+    IntentRouter(user_service=None)
+    series = _series(registry.render())
+    assert len(series) == len(set(series))
+    assert series.count("qqbot_intent_router_total_total") == 0
+    assert series.count("qqbot_intent_router_total") == 1
+
+
+def test_counters_end_with_total():
+    text = registry.render()
+    counters = re.findall(r"^# TYPE (\S+) counter$", text, re.M)
+    assert counters
+    assert [name for name in counters if not name.endswith("_total")] == []
@@ -0,0 +1,160 @@
+# tests/test_points_ledger.py
+import asyncio
+
+from mapper.points_ledger import PointsLedger
+from utils.constant import Constant
+from utils.redis_client import get_redis
+
+
+class _FakeDatabase:
+    """按 entry_id 去重的内存版 apply_points_ledger"""
+
+    def __init__(self):
+        self.points = {}
+        self.entry_ids = set()
+
+    async def ensure_points_ledger_table(self):
+        pass
+
+    async def get_user_points(self, user_id: str, group_id: str):
+        return self.points.get((user_id, group_id), 0)
+
+    async def apply_points_delta(self, user_id: str, group_id: str, delta: int, floor: int | None = 0):
+        points = self.points.get((user_id, group_id))
+        if points is None or (floor is not None and points + delta < floor):
+            return None
+        self.points[(user_id, group_id)] = points + delta
+        return points + delta
+
+    async def apply_points_ledger(self, rows: list, flush_id: str) -> int:
+        inserted = 0
+        for entry_id, user_id, group_id, delta, reason, created_at in rows:
+            if entry_id in self.entry_ids:
+                continue
+            self.entry_ids.add(entry_id)
+            self.points[(user_id, group_id)] = self.points.get((user_id, group_id), 0) + delta
+            inserted += 1
+        return inserted
+
+
+async def _reset():
+    await get_redis().delete(Constant.REDIS_POINTS_LEDGER_KEY, Constant.REDIS_POINTS_PENDING_KEY,
+                             Constant.REDIS_POINTS_LEDGER_LOCK_KEY, Constant.REDIS_POINTS_LEDGER_COMMITTING_KEY)
+
+
+def test_flush_after_crash_does_not_credit_twice(monkeypatch):
+    async def run():
+        await _reset()
+        db = _FakeDatabase()
+        ledger = PointsLedger(db)
+        monkeypatch.setattr(ledger, "start", lambda: None)
+        monkeypatch.setattr("mapper.points_ledger.leaderboard.incr", _noop)
+        await ledger.credit("u1", "g1", 5)
+        await ledger.credit("u1", "g1", 3)
+
+        # MySQL 提交后、裁剪前失败
+        finish = ledger._finish_flush
+
+        async def crash(**kwargs):
+            raise ConnectionError("redis down")
+
+        ledger._finish_flush = crash
+        try:
+            await ledger.flush()
+        except ConnectionError:
+            pass
+        ledger._finish_flush = finish
+
+        assert await ledger.flush() == 2
+        assert db.points[("u1", "g1")] == 8
+        assert await ledger.balance("u1", "g1") == 8
+        assert await get_redis().llen(Constant.REDIS_POINTS_LEDGER_KEY) == 0
+
+    asyncio.run(run())
+
+
+def test_flush_does_not_trim_after_losing_lock(monkeypatch):
+    async def run():
+        await _reset()
+        db = _FakeDatabase()
+        ledger = PointsLedger(db)
+        monkeypatch.setattr(ledger, "start", lambda: None)
+        monkeypatch.setattr("mapper.points_ledger.leaderboard.incr", _noop)
+        await ledger.credit("u1", "g1", 5)
+
+        # 刷盘期间锁过期并被其他进程取得
+        apply = db.apply_points_ledger
+
+        async def slow_apply(rows, flush_id):
+            await get_redis().set(Constant.REDIS_POINTS_LEDGER_LOCK_KEY, "other")
+            await ledger.credit("u1", "g1", 2)
+            return await apply(rows, flush_id)
+
+        db.apply_points_ledger = slow_apply
+        assert await ledger.flush() == 0
+        assert await get_redis().llen(Constant.REDIS_POINTS_LEDGER_KEY) == 2
+
+        db.apply_points_ledger = apply
+        await get_redis().delete(Constant.REDIS_POINTS_LEDGER_LOCK_KEY)
+        assert await ledger.flush() == 2
+        assert db.points[("u1", "g1")] == 7
+        assert await ledger.balance("u1", "g1") == 7
+
+    asyncio.run(run())
+
+
+def test_credit_balance_not_double_counted_when_flush_lands_between_reads(monkeypatch):
+    async def run():
+        await _reset()
+        db = _FakeDatabase()
+        ledger = PointsLedger(db)
+        monkeypatch.setattr(ledger, "start", lambda: None)
+        monkeypatch.setattr("mapper.points_ledger.leaderboard.incr", _noop)
+        await ledger.credit("u1", "g1", 5)
+
+        # 记账之后、读取 MySQL 之前，另一次刷盘把两笔流水都落盘并裁剪
+        get_user_points = db.get_user_points
+
+        async def flush_then_read(user_id, group_id):
+            db.get_user_points = get_user_points
+            await ledger.flush()
+            return await get_user_points(user_id, group_id)
+
+        db.get_user_points = flush_then_read
+        assert await ledger.credit("u1", "g1", 3) == 8
+        assert await ledger.balance("u1", "g1") == 8
+
+    asyncio.run(run())
+
+
+def test_debit_waits_for_flush_held_by_another_process(monkeypatch):
+    async def run():
+        await _reset()
+        db = _FakeDatabase()
+        db.points[("u1", "g1")] = 0
+        ledger = PointsLedger(db)
+        monkeypatch.setattr(ledger, "start", lambda: None)
+        monkeypatch.setattr("mapper.points_ledger.leaderboard.incr", _noop)
+        await ledger.credit("u1", "g1", 10)
+
+        # 另一个进程持有刷盘锁，稍后释放
+        await get_redis().set(Constant.REDIS_POINTS_LEDGER_LOCK_KEY, "other")
+
+        async def release():
+            await asyncio.sleep(0.2)
+            await get_redis().delete(Constant.REDIS_POINTS_LEDGER_LOCK_KEY)
+
+        releaser = asyncio.create_task(release())
+        assert await ledger.debit("u1", "g1", 4) == 6
+        await releaser
+        assert db.points[("u1", "g1")] == 6
+        assert await ledger.pending("u1", "g1") == 0
+
+        # 余额确实不足时仍返回 None
+        assert await ledger.debit("u1", "g1", 7) is None
+
+    asyncio.run(run())
+
+
+async def _noop(*args, **kwargs):
+    pass
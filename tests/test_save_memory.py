@@ -0,0 +1,69 @@
+# tests/test_save_memory.py
+import asyncio
+import json
+
+from service.agentUtils.saveMemory import SaveMemory, _get_user_temp_key
+from utils.circuit_breaker import OPEN, summary_breaker
+from utils.constant import Constant
+from utils.redis_client import get_redis
+
+
+def test_temp_memory_is_capped_while_summary_breaker_open(monkeypatch):
+    async def run():
+        key = _get_user_temp_key("g1", "u1")
+        await get_redis().delete(key)
+        monkeypatch.setattr(Constant, "MAX_TEMP_MEMORY_MESSAGES", 6)
+        monkeypatch.setattr(summary_breaker, "state", OPEN)
+        memory = SaveMemory()
+
+        for i in range(10):
+            await memory.save(groupId="g1", userId="u1", userMessage=f"问{i}", agentMessage=f"答{i}")
+
+        items = [json.loads(item) for item in await get_redis().lrange(key, 0, -1)]
+        # 只保留最新的消息
+        assert [m["content"] for m in items] == ["问7", "答7", "问8", "答8", "问9", "答9"]
+
+    asyncio.run(run())
+
+
+def test_requeue_keeps_newest_messages(monkeypatch):
+    async def run():
+        key = _get_user_temp_key("g1", "u2")
+        await get_redis().delete(key)
+        monkeypatch.setattr(Constant, "MAX_TEMP_MEMORY_MESSAGES", 4)
+        memory = SaveMemory()
+        await get_redis().rpush(key, *memory._dump([{"role": "user", "content": "新1"},
+                                                   {"role": "user", "content": "新2"}]))
+
+        # 摘要失败的旧消息放回列表头部，超出上限时丢弃最旧的
+        await memory._requeue(key, [{"role": "user", "content": f"旧{i}"} for i in range(4)])
+
+        items = [json.loads(item) for item in await get_redis().lrange(key, 0, -1)]
+        assert [m["content"] for m in items] == ["旧2", "旧3", "新1", "新2"]
+
+    asyncio.run(run())
+
+
+def test_close_requeues_unfinished_summaries(monkeypatch):
+    async def run():
+        key = _get_user_temp_key("g1", "u3")
+        await get_redis().delete(key)
+        memory = SaveMemory()
+        started = asyncio.Event()
+
+        async def slow_summary(messages):
+            started.set()
+            await asyncio.sleep(60)
+
+        # 一个执行中、一个合并后待执行（同一 key），另有新消息已写入临时记忆
+        memory.summary_scheduler.submit(key, slow_summary, [{"role": "user", "content": "1"}])
+        await started.wait()
+        memory.summary_scheduler.submit(key, slow_summary, [{"role": "user", "content": "2"}])
+        await get_redis().rpush(key, *memory._dump([{"role": "user", "content": "3"}]))
+
+        await memory.close(timeout=0.1)
+
+        items = [json.loads(item) for item in await get_redis().lrange(key, 0, -1)]
+        assert [m["content"] for m in items] == ["1", "2", "3"]
+
+    asyncio.run(run())
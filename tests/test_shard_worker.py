@@ -0,0 +1,61 @@
+# tests/test_shard_worker.py
+import asyncio
+import uuid
+
+from service.shard_worker import ShardWorker, publish_event
+from utils.constant import Constant
+
+
+def test_handoff_never_runs_a_conversation_on_two_workers(monkeypatch):
+    run_id = uuid.uuid4().hex[:8]
+    monkeypatch.setattr(Constant, "REDIS_SCALEOUT_STREAM_KEY", f"test:{run_id}:events")
+    monkeypatch.setattr(Constant, "REDIS_SCALEOUT_LEASE_KEY", f"test:{run_id}:shard")
+    monkeypatch.setattr(Constant, "REDIS_SCALEOUT_WORKERS_KEY", f"test:{run_id}:workers")
+    monkeypatch.setattr(Constant, "SCALEOUT_LEASE_RENEW_INTERVAL", 0.2)
+    monkeypatch.setattr(Constant, "SCALEOUT_READ_BLOCK_MS", 100)
+
+    running = {}  # gid -> 正在处理该群消息的 worker
+    overlaps = []
+    handled = []
+
+    def handler(name):
+        async def handle(event: dict):
+            gid = event["gid"]
+            if running.get(gid) not in (None, name):
+                overlaps.append(gid)
+            running[gid] = name
+            await asyncio.sleep(0.02)
+            running.pop(gid, None)
+            handled.append(event["msg_id"])
+        return handle
+
+    async def publish(start: int, count: int):
+        for i in range(start, start + count):
+            await publish_event({"kind": "group", "gid": f"g{i % 10}", "uid": "u", "msg_id": str(i), "content": ""})
+
+    async def run():
+        # 并发名额远小于一轮读取的条数：大量消息已读出但还在等待名额时发生交还
+        first = ShardWorker("w1", handler("w1"), concurrency=2)
+        first_task = asyncio.create_task(first.run())
+        await asyncio.sleep(0.1)
+        await publish(0, 200)
+        await asyncio.sleep(0.1)
+
+        second = ShardWorker("w2", handler("w2"), concurrency=2)
+        second_task = asyncio.create_task(second.run())
+        await publish(200, 100)
+        for _ in range(200):
+            if len(handled) >= 300:
+                break
+            await asyncio.sleep(0.05)
+
+        first.stop()
+        second.stop()
+        await asyncio.gather(first_task, second_task)
+        return first.stats(), second.stats()
+
+    first_stats, second_stats = asyncio.run(run())
+    assert overlaps == []
+    assert sorted(handled, key=int) == [str(i) for i in range(300)]
+    assert first_stats["shards_released"] > 0
+    assert second_stats["handled"] > 0
@@ -0,0 +1,44 @@
+# tests/test_user_service.py
+import asyncio
+
+import pytest
+
+from service import user_service
+from service.user_service import UserService
+from utils.redis_client import get_redis
+
+
+class _FakeDatabase:
+    async def get_user_points(self, user_id: str, group_id: str):
+        return 10
+
+    async def get_user_system_prompt(self, user_id: str, group_id: str):
+        return None
+
+
+@pytest.fixture(autouse=True)
+def _no_invalidation_listener(monkeypatch):
+    monkeypatch.setattr(user_service, "start_system_prompt_invalidation", lambda: None)
+
+
+@pytest.mark.parametrize("group_id", ["PRIVATE", "private"])
+def test_private_prefetch_never_includes_group_memory(group_id):
+    async def run():
+        redis = get_redis()
+        # SaveMemory 把所有私聊摘要写在占位群号下
+        await redis.set(user_service._get_group_long_key(group_id), "其他用户的私聊摘要")
+        await redis.set(user_service._get_user_long_key(group_id, "u1"), "u1 的画像")
+        return await UserService(_FakeDatabase()).prefetch_chat_context(group_id, "u1")
+
+    context = asyncio.run(run())
+    assert context["group_memory"] is None
+    assert context["user_memory"] == "u1 的画像"
+    assert context["points"] == 10
+
+
+def test_group_prefetch_includes_group_memory():
+    async def run():
+        await get_redis().set(user_service._get_group_long_key("g1"), "群摘要")
+        return await UserService(_FakeDatabase()).prefetch_chat_context("g1", "u1")
+
+    assert asyncio.run(run())["group_memory"] == "群摘要"
@@ -0,0 +1,114 @@
+# utils/admission.py
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+
+
+class Overloaded(Exception):
+    """排队已满，请求被直接拒绝（调用方应快速降级回复）"""
+
+
+class KeyedLock:
+    """
+    按 key 串行化的异步锁（如按 thread_id 串行执行同一会话的请求）
+    - 没有持有者和等待者的 key 会被立即回收，不会无限增长
+    - max_pending: 每个 key 允许的最大排队数（不含持有者），超过则抛出 Overloaded
+    """
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self._locks = {}  # key -> [asyncio.Lock, 持有者 + 等待者数量]
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def hold(self, key):
+        """获取 key 对应的锁，返回排队等待秒数"""
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        elif entry[1] - 1 >= self.max_pending:  # 计数含持有者，排队数为 entry[1] - 1
+            self.rejected += 1
+            raise Overloaded(f"too many pending requests for {key}")
+
+        entry[1] += 1
+        start = time.perf_counter()
+        try:
+            async with entry[0]:
+                yield time.perf_counter() - start
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[key]
+
+    def stats(self) -> dict:
+        return {
+            "active_keys": len(self._locks),
+            "waiting": sum(max(count - 1, 0) for _, count in self._locks.values()),
+            "rejected": self.rejected,
+        }
+
+
+class AdmissionGate:
+    """
+    全局准入控制：限制同时进行的调用数（信号量）
+    - limit: 最大并发数
+    - max_waiting: 最大排队数，超过则立即抛出 Overloaded；None 表示不限制（只排队不拒绝）
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int | None = None):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self._sem = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def admit(self):
+        """进入准入区，返回排队等待秒数"""
+        if self.max_waiting is not None and self._sem.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded(f"{self.name} admission queue is full")
+
+        self.waiting += 1
+        start = time.perf_counter()
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        waited = time.perf_counter() - start
+
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            yield waited
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+# 进程内共享：聊天与摘要的 LLM 调用分别限流，互不挤占
+chat_gate = AdmissionGate("chat", Constant.CHAT_MAX_CONCURRENCY, Constant.CHAT_MAX_WAITING)
+summary_gate = AdmissionGate("summary", Constant.SUMMARY_MAX_CONCURRENCY)
+
+
+def _collect_gate_metrics():
+    for gate in (chat_gate, summary_gate):
+        yield from stats_samples("qqbot_admission", gate.stats(), {"gate": gate.name}, counters=("admitted", "rejected"))
+
+
+registry.register_collector(_collect_gate_metrics)
@@ -0,0 +1,194 @@
+# utils/circuit_breaker.py
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable
+
+from botpy import logging
+
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+
+_log = logging.get_logger()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """熔断器处于打开状态，调用被直接拒绝（调用方应快速降级）"""
+
+
+class CircuitBreaker:
+    """
+    模型调用熔断器
+    - 统计最近 window 次调用，失败或耗时超过 slow_call_seconds 都记为失败；
+      至少 min_calls 次且失败率达到 failure_rate 时打开
+    - 打开期间调用直接抛出 CircuitOpen；open_seconds 后进入半开状态：
+      设置了 probe 时由熔断器自己发一次探测请求，否则放行少量真实请求试探
+    - 试探成功则关闭，失败则重新打开，等待时间翻倍（不超过 max_open_seconds）
+    """
+
+    def __init__(
+            self,
+            name: str,
+            slow_call_seconds: float,
+            window: int = Constant.BREAKER_WINDOW,
+            min_calls: int = Constant.BREAKER_MIN_CALLS,
+            failure_rate: float = Constant.BREAKER_FAILURE_RATE,
+            open_seconds: float = Constant.BREAKER_OPEN_SECONDS,
+            max_open_seconds: float = Constant.BREAKER_MAX_OPEN_SECONDS,
+            half_open_max_calls: int = 1,
+    ):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.half_open_max_calls = half_open_max_calls
+        # 半开时的主动探测，如 lambda: llm.ainvoke("你好", max_tokens=1)
+        self.probe: Callable[[], Awaitable] | None = None
+
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # True 表示失败（异常或慢调用）
+        self._open_for = open_seconds
+        self._half_open_calls = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._probe_task: asyncio.Task | None = None
+
+        self.calls = 0
+        self.failures = 0
+        self.slow_calls = 0
+        self.rejected = 0
+        self.opened = 0
+
+    @property
+    def is_closed(self) -> bool:
+        return self.state == CLOSED
+
+    def _set_state(self, state: str, reason: str = ""):
+        if state == self.state:
+            return
+        _log.warning(f"熔断器 {self.name}: {self.state} → {state} {reason}".rstrip())
+        self.state = state
+
+    def _open(self, reason: str):
+        self.opened += 1
+        self._set_state(OPEN, reason)
+        self._half_open_calls = 0
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(self._open_for, self._enter_half_open)
+
+    def _reopen(self, reason: str):
+        self._open_for = min(self._open_for * 2, self.max_open_seconds)
+        self._open(f"{reason}，{self._open_for:.0f}s 后再次试探")
+
+    def _close(self):
+        self._set_state(CLOSED, "试探成功")
+        self._outcomes.clear()
+        self._open_for = self.open_seconds
+        self._half_open_calls = 0
+
+    def _enter_half_open(self):
+        self._timer = None
+        self._set_state(HALF_OPEN)
+        if self.probe is not None:
+            self._probe_task = asyncio.create_task(self._run_probe())
+
+    async def _run_probe(self):
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(self.probe(), timeout=self.slow_call_seconds)
+        except Exception as e:
+            self._reopen(f"探测失败: {e!r}")
+            return
+        self._close()
+        _log.info(f"熔断器 {self.name} 探测耗时 {time.perf_counter() - start:.2f}s")
+
+    def check(self):
+        """快速检查是否放行（在排队之前调用，避免打开期间的请求占用并发名额）"""
+        if self.state == OPEN or (self.state == HALF_OPEN and self.probe is not None):
+            self.rejected += 1
+            raise CircuitOpen(f"{self.name} circuit is {self.state}")
+
+    @asynccontextmanager
+    async def call(self):
+        """包裹一次模型调用并记录结果：async with breaker.call(): await llm.ainvoke(...)"""
+        self.check()
+        trial = self.state == HALF_OPEN
+        if trial:
+            if self._half_open_calls >= self.half_open_max_calls:
+                self.rejected += 1
+                raise CircuitOpen(f"{self.name} circuit is {self.state}")
+            self._half_open_calls += 1
+
+        self.calls += 1
+        start = time.perf_counter()
+        failed = None  # None 表示调用被取消，不计入统计
+        try:
+            yield
+            elapsed = time.perf_counter() - start
+            failed = elapsed > self.slow_call_seconds
+            if failed:
+                self.slow_calls += 1
+        except CircuitOpen:
+            raise
+        except Exception:
+            failed = True
+            self.failures += 1
+            raise
+        finally:
+            self._record(failed, trial)
+
+    def _record(self, failed: bool | None, trial: bool):
+        if trial:
+            self._half_open_calls -= 1
+            if self.state != HALF_OPEN or failed is None:
+                return
+            if failed:
+                self._reopen("试探请求失败")
+            else:
+                self._close()
+            return
+
+        if self.state != CLOSED or failed is None:
+            return
+        self._outcomes.append(failed)
+        if len(self._outcomes) >= self.min_calls:
+            rate = sum(self._outcomes) / len(self._outcomes)
+            if rate >= self.failure_rate:
+                self._open(f"最近 {len(self._outcomes)} 次调用失败率 {rate:.0%}")
+
+    def stats(self) -> dict:
+        recent = len(self._outcomes)
+        return {
+            "state": self.state,
+            "state_value": _STATE_VALUES[self.state],
+            "recent_failure_rate": sum(self._outcomes) / recent if recent else 0.0,
+            "calls": self.calls,
+            "failures": self.failures,
+            "slow_calls": self.slow_calls,
+            "rejected": self.rejected,
+            "opened": self.opened,
+        }
+
+
+# 进程内共享：对话模型与摘要模型分别熔断
+chat_breaker = CircuitBreaker("chat", Constant.CHAT_BREAKER_SLOW_SECONDS)
+summary_breaker = CircuitBreaker("summary", Constant.SUMMARY_BREAKER_SLOW_SECONDS)
+
+
+def _collect_breaker_metrics():
+    for breaker in (chat_breaker, summary_breaker):
+        yield from stats_samples(
+            "qqbot_circuit_breaker", breaker.stats(), {"breaker": breaker.name},
+            counters=("calls", "failures", "slow_calls", "rejected", "opened"),
+        )
+
+
+registry.register_collector(_collect_breaker_metrics)
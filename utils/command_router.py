@@ -0,0 +1,75 @@
+# utils/command_router.py
+from typing import Awaitable, Callable, Dict, List, Tuple
+
+# 指令处理函数：handler(group_id, user_id, args) -> 回复内容
+CommandHandler = Callable[[str, str, str], Awaitable[str]]
+
+
+class _Route:
+    __slots__ = ("handler", "takes_args")
+
+    def __init__(self, handler: CommandHandler, takes_args: bool):
+        self.handler = handler
+        self.takes_args = takes_args
+
+
+class CommandRouter:
+    """
+    指令路由：消息只做一次规范化，再按开头的指令关键字查表分发
+    - 以 "/" 开头的指令按关键字查字典（按已注册的关键字长度取前缀），
+      支持 "/设置用户画像 内容" 与 "/设置用户画像内容" 两种写法
+    - 不带 "/" 的别名（如“帮助”）只做整句精确匹配
+    - 普通聊天消息只需一次字典查找 + 首字符判断即可确定不是指令
+    """
+
+    def __init__(self):
+        self._prefixed: Dict[str, _Route] = {}
+        self._exact: Dict[str, _Route] = {}
+        self._lengths: List[int] = []  # 已注册 "/" 指令的关键字长度（从长到短）
+        self._exact_max_len = 0  # 别名最大长度，更长的消息无需查别名表
+
+    def register(self, keyword: str, handler: CommandHandler, takes_args: bool = False):
+        """注册指令；takes_args=True 时关键字后的内容作为参数传给 handler"""
+        key = keyword.strip().casefold()
+        route = _Route(handler, takes_args)
+        if key.startswith("/"):
+            self._prefixed[key] = route
+            self._lengths = sorted({len(k) for k in self._prefixed}, reverse=True)
+        else:
+            if takes_args:
+                raise ValueError(f"alias without '/' cannot take arguments: {keyword}")
+            self._exact[key] = route
+            self._exact_max_len = max(self._exact_max_len, len(key))
+
+    def command(self, *keywords: str, takes_args: bool = False):
+        """装饰器形式注册：@router.command("/签到")"""
+
+        def decorator(handler: CommandHandler) -> CommandHandler:
+            for keyword in keywords:
+                self.register(keyword, handler, takes_args)
+            return handler
+
+        return decorator
+
+    def match(self, message: str) -> Tuple[CommandHandler, str] | None:
+        """匹配指令，返回 (handler, 参数)；不是指令时返回 None"""
+        text = message.strip()
+
+        if len(text) <= self._exact_max_len:
+            route = self._exact.get(text.casefold())
+            if route is not None:
+                return route.handler, ""
+
+        if not text.startswith("/"):
+            return None
+
+        for length in self._lengths:
+            route = self._prefixed.get(text[:length].casefold())
+            if route is None:
+                continue
+            args = text[length:].strip()
+            if route.takes_args:
+                return route.handler, args
+            # 无参数指令要求整句匹配，如 "/签到 一下" 交给 AI 处理
+            return (route.handler, "") if not args else None
+        return None
@@ -13,10 +13,23 @@ class Constant:
 
     # DashScope API 配置
     DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
-    DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
 
     # Redis 连接
     REDIS_CONN_STRING = os.getenv("REDIS_CONN_STRING", "redis://localhost:6379")
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "32"))  # 每个进程的 Redis 连接上限
+    REDIS_POOL_TIMEOUT = 5  # 连接池耗尽时等待空闲连接的秒数
+    REDIS_HEALTH_CHECK_INTERVAL = 30  # 连接空闲超过该秒数后，使用前先 PING
+
+    # Prometheus 指标端点（端口为 0 时不启动）
+    METRICS_HOST = os.getenv("METRICS_HOST", "0.0.0.0")
+    METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+    # MySQL 连接池（进程内所有 Database 实例共享）
+    MYSQL_POOL_MINSIZE = int(os.getenv("MYSQL_POOL_MINSIZE", "2"))
+    MYSQL_POOL_MAXSIZE = int(os.getenv("MYSQL_POOL_MAXSIZE", "20"))
+    MYSQL_POOL_RECYCLE = 3600  # 连接空闲超过该秒数后回收重建，-1 为不回收
+    MYSQL_POOL_PING_IDLE = 60  # 连接空闲超过该秒数，借出前先 ping 检查，-1 为不检查
 
     # Redis 键前缀
     REDIS_TEMP_USER_MEMORY_KEY = "memory:user:temp"
@@ -24,18 +37,172 @@ class Constant:
     REDIS_USER_MEMORY_KEY = "memory:user:long"
     REDIS_GROUP_MEMORY_KEY = "memory:group:long"
     REDIS_USER_SYSTEM_PROMPT_KEY = "memory:user:system_prompt"
+    REDIS_SYSTEM_PROMPT_INVALIDATE_CHANNEL = "memory:user:system_prompt:invalidate"  # 提示词失效通知频道
+    REDIS_POINTS_LEDGER_KEY = "points:ledger"  # 待刷盘的积分流水（列表）
+    REDIS_POINTS_PENDING_KEY = "points:pending"  # 待刷盘积分累计（哈希，字段为 "group_id:user_id"）
+    REDIS_POINTS_LEDGER_LOCK_KEY = "points:ledger:flush_lock"
+    REDIS_POINTS_LEDGER_COMMITTING_KEY = "points:ledger:committing"  # 刷盘正在提交 MySQL（提交后到裁剪前）
+    REDIS_POINTS_LEDGER_GEN_KEY = "points:ledger:gen"  # 刷盘代数，每次裁剪完成后递增
+    REDIS_POINTS_RANK_KEY = "points:rank"  # 群积分排行榜（有序集合）前缀，后接 group_id
+    REDIS_KNOWN_USERS_KEY = "user:known"  # 已初始化用户集合，成员为 "group_id:user_id"
+    REDIS_MESSAGE_SEEN_KEY = "msg:seen"  # 已处理的平台消息 ID 前缀，后接 message.id
+    REDIS_RATE_LIMIT_KEY = "ratelimit"  # 令牌桶（哈希）前缀
+    REDIS_SCALEOUT_STREAM_KEY = "bot:events"  # 多进程模式下各分片的事件流前缀，后接分片号
+    REDIS_SCALEOUT_LEASE_KEY = "bot:shard"  # 分片租约前缀，后接分片号，值为持有者 worker_id
+    REDIS_SCALEOUT_WORKERS_KEY = "bot:workers"  # 存活 worker 心跳（有序集合，分数为毫秒时间戳）
+
+    # 系统提示词进程内缓存（Redis 前的一级缓存）
+    SYSTEM_PROMPT_CACHE_SIZE = 10_000
+    SYSTEM_PROMPT_CACHE_TTL = 300  # 秒；跨进程失效依赖 Redis 发布订阅，TTL 只是兜底
+    SYSTEM_PROMPT_NEGATIVE_TTL = 600  # 没有自定义提示词时，Redis 中空值标记的存活秒数
+
+    # 已初始化用户缓存（init_user 命中后不再写 MySQL）
+    KNOWN_USER_CACHE_SIZE = 100_000
+    KNOWN_USER_REDIS_ENABLED = True
+
+    # 入站消息去重：网关重连 / 恢复会话后可能重复投递同一条消息
+    MESSAGE_DEDUPE_TTL = 600  # 秒；消息 ID 的记忆时长
+    MESSAGE_DEDUPE_CACHE_SIZE = 20_000
+
+    # 令牌桶限流：(桶容量, 每秒补充令牌数)，None 表示该级不限；AI 对话与指令分别配置
+    RATE_LIMITS = {
+        "chat": {
+            "user": (5, 0.1),  # 每人可连发 5 条，之后每 10 秒 1 条
+            "group": (20, 0.5),
+            "global": (60, 10),  # 按模型服务的 QPS 配额设置
+        },
+        "command": {
+            "user": (10, 1),
+            "group": (60, 5),
+            "global": None,
+        },
+    }
+    RATE_LIMIT_NOTICE_INTERVAL = 30  # 同一用户超限后，该秒数内只提示一次
+    RATE_LIMIT_NOTICE_CACHE_SIZE = 10_000
+    RATE_LIMIT_REPLIES = {
+        "user": "你说得太快啦，言小糯有点跟不上～ 稍微歇一会儿再来找我吧 (〃＞＿＜;〃)",
+        "group": "群里大家太热情啦，言小糯忙不过来了，稍等一下下哦～ (｡•́︿•̀｡)",
+        "global": "呜呜，找言小糯的人太多啦，稍等一下再来找我好不好～ (｡•́︿•̀｡)",
+    }
 
     # 消息数量阈值（触发摘要到长期记忆）
     MAX_USER_MESSAGE_COUNT = 40
     MAX_GROUP_MESSAGE_COUNT = 100
+    # 临时记忆列表最多保留的消息数（摘要模型熔断期间不断累积时只保留最新的）
+    MAX_TEMP_MEMORY_MESSAGES = 400
+
+    # 并发控制：同一会话串行处理，聊天 / 摘要 LLM 调用分别限流
+    CHAT_MAX_CONCURRENCY = 16  # 同时进行的聊天智能体调用数
+    CHAT_MAX_WAITING = 64  # 聊天准入排队上限，超过后直接返回繁忙回复
+    CHAT_MAX_PENDING_PER_THREAD = 3  # 同一会话（thread_id）最多排队的请求数
+    SUMMARY_MAX_CONCURRENCY = 4  # 同时进行的摘要 / 画像更新 LLM 调用数
+    CHAT_ERROR_REPLY = "抱歉，系统出错了。"
+    CHAT_BUSY_REPLY = "呜呜，找言小糯的人太多啦，稍等一下再来找我好不好～ (｡•́︿•̀｡)"
+
+    # 模型熔断：最近 BREAKER_WINDOW 次调用中失败（含慢调用）比例达到阈值时打开，期间直接降级回复
+    BREAKER_WINDOW = 20
+    BREAKER_MIN_CALLS = 5
+    BREAKER_FAILURE_RATE = 0.5
+    BREAKER_OPEN_SECONDS = 30  # 打开后多久进入半开试探，试探失败则翻倍
+    BREAKER_MAX_OPEN_SECONDS = 300
+    CHAT_BREAKER_SLOW_SECONDS = 30  # 单次对话模型调用（不含工具与 checkpointer）超过该秒数记为慢调用
+    SUMMARY_BREAKER_SLOW_SECONDS = 60
+    CHAT_DEGRADED_REPLY = "呜…言小糯的小脑袋暂时转不动啦，先休息一下，过一会儿再来找我聊天吧～ (｡•́︿•̀｡)\n签到、查积分等指令还可以正常使用哦！"
+
+    # 后台摘要调度
+    SUMMARY_WORKERS = 2  # 同时执行的摘要任务数
+    SUMMARY_MAX_RETRIES = 3
+    SUMMARY_RETRY_BASE_DELAY = 2.0  # 重试退避基数（秒），第 n 次重试等待 base * 2^(n-1)
+    SUMMARY_SHUTDOWN_TIMEOUT = 20  # 进程退出时等待摘要完成的秒数，未完成的消息放回临时记忆列表
 
     # 模型配置
-    CHAT_MODEL_NAME = "deepseek-v3.2" # 备选 qwen-plus
+    CHAT_MODEL_NAME = "deepseek-v3.2"
+    # 对话模型按优先级排列：主模型慢于对冲阈值时同时请求下一个，出错时切换到下一个
+    CHAT_MODEL_NAMES = os.getenv("CHAT_MODEL_NAMES", f"{CHAT_MODEL_NAME},qwen-plus").split(",")
     SUMMARY_MODEL_NAME = "qwen-flash"
 
+    # 对冲请求：阈值取该模型最近耗时的分位数，样本不足时使用初始值
+    CHAT_HEDGE_ENABLED = True
+    CHAT_HEDGE_QUANTILE = 0.95
+    CHAT_HEDGE_INITIAL_DELAY = 4.0
+    CHAT_HEDGE_MIN_DELAY = 1.0
+    CHAT_HEDGE_MAX_DELAY = 10.0
+    CHAT_HEDGE_MIN_SAMPLES = 20
+    CHAT_HEDGE_WINDOW = 200  # 每个模型保留的最近耗时样本数
+    CHAT_HEDGE_MAX_RETRIES = 1  # 多模型时单个模型的 SDK 重试次数，失败尽快切换到下一个模型
+
     CHAT_TEMPERATURE = 1.0
     CHAT_MAX_TOKENS = 100
 
+    # 上下文预取：对话前并发读取系统提示词、用户/群组长期记忆与积分并注入系统提示，
+    # 省去智能体调用 queryUserLongMemory 等工具的额外模型往返
+    CHAT_CONTEXT_PREFETCH_ENABLED = False
+    CHAT_CONTEXT_MAX_CHARS = 1200  # 注入的长期记忆总字数上限（用户画像优先）
+
+    # 意图快速路由：明确的签到/查分/排行/帮助请求在调用智能体前直接处理，不经过 LLM
+    INTENT_ROUTER_ENABLED = True
+    INTENT_LLM_CALLS_SAVED = 2  # 智能体处理这类请求需要的模型调用数（调用工具 + 组织回复）
+    # 快速路由的回复模板（{result} 为处理结果），按意图随机选择一条，保持言小糯的语气
+    INTENT_REPLY_TEMPLATES = {
+        "checkin": [
+            "{result}\n今天也元气满满呀～ (๑•̀ㅂ•́)و✧",
+            "{result}\n明天也要记得来找我签到呐～ (｡･ω･｡)ﾉ",
+        ],
+        "points": [
+            "帮你查好啦～\n{result} (๑>ᴗ<๑)",
+            "{result}\n继续加油攒积分呀～ ٩(ˊᗜˋ*)و",
+        ],
+        "leaderboard": [
+            "{result}\n冲鸭，向榜首进发～ ( •̀ ω •́ )✧",
+            "最新排行榜来啦～\n{result}",
+        ],
+        "help": [
+            "{result}\n有什么想做的直接告诉我就好啦～ (｡･ω･｡)",
+        ],
+    }
+
+    # 模型 HTTP 连接池（所有模型客户端共享）
+    LLM_HTTP2_ENABLED = True  # 需安装 h2，未安装时自动退回 HTTP/1.1
+    LLM_HTTP_MAX_CONNECTIONS = 50
+    LLM_HTTP_MAX_KEEPALIVE = 20
+    LLM_HTTP_KEEPALIVE_EXPIRY = 60  # 空闲长连接保留秒数
+    LLM_HTTP_CONNECT_TIMEOUT = 5
+    LLM_HTTP_READ_TIMEOUT = 60
+    LLM_HTTP_POOL_TIMEOUT = 10  # 连接池耗尽时等待空闲连接的秒数
+
+    # 群聊突发合并：同一群在窗口内收到的多条 @ 消息合并为一次智能体调用（0 表示关闭）
+    GROUP_BURST_WINDOW_MS = 0  # 从窗口内第一条消息起算，即单条消息最多额外等待的毫秒数
+    GROUP_BURST_MAX_MESSAGES = 5  # 攒满该条数立即处理，不再等待窗口结束
+    GROUP_BURST_PROMPT = (
+        "【多人发言】本轮是群里多位用户几乎同时发来的消息，每条以 [#序号|用户ID:xxx] 开头。\n"
+        "请逐条回复，每条回复单独成段，并以对应的 [#序号] 开头，例如：\n"
+        "[#1] 对第 1 条消息的回复\n"
+        "[#2] 对第 2 条消息的回复\n"
+        "不要遗漏任何一条，也不要在 [#序号] 之外添加其他内容；调用工具时使用该条消息对应的用户ID。"
+    )
+
+    # 多进程模式（supervisor.py）：网关进程把消息按群 / 私聊用户哈希到分片事件流，
+    # 各 worker 通过 Redis 租约认领分片，每个会话只由一个 worker 处理
+    SCALEOUT_WORKERS = int(os.getenv("SCALEOUT_WORKERS", str(os.cpu_count() or 1)))  # worker 进程数
+    SCALEOUT_SHARDS = 32  # 分片数，应明显大于 worker 数以便均衡
+    SCALEOUT_CONSUMER_GROUP = "workers"
+    SCALEOUT_LEASE_TTL_MS = 15_000  # 租约有效期；worker 失联超过该时间后分片由其他 worker 接管
+    SCALEOUT_LEASE_RENEW_INTERVAL = 5  # 秒；续约、心跳与再均衡的周期
+    SCALEOUT_WORKER_CONCURRENCY = 64  # 单个 worker 同时处理的消息数
+    SCALEOUT_READ_COUNT = 32
+    SCALEOUT_READ_BLOCK_MS = 1000
+    SCALEOUT_STREAM_MAXLEN = 10_000  # 每个分片事件流保留的近似条数
+
+    # 启动预热时发送一次极短的模型请求，提前建立到模型服务的 HTTP 长连接
+    CHAT_WARMUP_LLM_ENABLED = True
+
+    # 流式回复：首个完整句子就绪即发送，其余按批发送
+    CHAT_STREAMING_ENABLED = False
+    STREAM_FIRST_SEGMENT_MIN_CHARS = 6  # 首条消息的最少字数
+    STREAM_BATCH_MIN_CHARS = 60  # 后续每批的最少字数
+    STREAM_BATCH_INTERVAL = 1.5  # 距上次发送超过该秒数时不再等待凑够字数
+    STREAM_MAX_MESSAGES = 5  # 单条消息的被动回复次数上限（msg_seq 1..N）
+
     SUMMARY_TEMPERATURE = 0.6
     SUMMARY_MAX_TOKENS = 100
 
@@ -51,6 +218,19 @@ class Constant:
         30: 150,
     }
 
+    # 积分流水写后刷盘
+    POINTS_LEDGER_FLUSH_INTERVAL_MS = 500
+    POINTS_LEDGER_FLUSH_SIZE = 200  # 单批最多刷盘条数，积累到该数量时立即刷盘
+    POINTS_LEDGER_LOCK_TTL_MS = 10_000  # 刷盘锁超时，防止进程崩溃后锁无法释放
+    POINTS_LEDGER_RETRY_INTERVAL_MS = 50  # 读余额遇到刷盘提交、扣分等待刷盘锁时的重试间隔
+    POINTS_LEDGER_READ_RETRIES = 5  # 读余额时遇到刷盘提交的最大重试次数
+
+    # 积分排行榜
+    LEADERBOARD_TOP_N = 10
+    LEADERBOARD_TTL = 86400  # 排行榜过期后下次读取时从 MySQL 重建，修正可能的增量偏差
+    LEADERBOARD_REBUILD_BATCH_SIZE = 1000
+    LEADERBOARD_REBUILD_LOCK_TTL_MS = 30_000
+
     USER_SYSTEM_PROMPT_COST = 50  # 设置个性化系统提示词的积分消耗，负数则为增加
 
     # 角色设定：定义 AI 的性格、语气、身份
@@ -71,6 +251,7 @@ class Constant:
         "• queryUserLongMemory：用户明确提及‘我’的兴趣/背景，或需个性化回复时（如‘记得我喜欢什么吗？’）\n"
         "• queryGroupLongMemory：群聊中需回顾群历史/主题（如‘咱们群之前聊过啥？’），私聊禁用\n"
         "• queryUserPoints：用户询问‘积分’‘多少分’‘points’等\n"
+        "• queryLeaderboard：用户询问‘排行榜’‘排名’‘第几名’等\n"
         "• doCheckin：用户发送‘签到’或类似指令\n"
         "• showHelp：用户请求‘帮助’‘help’‘菜单’等\n"
         "• addUserPoints / deductUserPoints：增加和减少积分，由你控制\n"
@@ -106,7 +287,9 @@ class Constant:
         "/签到\n"
         "—— 每日打卡领积分！\n"
         "/查询积分\n"
-        "—— 查看你的积分、累计/连续签到天数 \n\n"
+        "—— 查看你的积分、累计/连续签到天数 \n"
+        "/排行榜\n"
+        "—— 查看本群积分排行和你的名次\n\n"
         "🎨 用户画像管理：\n"
         "/查询用户画像\n"
         "—— 看看我记得关于你的哪些小秘密～\n"
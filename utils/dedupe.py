@@ -0,0 +1,63 @@
+# utils/dedupe.py
+from botpy import logging
+
+from utils.cache import LRUCache
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+from utils.redis_client import get_redis
+
+_log = logging.get_logger()
+
+
+class MessageDeduper:
+    """
+    入站消息幂等：按平台 message.id 去重
+    - 进程内 LRU 挡住同一进程收到的重复投递，无需访问 Redis
+    - Redis SET NX EX 在多个进程之间去重；Redis 不可用时只依赖本地缓存，不阻断消息处理
+    """
+
+    def __init__(self, ttl: int = Constant.MESSAGE_DEDUPE_TTL, maxsize: int = Constant.MESSAGE_DEDUPE_CACHE_SIZE):
+        self.ttl = ttl
+        self._seen = LRUCache(maxsize, ttl=ttl)
+        self._redis = get_redis()
+        self.checked = 0
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    async def first_seen(self, msg_id: str) -> bool:
+        """首次收到该消息返回 True；重复投递返回 False"""
+        if not msg_id:
+            return True
+        self.checked += 1
+        if self._seen.get(msg_id) is not None:
+            self.local_hits += 1
+            return False
+        self._seen.set(msg_id, True)
+
+        try:
+            claimed = await self._redis.set(f"{Constant.REDIS_MESSAGE_SEEN_KEY}:{msg_id}", 1, nx=True, ex=self.ttl)
+        except Exception as e:
+            self.redis_errors += 1
+            _log.warning(f"消息去重访问 Redis 失败，仅按本地缓存去重: {e}")
+            return True
+        if not claimed:
+            self.redis_hits += 1
+            return False
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "checked": self.checked,
+            "duplicates": self.local_hits + self.redis_hits,
+            "local_hits": self.local_hits,
+            "redis_hits": self.redis_hits,
+            "redis_errors": self.redis_errors,
+        }
+
+
+# 进程内共享的入站消息去重器
+message_deduper = MessageDeduper()
+registry.register_collector(lambda: stats_samples(
+    "qqbot_message_dedupe", message_deduper.stats(), counters=("checked", "duplicates", "local_hits", "redis_hits", "redis_errors"),
+))
@@ -0,0 +1,238 @@
+# utils/hedged_model.py
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
+
+from botpy import logging
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableConfig
+from langgraph.constants import TAG_NOSTREAM
+
+from utils.constant import Constant
+from utils.metrics import counter_name, registry
+
+_log = logging.get_logger()
+
+
+class _ModelStats:
+    __slots__ = ("latencies", "calls", "wins", "errors", "hedged", "cancelled")
+
+    def __init__(self, window: int):
+        self.latencies = deque(maxlen=window)  # 最近的响应耗时（秒），只含胜出的调用
+        self.calls = 0
+        self.wins = 0
+        self.errors = 0
+        self.hedged = 0  # 因超过阈值而触发对冲的次数
+        self.cancelled = 0
+
+
+class HedgeTracker:
+    """按模型记录耗时与胜出次数，并给出自适应的对冲阈值（最近耗时的分位数）"""
+
+    def __init__(self, model_names: Sequence[str], window: int = Constant.CHAT_HEDGE_WINDOW):
+        self._stats: Dict[str, _ModelStats] = {name: _ModelStats(window) for name in model_names}
+        registry.register_collector(self._collect, name="hedge_tracker")
+
+    def record(self, name: str, elapsed: float, outcome: str):
+        """
+        outcome: win / error / cancelled
+        只有胜出的耗时计入样本：被取消的调用耗时只是下限，计入会把阈值越拉越低、对冲越来越频繁
+        """
+        stats = self._stats[name]
+        stats.calls += 1
+        if outcome == "error":
+            stats.errors += 1
+        elif outcome == "cancelled":
+            stats.cancelled += 1
+        else:
+            stats.wins += 1
+            stats.latencies.append(elapsed)
+
+    def hedged(self, name: str):
+        self._stats[name].hedged += 1
+
+    def threshold(self, name: str) -> float:
+        """该模型未响应多久后发出对冲请求"""
+        latencies = self._stats[name].latencies
+        if len(latencies) < Constant.CHAT_HEDGE_MIN_SAMPLES:
+            return Constant.CHAT_HEDGE_INITIAL_DELAY
+        ordered = sorted(latencies)
+        value = ordered[min(len(ordered) - 1, int(len(ordered) * Constant.CHAT_HEDGE_QUANTILE))]
+        return min(max(value, Constant.CHAT_HEDGE_MIN_DELAY), Constant.CHAT_HEDGE_MAX_DELAY)
+
+    def stats(self) -> dict:
+        result = {}
+        for name, stats in self._stats.items():
+            ordered = sorted(stats.latencies)
+            result[name] = {
+                "calls": stats.calls,
+                "wins": stats.wins,
+                "errors": stats.errors,
+                "hedged": stats.hedged,
+                "cancelled": stats.cancelled,
+                "p50_seconds": ordered[len(ordered) // 2] if ordered else 0.0,
+                "hedge_threshold_seconds": self.threshold(name),
+            }
+        return result
+
+    def _collect(self):
+        for name, stats in self.stats().items():
+            labels = {"model": name}
+            for field in ("calls", "wins", "errors", "hedged", "cancelled"):
+                yield counter_name(f"qqbot_chat_model_{field}"), "counter", f"对话模型 {field}", labels, stats[field]
+            for field in ("p50_seconds", "hedge_threshold_seconds"):
+                yield f"qqbot_chat_model_{field}", "gauge", f"对话模型 {field}", labels, stats[field]
+
+
+class HedgedChatModel(BaseChatModel):
+    """
+    按顺序排列的多个对话模型：主模型超过自适应阈值（最近耗时的 p95）仍未响应时，
+    把同一请求发给下一个模型，先完成者胜出并取消其余请求；出错时立即切换到下一个模型
+    - 流式调用以首个 chunk 为准决定胜者，之后只转发胜者的输出（记录的耗时为首个 chunk 的耗时）
+    - bind_tools 会对每个模型分别绑定，统计在绑定前后共享
+    - 内部各模型的调用标记为 nostream：LangGraph 的 messages 流只收到本模型转发的胜者输出，
+      不会混入落败模型的 chunk
+    """
+
+    models: List[Any]  # BaseChatModel 或其 bind_tools 后的 Runnable
+    model_names: List[str]
+    tracker: Any
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-chat"
+
+    def bind_tools(self, tools: Sequence[Any], **kwargs: Any) -> "HedgedChatModel":
+        return HedgedChatModel(
+            models=[model.bind_tools(tools, **kwargs) for model in self.models],
+            model_names=self.model_names,
+            tracker=self.tracker,
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Optional[CallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        # 仅为满足接口，项目中只使用异步调用；同步调用不做对冲，按顺序失败切换
+        error = None
+        config = self._inner_config(run_manager)
+        for index, model in enumerate(self.models):
+            start = time.perf_counter()
+            try:
+                message = model.invoke(messages, config, stop=stop, **kwargs)
+            except Exception as e:
+                self.tracker.record(self.model_names[index], time.perf_counter() - start, "error")
+                error = e
+                continue
+            self.tracker.record(self.model_names[index], time.perf_counter() - start, "win")
+            return ChatResult(generations=[ChatGeneration(message=message)])
+        raise error
+
+    async def _race(self, start_call):
+        """
+        依次启动各模型的调用，返回 (胜出模型序号, 结果, 其余仍在进行的任务)
+        start_call(index) 返回一个 awaitable，完成即表示该模型已响应
+        """
+        pending: Dict[asyncio.Task, tuple] = {}
+        next_index = 0
+        last_error = None
+
+        def launch():
+            nonlocal next_index
+            task = asyncio.ensure_future(start_call(next_index))
+            pending[task] = (next_index, time.perf_counter())
+            next_index += 1
+
+        launch()
+        try:
+            while pending:
+                timeout = None
+                if next_index < len(self.models):
+                    timeout = self.tracker.threshold(self.model_names[next_index - 1])
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # 当前模型超过阈值仍未响应：对冲到下一个模型
+                    self.tracker.hedged(self.model_names[next_index - 1])
+                    _log.info(f"模型 {self.model_names[next_index - 1]} 超过 {timeout:.2f}s 未响应，"
+                              f"对冲请求 {self.model_names[next_index]}")
+                    launch()
+                    continue
+
+                for task in done:
+                    index, started = pending.pop(task)
+                    elapsed = time.perf_counter() - started
+                    if task.exception() is None:
+                        self.tracker.record(self.model_names[index], elapsed, "win")
+                        return index, task.result(), pending
+                    last_error = task.exception()
+                    self.tracker.record(self.model_names[index], elapsed, "error")
+                    _log.warning(f"模型 {self.model_names[index]} 调用失败: {last_error!r}")
+
+                # 出错时立即切换到下一个模型
+                if next_index < len(self.models):
+                    launch()
+            raise last_error
+        except BaseException:
+            await self._cancel(pending)
+            raise
+
+    async def _cancel(self, pending: Dict[asyncio.Task, tuple]):
+        for task, (index, started) in pending.items():
+            task.cancel()
+            self.tracker.record(self.model_names[index], time.perf_counter() - started, "cancelled")
+        await asyncio.gather(*pending, return_exceptions=True)
+        pending.clear()
+
+    @staticmethod
+    def _inner_config(run_manager: CallbackManagerForLLMRun | AsyncCallbackManagerForLLMRun | None) -> RunnableConfig:
+        """内部调用挂在本次调用之下，且不进入 LangGraph 的 messages 流"""
+        return {
+            "callbacks": run_manager.get_child() if run_manager else None,
+            "tags": [TAG_NOSTREAM],
+        }
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Optional[AsyncCallbackManagerForLLMRun] = None, **kwargs: Any) -> ChatResult:
+        config = self._inner_config(run_manager)
+        index, message, losers = await self._race(
+            lambda i: self.models[i].ainvoke(messages, config, stop=stop, **kwargs)
+        )
+        await self._cancel(losers)
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+                       **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        streams = {}
+        config = self._inner_config(run_manager)
+
+        async def first_chunk(i: int):
+            stream = streams[i] = self.models[i].astream(messages, config, stop=stop, **kwargs)
+            try:
+                return await stream.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        try:
+            index, chunk, losers = await self._race(first_chunk)
+            await self._cancel(losers)
+            for i, stream in streams.items():
+                if i != index:
+                    await stream.aclose()
+
+            stream = streams[index]
+            while chunk is not None:
+                generation = ChatGenerationChunk(message=chunk)
+                if run_manager:
+                    await run_manager.on_llm_new_token(generation.text, chunk=generation)
+                yield generation
+                try:
+                    chunk = await stream.__anext__()
+                except StopAsyncIteration:
+                    chunk = None
+        finally:
+            for stream in streams.values():
+                await stream.aclose()
@@ -0,0 +1,118 @@
+# utils/llm_factory.py
+import importlib.util
+from typing import List
+
+import httpx
+from langchain_core.language_models import BaseChatModel
+from langchain_openai import ChatOpenAI
+
+from utils.constant import Constant
+from utils.hedged_model import HedgeTracker, HedgedChatModel
+from utils.metrics import llm_usage_callback, registry, stats_samples
+
+# 安装了 h2 时启用 HTTP/2：多个并发请求复用同一条连接
+_HTTP2 = Constant.LLM_HTTP2_ENABLED and importlib.util.find_spec("h2") is not None
+
+_TIMEOUT = httpx.Timeout(
+    Constant.LLM_HTTP_READ_TIMEOUT,
+    connect=Constant.LLM_HTTP_CONNECT_TIMEOUT,
+    pool=Constant.LLM_HTTP_POOL_TIMEOUT,
+)
+
+
+class _HttpStats:
+    """通过 httpcore 的 trace 事件统计新建连接数，其余请求即复用了已有连接"""
+
+    def __init__(self):
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.http2_responses = 0
+        self.errors = 0
+
+    async def _trace(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+
+    async def on_request(self, request: httpx.Request):
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def on_response(self, response: httpx.Response):
+        if response.http_version == "HTTP/2":
+            self.http2_responses += 1
+        if response.status_code >= 500:
+            self.errors += 1
+
+
+_stats = _HttpStats()
+
+# 所有模型客户端共享的 HTTP 连接池：TLS 握手与长连接在对话、摘要、画像更新之间复用
+_http_client = httpx.AsyncClient(
+    http2=_HTTP2,
+    timeout=_TIMEOUT,
+    limits=httpx.Limits(
+        max_connections=Constant.LLM_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=Constant.LLM_HTTP_MAX_KEEPALIVE,
+        keepalive_expiry=Constant.LLM_HTTP_KEEPALIVE_EXPIRY,
+    ),
+    event_hooks={"request": [_stats.on_request], "response": [_stats.on_response]},
+)
+
+
+def create_chat_model(model: str, temperature: float, max_tokens: int, **kwargs) -> ChatOpenAI:
+    """创建使用共享 HTTP 连接池的模型客户端（自动挂载 token 用量统计）"""
+    return ChatOpenAI(
+        model=model,
+        api_key=Constant.DASHSCOPE_API_KEY,
+        base_url=Constant.DASHSCOPE_BASE_URL,
+        temperature=temperature,
+        max_tokens=max_tokens,
+        http_async_client=_http_client,
+        # OpenAI SDK 会用自己的默认超时覆盖 httpx 客户端的设置，这里显式传入
+        timeout=_TIMEOUT,
+        callbacks=[llm_usage_callback],
+        **kwargs,
+    )
+
+
+def create_hedged_chat_model(model_names: List[str], temperature: float, max_tokens: int) -> BaseChatModel:
+    """按顺序组合多个对话模型（对冲 + 失败切换）；只有一个模型或关闭对冲时返回普通模型"""
+    model_names = [name.strip() for name in model_names if name.strip()]
+    if len(model_names) == 1 or not Constant.CHAT_HEDGE_ENABLED:
+        return create_chat_model(model_names[0], temperature, max_tokens)
+    return HedgedChatModel(
+        models=[
+            create_chat_model(name, temperature, max_tokens, max_retries=Constant.CHAT_HEDGE_MAX_RETRIES)
+            for name in model_names
+        ],
+        model_names=model_names,
+        tracker=HedgeTracker(model_names),
+    )
+
+
+def llm_http_stats() -> dict:
+    """模型 HTTP 连接池的请求数、新建连接数与复用率"""
+    requests = _stats.requests
+    return {
+        "http2": _HTTP2,
+        "requests": requests,
+        "connections_opened": _stats.connections_opened,
+        "tls_handshakes": _stats.tls_handshakes,
+        "reused": max(requests - _stats.connections_opened, 0),
+        "reuse_ratio": (1 - _stats.connections_opened / requests) if requests else 0.0,
+        "http2_responses": _stats.http2_responses,
+        "server_errors": _stats.errors,
+    }
+
+
+async def close_llm_http_client():
+    await _http_client.aclose()
+
+
+registry.register_collector(lambda: stats_samples(
+    "qqbot_llm_http", llm_http_stats(),
+    counters=("requests", "connections_opened", "tls_handshakes", "reused", "http2_responses", "server_errors"),
+))
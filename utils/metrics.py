@@ -0,0 +1,287 @@
+# utils/metrics.py
+import time
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, Iterable, Tuple
+
+from aiohttp import web
+from botpy import logging
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.outputs import LLMResult
+
+from utils.constant import Constant
+
+_log = logging.get_logger()
+
+_DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+
+    def _key(self, labels: Dict[str, str]) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    @abstractmethod
+    def samples(self) -> Iterable[Tuple[str, Dict[str, str], float]]:
+        """(样本名, 标签, 值)"""
+
+
+class Counter(_Metric):
+    type = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Gauge(_Metric):
+    type = "gauge"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[tuple, float] = {}
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def samples(self):
+        for key, value in self._values.items():
+            yield self.name, dict(zip(self.labelnames, key)), value
+
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, *args, buckets: Tuple[float, ...] = _DEFAULT_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[tuple, list] = {}  # key -> [各桶计数, 总和, 总数]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[0][i] += 1
+        series[1] += value
+        series[2] += 1
+
+    def samples(self):
+        for key, (counts, total, count) in self._series.items():
+            labels = dict(zip(self.labelnames, key))
+            for bound, bucket_count in zip(self.buckets, counts):
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, bucket_count
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, count
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, count
+
+
+# 采集函数返回 [(指标名, 类型, 说明, 标签, 值), ...]，在渲染时调用，用于导出已有对象上的统计
+Collector = Callable[[], Iterable[Tuple[str, str, str, Dict[str, str], float]]]
+
+
+def counter_name(name: str) -> str:
+    """Prometheus 约定计数器以 _total 结尾"""
+    return name if name.endswith("_total") else f"{name}_total"
+
+
+def stats_samples(prefix: str, stats: dict, labels: Dict[str, str] = None, counters: Iterable[str] = ()):
+    """
+    把 stats() 返回的数值字典转为采集结果：counters 中的字段按计数器导出（名称补上 _total 后缀），
+    其余按仪表导出
+    """
+    labels = labels or {}
+    counters = set(counters)
+    for field, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        if field in counters:
+            yield counter_name(f"{prefix}_{field}"), "counter", f"{prefix} {field}", labels, value
+        else:
+            yield f"{prefix}_{field}", "gauge", f"{prefix} {field}", labels, value
+
+
+class MetricsRegistry:
+    """进程内指标注册表，按 Prometheus 文本格式导出"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._collectors: Dict[str, Collector] = {}
+
+    def _get_or_create(self, cls, name: str, help_text: str, labelnames: Tuple[str, ...], **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+        return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Tuple[str, ...] = ()) -> Gauge:
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name: str, help_text: str, labelnames: Tuple[str, ...] = (),
+                  buckets: Tuple[float, ...] = _DEFAULT_BUCKETS) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def register_collector(self, collector: Collector, name: str = None):
+        """
+        注册采集函数；同名的只保留最后注册的一个。
+        按实例注册的采集函数（如每个 ChatService 一个）须传 name，重复创建实例时不会导出重复的序列
+        """
+        self._collectors[name or f"anonymous:{id(collector)}"] = collector
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+
+        collected: Dict[str, list] = {}
+        for collector in self._collectors.values():
+            try:
+                for name, metric_type, help_text, labels, value in collector():
+                    collected.setdefault(name, [metric_type, help_text, []])[2].append((labels, value))
+            except Exception as e:
+                _log.warning(f"指标采集失败 {collector}: {e}")
+        for name, (metric_type, help_text, samples) in collected.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+stage_seconds = registry.histogram(
+    "qqbot_stage_seconds", "消息处理各阶段耗时（秒）", ("stage",)
+)
+tool_seconds = registry.histogram(
+    "qqbot_tool_seconds", "智能体工具调用耗时（秒）", ("tool",)
+)
+llm_tokens = registry.counter(
+    "qqbot_llm_tokens_total", "LLM token 用量", ("model", "kind")
+)
+llm_calls = registry.counter(
+    "qqbot_llm_calls_total", "LLM 调用次数", ("model",)
+)
+
+
+@contextmanager
+def span(stage: str):
+    """记录一个处理阶段的耗时：with span("init_user"): ..."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.observe(time.perf_counter() - start, stage=stage)
+
+
+def timed_tool(func):
+    """记录 @tool 异步函数的耗时，需放在 @tool 之下"""
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            tool_seconds.observe(time.perf_counter() - start, tool=func.__name__)
+
+    return wrapper
+
+
+class LLMUsageCallback(BaseCallbackHandler):
+    """统计每个模型的调用次数与 token 用量"""
+
+    def on_llm_end(self, response: LLMResult, **kwargs):
+        llm_output = response.llm_output or {}
+        model = llm_output.get("model_name")
+        usage = llm_output.get("token_usage") or {}
+        prompt_tokens = usage.get("prompt_tokens")
+        completion_tokens = usage.get("completion_tokens")
+
+        # 流式调用时用量在消息的 usage_metadata 中
+        if prompt_tokens is None:
+            for generations in response.generations:
+                for generation in generations:
+                    message = getattr(generation, "message", None)
+                    if message is None:
+                        continue
+                    model = model or message.response_metadata.get("model_name")
+                    if message.usage_metadata:
+                        prompt_tokens = (prompt_tokens or 0) + message.usage_metadata.get("input_tokens", 0)
+                        completion_tokens = (completion_tokens or 0) + message.usage_metadata.get("output_tokens", 0)
+
+        model = model or "unknown"
+        llm_calls.inc(model=model)
+        if prompt_tokens:
+            llm_tokens.inc(prompt_tokens, model=model, kind="prompt")
+        if completion_tokens:
+            llm_tokens.inc(completion_tokens, model=model, kind="completion")
+
+
+llm_usage_callback = LLMUsageCallback()
+
+
+async def _handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+
+_runner: web.AppRunner | None = None
+
+
+async def start_metrics_server(host: str = Constant.METRICS_HOST, port: int = Constant.METRICS_PORT):
+    """启动 /metrics HTTP 端点（port 为 0 时不启动，重复调用无副作用）"""
+    global _runner
+    if _runner is not None or not port:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle_metrics)
+    _runner = web.AppRunner(app)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    _log.info(f"指标端点已启动：http://{host}:{port}/metrics")
+
+
+async def stop_metrics_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
@@ -0,0 +1,133 @@
+# utils/rate_limiter.py
+from typing import Dict, List, Tuple
+
+from botpy import logging
+
+from utils.cache import LRUCache
+from utils.constant import Constant
+from utils.metrics import registry
+from utils.redis_client import get_redis
+
+_log = logging.get_logger()
+
+# 多级令牌桶：所有桶都有足够令牌时才一起扣减，任一不足则都不扣
+# KEYS: 各级桶；ARGV: cost, 然后每个桶依次为 capacity, 每秒补充令牌数
+# 返回 {0, 0} 表示放行，否则 {不足的桶序号（从 1 开始）, 需等待的毫秒数}
+# 使用 Redis 服务器时间，多个进程的时钟差异不影响计算
+_TOKEN_BUCKET_SCRIPT = """
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local cost = tonumber(ARGV[1])
+local tokens = {}
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    local state = redis.call('HMGET', KEYS[i], 'tokens', 'ts')
+    local current = tonumber(state[1])
+    local ts = tonumber(state[2])
+    if current == nil then
+        current = capacity
+        ts = now
+    end
+    current = math.min(capacity, current + math.max(0, now - ts) * rate / 1000)
+    if current < cost then
+        return {i, math.ceil((cost - current) * 1000 / rate)}
+    end
+    tokens[i] = current
+end
+for i = 1, #KEYS do
+    local capacity = tonumber(ARGV[2 * i])
+    local rate = tonumber(ARGV[2 * i + 1])
+    redis.call('HSET', KEYS[i], 'tokens', tostring(tokens[i] - cost), 'ts', now)
+    redis.call('PEXPIRE', KEYS[i], math.ceil(capacity * 1000 / rate) + 1000)
+end
+return {0, 0}
+"""
+
+_LEVELS = ("user", "group", "global")
+
+
+class RateLimiter:
+    """
+    基于 Redis 的多级令牌桶限流（用户 / 群 / 全局），所有进程共享同一组桶
+    - 每类消息（如 chat、command）的各级容量与补充速度独立配置，None 表示该级不限
+    - Redis 不可用时放行，不因限流组件故障而拒绝服务
+    - 超限回复预先生成，同一用户在 RATE_LIMIT_NOTICE_INTERVAL 内只提示一次，之后静默丢弃
+    """
+
+    def __init__(self, limits: Dict[str, Dict[str, Tuple[int, float] | None]] = Constant.RATE_LIMITS):
+        self.limits = limits
+        self._redis = get_redis()
+        self._script = self._redis.register_script(_TOKEN_BUCKET_SCRIPT)
+        self._notified = LRUCache(Constant.RATE_LIMIT_NOTICE_CACHE_SIZE, ttl=Constant.RATE_LIMIT_NOTICE_INTERVAL)
+        self.allowed: Dict[str, int] = {kind: 0 for kind in limits}
+        self.limited: Dict[Tuple[str, str], int] = {}
+        self.errors = 0
+
+    def _buckets(self, kind: str, group_id: str | None, user_id: str) -> Tuple[List[str], List, List[str]]:
+        prefix = f"{Constant.REDIS_RATE_LIMIT_KEY}:{kind}"
+        scopes = {
+            "user": f"{prefix}:user:{group_id or 'private'}:{user_id}",
+            "group": f"{prefix}:group:{group_id}" if group_id else None,
+            "global": f"{prefix}:global",
+        }
+        keys, args, levels = [], [], []
+        for level in _LEVELS:
+            limit = self.limits[kind].get(level)
+            if limit is None or scopes[level] is None:
+                continue
+            keys.append(scopes[level])
+            args.extend(limit)
+            levels.append(level)
+        return keys, args, levels
+
+    async def acquire(self, kind: str, group_id: str | None, user_id: str, cost: int = 1) -> str | None:
+        """
+        尝试消耗令牌
+        :param group_id: 私聊传 None（不计群级限额）
+        :return: 放行时返回 None，超限时返回触发限流的级别（user / group / global）
+        """
+        keys, args, levels = self._buckets(kind, group_id, user_id)
+        if not keys:
+            self.allowed[kind] += 1
+            return None
+        try:
+            index, _ = await self._script(keys=keys, args=[cost, *args])
+        except Exception as e:
+            self.errors += 1
+            _log.warning(f"限流检查失败，放行: {e}")
+            return None
+
+        if index == 0:
+            self.allowed[kind] += 1
+            return None
+        level = levels[index - 1]
+        self.limited[(kind, level)] = self.limited.get((kind, level), 0) + 1
+        return level
+
+    def limited_reply(self, level: str, group_id: str | None, user_id: str) -> str | None:
+        """超限提示；同一用户短时间内已提示过则返回 None（静默丢弃）"""
+        key = (group_id, user_id)
+        if self._notified.get(key) is not None:
+            return None
+        self._notified.set(key, True)
+        return Constant.RATE_LIMIT_REPLIES[level]
+
+    def stats(self) -> dict:
+        return {
+            "allowed": dict(self.allowed),
+            "limited": {f"{kind}:{level}": count for (kind, level), count in self.limited.items()},
+            "errors": self.errors,
+        }
+
+    def _collect(self):
+        for kind, count in self.allowed.items():
+            yield "qqbot_rate_limit_allowed_total", "counter", "限流放行次数", {"kind": kind}, count
+        for (kind, level), count in self.limited.items():
+            yield "qqbot_rate_limit_limited_total", "counter", "限流拒绝次数", {"kind": kind, "level": level}, count
+        yield "qqbot_rate_limit_errors_total", "counter", "限流检查失败（已放行）次数", {}, self.errors
+
+
+# 进程内共享的限流器
+rate_limiter = RateLimiter()
+registry.register_collector(rate_limiter._collect)
@@ -0,0 +1,132 @@
+# utils/redis_client.py
+import time
+from contextlib import asynccontextmanager
+from typing import List, Sequence
+
+from redis.asyncio import BlockingConnectionPool, Redis
+
+from utils.constant import Constant
+from utils.metrics import registry, stats_samples
+
+
+class _RedisStats:
+    """按命令名统计 Redis 调用次数与耗时（含等待连接池的时间）"""
+
+    def __init__(self):
+        self.commands = {}  # name -> [count, total_seconds, max_seconds, errors]
+
+    def record(self, name: str, elapsed: float, error: bool = False):
+        entry = self.commands.get(name)
+        if entry is None:
+            entry = self.commands[name] = [0, 0.0, 0.0, 0]
+        entry[0] += 1
+        entry[1] += elapsed
+        entry[2] = max(entry[2], elapsed)
+        if error:
+            entry[3] += 1
+
+
+_stats = _RedisStats()
+
+
+class _InstrumentedRedis(Redis):
+    """记录每条命令耗时的 Redis 客户端"""
+
+    async def execute_command(self, *args, **options):
+        start = time.perf_counter()
+        error = False
+        try:
+            return await super().execute_command(*args, **options)
+        except Exception:
+            error = True
+            raise
+        finally:
+            _stats.record(str(args[0]).upper(), time.perf_counter() - start, error)
+
+
+# 进程内唯一的 Redis 连接池：连接数有上限，耗尽时排队等待而不是继续新建连接
+# 统一 decode_responses=True，所有模块读到的都是 str
+_pool = BlockingConnectionPool.from_url(
+    Constant.REDIS_CONN_STRING,
+    max_connections=Constant.REDIS_MAX_CONNECTIONS,
+    timeout=Constant.REDIS_POOL_TIMEOUT,
+    health_check_interval=Constant.REDIS_HEALTH_CHECK_INTERVAL,
+    decode_responses=True,
+)
+_client = _InstrumentedRedis(connection_pool=_pool)
+
+
+def get_redis() -> Redis:
+    """获取共享 Redis 客户端（所有模块共用同一个连接池）"""
+    return _client
+
+
+@asynccontextmanager
+async def pipeline(transaction: bool = False):
+    """
+    批量发送命令，一次往返：
+        async with pipeline() as pipe:
+            pipe.get(a)
+            pipe.get(b)
+            va, vb = await pipe.execute()
+    transaction=True 时以 MULTI/EXEC 原子执行
+    """
+    start = time.perf_counter()
+    error = False
+    try:
+        async with _client.pipeline(transaction=transaction) as pipe:
+            yield pipe
+    except Exception:
+        error = True
+        raise
+    finally:
+        _stats.record("MULTI" if transaction else "PIPELINE", time.perf_counter() - start, error)
+
+
+async def batch(*commands: Sequence, transaction: bool = False) -> List:
+    """以管道执行多条原始命令，如 await batch(("GET", k1), ("HGET", k2, f))"""
+    async with pipeline(transaction=transaction) as pipe:
+        for command in commands:
+            pipe.execute_command(*command)
+        return await pipe.execute()
+
+
+def redis_stats() -> dict:
+    """连接池占用与各命令的调用次数、耗时"""
+    in_use = len(getattr(_pool, "_in_use_connections", ()))
+    idle = len(getattr(_pool, "_available_connections", ()))
+    return {
+        "pool": {
+            "max_connections": _pool.max_connections,
+            "in_use": in_use,
+            "idle": idle,
+        },
+        "commands": {
+            name: {
+                "count": count,
+                "total_seconds": total,
+                "avg_seconds": total / count if count else 0.0,
+                "max_seconds": max_seconds,
+                "errors": errors,
+            }
+            for name, (count, total, max_seconds, errors) in _stats.commands.items()
+        },
+    }
+
+
+async def close_redis():
+    """关闭共享连接池（应在应用退出时调用）"""
+    await _client.aclose()
+    await _pool.disconnect()
+
+
+def _collect_redis_metrics():
+    stats = redis_stats()
+    yield from stats_samples("qqbot_redis_pool", stats["pool"])
+    for name, entry in stats["commands"].items():
+        yield "qqbot_redis_commands_total", "counter", "Redis 命令调用次数", {"command": name}, entry["count"]
+        yield "qqbot_redis_command_seconds_total", "counter", "Redis 命令累计耗时（秒）", {"command": name}, entry["total_seconds"]
+        yield "qqbot_redis_command_errors_total", "counter", "Redis 命令失败次数", {"command": name}, entry["errors"]
+
+
+registry.register_collector(_collect_redis_metrics)
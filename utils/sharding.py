@@ -0,0 +1,150 @@
+# utils/sharding.py
+import math
+import time
+import zlib
+from typing import Dict, List, Set, Tuple
+
+from botpy import logging
+
+from utils.constant import Constant
+from utils.redis_client import get_redis, pipeline
+
+_log = logging.get_logger()
+
+# 续约仍归自己持有的租约，返回每个键是否续约成功
+_RENEW_SCRIPT = """
+local renewed = {}
+for i, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        redis.call('PEXPIRE', key, ARGV[2])
+        renewed[i] = 1
+    else
+        renewed[i] = 0
+    end
+end
+return renewed
+"""
+
+# 认领空闲分片：返回 0 表示已被他人持有，1 表示原租约过期（或从未有人持有），2 表示原持有者主动交还
+_ACQUIRE_SCRIPT = """
+if not redis.call('SET', KEYS[1], ARGV[1], 'NX', 'PX', ARGV[2]) then
+    return 0
+end
+if redis.call('DEL', KEYS[2]) == 1 then
+    return 2
+end
+return 1
+"""
+
+# 仅当租约仍归自己持有时才释放，并留下“已主动交还”标记
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    redis.call('DEL', KEYS[1])
+    redis.call('SET', KEYS[2], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+def shard_of(key: str, shards: int = Constant.SCALEOUT_SHARDS) -> int:
+    """会话键（group_openid / 私聊 user_openid）所属分片；跨进程稳定，不能用内置 hash()"""
+    return zlib.crc32(key.encode("utf-8")) % shards
+
+
+def stream_key(shard: int) -> str:
+    return f"{Constant.REDIS_SCALEOUT_STREAM_KEY}:{shard}"
+
+
+def lease_key(shard: int) -> str:
+    return f"{Constant.REDIS_SCALEOUT_LEASE_KEY}:{shard}"
+
+
+def handoff_key(shard: int) -> str:
+    return f"{Constant.REDIS_SCALEOUT_LEASE_KEY}:{shard}:released"
+
+
+class ShardLeaseManager:
+    """
+    基于 Redis 租约的分片归属
+    - 每个分片一个租约键（SET NX PX），持有者定期续约；进程退出或失联超过 TTL 后租约过期，由其他 worker 接管
+    - worker 通过心跳有序集合得知存活 worker 数，只认领 ceil(分片数 / 存活数) 个分片，
+      超出的分片交还，新 worker 加入后分片自动迁移
+    """
+
+    def __init__(self, worker_id: str, shards: int = Constant.SCALEOUT_SHARDS,
+                 ttl_ms: int = Constant.SCALEOUT_LEASE_TTL_MS):
+        self.worker_id = worker_id
+        self.shards = shards
+        self.ttl_ms = ttl_ms
+        self.owned: Set[int] = set()
+        self._redis = get_redis()
+        self._renew = self._redis.register_script(_RENEW_SCRIPT)
+        self._acquire = self._redis.register_script(_ACQUIRE_SCRIPT)
+        self._release = self._redis.register_script(_RELEASE_SCRIPT)
+        # 各 worker 从不同的分片开始尝试认领，减少争抢
+        self._offset = zlib.crc32(worker_id.encode("utf-8")) % shards
+
+    async def heartbeat(self) -> int:
+        """上报心跳并清理失联的 worker，返回存活 worker 数"""
+        now = int(time.time() * 1000)
+        async with pipeline() as pipe:
+            pipe.zadd(Constant.REDIS_SCALEOUT_WORKERS_KEY, {self.worker_id: now})
+            pipe.zremrangebyscore(Constant.REDIS_SCALEOUT_WORKERS_KEY, 0, now - self.ttl_ms)
+            pipe.zcard(Constant.REDIS_SCALEOUT_WORKERS_KEY)
+            _, _, live = await pipe.execute()
+        return max(live, 1)
+
+    async def renew(self) -> Set[int]:
+        """续约已持有的分片，返回已丢失（被判定失联后由他人接管）的分片"""
+        if not self.owned:
+            return set()
+        shards = sorted(self.owned)
+        renewed = await self._renew(keys=[lease_key(s) for s in shards], args=[self.worker_id, self.ttl_ms])
+        lost = {shard for shard, ok in zip(shards, renewed) if not ok}
+        if lost:
+            _log.warning(f"worker {self.worker_id} 丢失分片租约 {sorted(lost)}")
+        self.owned -= lost
+        return lost
+
+    async def acquire(self, limit: int) -> Dict[int, bool]:
+        """
+        尝试认领空闲分片，直到持有 limit 个
+        :return: {新认领的分片: 原租约是否过期}；主动交还的分片为 False，其上没有未确认的在途消息
+        """
+        acquired = {}
+        for i in range(self.shards):
+            if len(self.owned) >= limit:
+                break
+            shard = (self._offset + i) % self.shards
+            if shard in self.owned:
+                continue
+            result = await self._acquire(
+                keys=[lease_key(shard), handoff_key(shard)], args=[self.worker_id, self.ttl_ms]
+            )
+            if result:
+                self.owned.add(shard)
+                acquired[shard] = result == 1
+        return acquired
+
+    async def release(self, shard: int):
+        """主动交还分片（调用方须保证该分片已没有未确认的消息）"""
+        self.owned.discard(shard)
+        await self._release(keys=[lease_key(shard), handoff_key(shard)], args=[self.worker_id, self.ttl_ms])
+
+    async def release_all(self):
+        for shard in list(self.owned):
+            await self.release(shard)
+        await self._redis.zrem(Constant.REDIS_SCALEOUT_WORKERS_KEY, self.worker_id)
+
+    async def rebalance(self) -> Tuple[Dict[int, bool], Set[int], List[int]]:
+        """
+        心跳 + 续约 + 按公平份额认领
+        :return: ({新认领的分片: 原租约是否过期}, 丢失的分片, 超出公平份额、应交还的分片)
+        """
+        live = await self.heartbeat()
+        lost = await self.renew()
+        fair_share = math.ceil(self.shards / live)
+        acquired = await self.acquire(fair_share)
+        surplus = sorted(self.owned)[fair_share:]
+        return acquired, lost, surplus